@@ -9,8 +9,25 @@ The code below contains entrypoints for two Lambda functions (prefixed with `han
 
 import os
 import logging
+import bisect
+import fnmatch
+import functools
+import heapq
+import http.client
+import io
+import ipaddress
 import json
-import urllib.request
+import random
+import select
+import threading
+import time
+from collections import ChainMap, OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from urllib.request import Request
 import re
 import boto3
 
@@ -18,65 +35,743 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+SLACK_FORWARDER_MAX_WORKERS = int(os.getenv("SLACK_FORWARDER_MAX_WORKERS", "4"))
+EVENT_TRANSFORMER_MAX_WORKERS = int(os.getenv("EVENT_TRANSFORMER_MAX_WORKERS", "4"))
+SLACK_FORWARDER_COALESCE = os.getenv("SLACK_FORWARDER_COALESCE", "false") == "true"
+
+# BEGIN shared transport (assets/shared/slack.py)
+SLACK_CONNECT_TIMEOUT_SECONDS = float(os.getenv("SLACK_CONNECT_TIMEOUT_SECONDS", "2"))
+SLACK_READ_TIMEOUT_SECONDS = float(os.getenv("SLACK_READ_TIMEOUT_SECONDS", "4"))
+
+
+class LatencyHistogram:
+    """Counts of request latencies in fixed millisecond buckets."""
+
+    BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, seconds * 1000)] += 1
+
+    def __str__(self):
+        labels = [f"<={bucket}ms" for bucket in self.BUCKETS_MS]
+        labels.append(f">{self.BUCKETS_MS[-1]}ms")
+        return " ".join(f"{label}:{n}" for label, n in zip(labels, self.counts))
+
+
+class TransportResponse:
+    def __init__(self, status: int, headers, body: bytes):
+        self.status = status
+        self.headers = headers
+        self._body = body
+
+    def read(self) -> bytes:
+        return self._body
+
+
+class RequestNotSentError(URLError):
+    """A request failed before it was sent, so retrying it cannot post the
+    message twice."""
+
+
+class KeepAliveTransport:
+    """Send HTTP(S) requests over persistent connections that are reused
+    across warm Lambda invocations.
+
+    `urlopen` is a drop-in replacement for `urllib.request.urlopen`: it
+    raises HTTPError for 4xx/5xx responses and URLError for connection
+    failures and timeouts. Idle connections are pooled per origin, and one
+    that the server has closed while idle is discarded before it is reused.
+    Requests are not retried, since a request that fails once sent (e.g. a
+    read timeout) may already have been processed. Failures before the
+    request was sent raise RequestNotSentError, which is safe to retry.
+    """
+
+    def __init__(
+        self,
+        *,
+        connect_timeout: float = SLACK_CONNECT_TIMEOUT_SECONDS,
+        read_timeout: float = SLACK_READ_TIMEOUT_SECONDS,
+        max_idle_per_origin: int = 4,
+        ssl_context=None,
+    ):
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._max_idle_per_origin = max_idle_per_origin
+        self._ssl_context = ssl_context
+        self._lock = threading.Lock()
+        self._idle: dict[tuple[str, str, int], list[http.client.HTTPConnection]] = {}
+        self.latency_histogram = LatencyHistogram()
+        self.connections_opened = 0
+
+    def _connect(self, origin: tuple[str, str, int]) -> http.client.HTTPConnection:
+        scheme, host, port = origin
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                host, port, timeout=self._connect_timeout, context=self._ssl_context
+            )
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self._connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self._read_timeout)
+        with self._lock:
+            self.connections_opened += 1
+        return conn
+
+    def _acquire(self, origin) -> http.client.HTTPConnection:
+        while True:
+            with self._lock:
+                idle = self._idle.get(origin)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                return self._connect(origin)
+            # An idle connection is only readable once the server has closed it
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+            if not readable:
+                return conn
+            conn.close()
+
+    def _release(self, origin, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self._max_idle_per_origin:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def urlopen(self, req: Request) -> TransportResponse:
+        url = urlsplit(req.full_url)
+        origin = (
+            url.scheme,
+            url.hostname,
+            url.port or (443 if url.scheme == "https" else 80),
+        )
+        path = (url.path or "/") + (f"?{url.query}" if url.query else "")
+        headers = dict(req.header_items())
+        if not req.has_header("Content-type"):
+            headers["Content-Type"] = "application/json"
+
+        start = time.monotonic()
+        try:
+            conn = self._acquire(origin)
+        except (OSError, http.client.HTTPException) as e:
+            raise RequestNotSentError(e) from e
+        try:
+            # A request that could not be written in full cannot be processed
+            conn.request(req.get_method(), path, body=req.data, headers=headers)
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise RequestNotSentError(e) from e
+        try:
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise URLError(e) from e
+        self.latency_histogram.observe(time.monotonic() - start)
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(origin, conn)
+
+        if response.status >= 400:
+            raise HTTPError(
+                req.full_url,
+                response.status,
+                response.reason,
+                response.headers,
+                io.BytesIO(body),
+            )
+        return TransportResponse(response.status, response.headers, body)
+
+
+# END shared transport
+transport = KeepAliveTransport()
+
+
+# BEGIN shared sender (assets/shared/slack.py)
+SLACK_RATE_LIMIT_PER_SECOND = float(os.getenv("SLACK_RATE_LIMIT_PER_SECOND", "1"))
+SLACK_RATE_LIMIT_BURST = float(os.getenv("SLACK_RATE_LIMIT_BURST", "5"))
+# Time kept in reserve at the end of the Lambda invocation when retrying
+SLACK_RETRY_SAFETY_MARGIN_SECONDS = 1.0
+
+
+class TokenBucket:
+    """Token bucket limiting the rate of posts to a single webhook."""
+
+    def __init__(self, rate: float, capacity: float, *, clock=time.monotonic):
+        self._rate = rate
+        self._capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated_at = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how many seconds to wait before using it."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._updated_at) * self._rate
+            )
+            self._updated_at = now
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+            return max(wait, self._blocked_until - now)
+
+    def block_for(self, seconds: float):
+        """Hold back all posts for `seconds`, e.g. after a 429 with Retry-After."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+
+@dataclass
+class SendOutcome:
+    delivered: bool
+    attempts: int
+    waited_seconds: float
+    status: int | None = None
+    reason: str = ""
+
+
+class SlackSender:
+    """Post messages to Slack webhooks without making rate limiting worse.
+
+    Posts are paced by a token bucket per webhook URL. Throttled (429) and
+    server (5xx) errors, and requests that could not be sent, are retried
+    with jittered exponential backoff, honouring Retry-After, for as long as
+    the deadline allows. Other client errors are not retried, and neither
+    are connection errors once the request was sent (e.g. a read timeout),
+    as Slack may have posted the message already.
+    """
+
+    def __init__(
+        self,
+        urlopen_func,
+        *,
+        rate: float = SLACK_RATE_LIMIT_PER_SECOND,
+        burst: float = SLACK_RATE_LIMIT_BURST,
+        base_backoff_seconds: float = 0.5,
+        max_backoff_seconds: float = 8.0,
+        clock=time.monotonic,
+        sleep=time.sleep,
+        random_func=random.random,
+    ):
+        self._urlopen = urlopen_func
+        self._rate = rate
+        self._burst = burst
+        self._base_backoff_seconds = base_backoff_seconds
+        self._max_backoff_seconds = max_backoff_seconds
+        self._clock = clock
+        self._sleep = sleep
+        self._random = random_func
+        self._buckets: dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+
+    def _bucket(self, slack_url: str) -> TokenBucket:
+        with self._buckets_lock:
+            if slack_url not in self._buckets:
+                self._buckets[slack_url] = TokenBucket(
+                    self._rate, self._burst, clock=self._clock
+                )
+            return self._buckets[slack_url]
+
+    def _wait(self, seconds: float, deadline: float) -> bool:
+        """Sleep for `seconds` unless that would pass the deadline."""
+        if self._clock() + seconds > deadline:
+            return False
+        if seconds > 0:
+            self._sleep(seconds)
+        return True
+
+    def send(self, slack_url: str, slack_message: dict, *, deadline: float):
+        """Post the message, retrying until `deadline` (on the sender's clock)."""
+        bucket = self._bucket(slack_url)
+        body = json.dumps(slack_message).encode("utf-8")
+        start = self._clock()
+        attempts = 0
+        status, reason = None, ""
+
+        while True:
+            if not self._wait(bucket.reserve(), deadline):
+                reason = reason or "rate limited"
+                break
+            attempts += 1
+            try:
+                self._urlopen(
+                    Request(
+                        slack_url,
+                        data=body,
+                        headers={"Content-Type": "application/json"},
+                    )
+                ).read()
+                return SendOutcome(True, attempts, self._clock() - start, 200)
+            except HTTPError as e:
+                status, reason = e.code, str(e.reason)
+                if e.code != 429 and e.code < 500:
+                    break
+                retry_after = _parse_retry_after(e.headers)
+                if e.code == 429 and retry_after is not None:
+                    bucket.block_for(retry_after)
+            except URLError as e:
+                status, reason = None, str(e.reason)
+                # Once sent, the request may have been processed already
+                if not isinstance(e, RequestNotSentError):
+                    break
+
+            backoff = min(
+                self._max_backoff_seconds,
+                self._base_backoff_seconds * 2 ** (attempts - 1),
+            )
+            if not self._wait(backoff * self._random(), deadline):
+                break
+
+        return SendOutcome(False, attempts, self._clock() - start, status, reason)
+
+
+def _parse_retry_after(headers) -> float | None:
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def deadline_from_context(context) -> float:
+    """Return the time on the monotonic clock by which retries must stop."""
+    remaining_seconds = (
+        context.get_remaining_time_in_millis() / 1000 if context else 5.0
+    )
+    return time.monotonic() + remaining_seconds - SLACK_RETRY_SAFETY_MARGIN_SECONDS
+
+
+# END shared sender
+slack_sender = SlackSender(transport.urlopen)
+
+
+class FriendlyNameMatcher:
+    """Augment values (e.g., AWS account IDs) in strings with friendly names.
+
+    The names are compiled into a trie once, so the cost of a replacement
+    grows with the length of the text rather than the number of names.
+    Matching is leftmost-first, and when several names match at the same
+    position the one listed first in `friendly_names` wins.
+
+    We avoid replacing values that are directly prefixed and/or suffixed with ':'
+    as it is most likely an ARN or similiar. We don't want to replace account IDs
+    inside ARNs as this would look messy. This is a quite basic heuristic, but it
+    should allow us to easily replace most relevant values (e.g., principal ID,
+    account ID, etc.) with friendly names without a complicated matcher.
+    """
+
+    _END = ""
+
+    def __init__(self, friendly_names, _tries=None):
+        self._friendly_names = friendly_names
+        # Tries in order of priority, each matching leftmost-first on its own
+        self._tries = (
+            _tries if _tries is not None else [self._build_trie(friendly_names)]
+        )
+        # Jump between possible match starts with a C-level scan
+        start_chars = sorted({c for trie in self._tries for c in trie})
+        self._start_pattern = (
+            re.compile("[" + "".join(re.escape(c) for c in start_chars) + "]")
+            if start_chars
+            else None
+        )
+
+    @classmethod
+    def _build_trie(cls, friendly_names):
+        trie = {}
+        for priority, key in enumerate(friendly_names):
+            if not key:
+                continue
+            node = trie
+            for char in key:
+                node = node.setdefault(char, {})
+            node[cls._END] = (priority, key)
+        return trie
+
+    def extended(self, extra_names):
+        """Return a matcher that also matches `extra_names`, which rank after
+        the names of this matcher. Only a trie of the extra names is built,
+        so this is cheap for the few names looked up for a single event."""
+        return FriendlyNameMatcher(
+            ChainMap(extra_names, self._friendly_names),
+            _tries=[*self._tries, self._build_trie(extra_names)],
+        )
+
+    def _match_at(self, s, start):
+        """Return (end, key) of the best match starting at `start`, or None."""
+        for trie in self._tries:
+            best = None
+            node = trie
+            i = start
+            while i < len(s) and s[i] in node:
+                node = node[s[i]]
+                i += 1
+                terminal = node.get(self._END)
+                if (
+                    terminal is not None
+                    and (i == len(s) or s[i] != ":")
+                    and (best is None or terminal[0] < best[0])
+                ):
+                    best = (terminal[0], i, terminal[1])
+            if best is not None:
+                return best[1:]
+        return None
+
+    def replace(self, s):
+        if self._start_pattern is None:
+            return s
+        parts = []
+        last = 0
+        pos = 0
+        while True:
+            m = self._start_pattern.search(s, pos)
+            if m is None:
+                break
+            start = m.start()
+            match = None
+            if start == 0 or s[start - 1] != ":":
+                match = self._match_at(s, start)
+            if match is None:
+                pos = start + 1
+                continue
+            end, key = match
+            parts.append(s[last:end])
+            parts.append(f" ({self._friendly_names[key]})")
+            last = pos = end
+        parts.append(s[last:])
+        return "".join(parts)
+
+
+class AugmentedFriendlyNames(Mapping):
+    """Friendly names augmented with the few names looked up for a single
+    event. The augmented names take precedence over the friendly names, which
+    are kept as they are so that their matcher is reused."""
+
+    def __init__(self, friendly_names, extra_names):
+        self.friendly_names = friendly_names
+        self.extra_names = extra_names
+
+    def __getitem__(self, key):
+        if key in self.extra_names:
+            return self.extra_names[key]
+        return self.friendly_names[key]
+
+    def __iter__(self):
+        yield from self.friendly_names
+        yield from (key for key in self.extra_names if key not in self.friendly_names)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+# Matchers built in this container, keyed by the identity of the friendly
+# names they match, least recently used first
+_friendly_name_matchers = OrderedDict()
+_MAX_CACHED_MATCHERS = 32
+
+
+def get_friendly_name_matcher(friendly_names):
+    """Return a matcher for the friendly names, reusing the one previously
+    built for the same dictionary. The dictionary must not be modified once
+    it has been matched against, as with the one from parse_friendly_names."""
+    if isinstance(friendly_names, AugmentedFriendlyNames):
+        return get_friendly_name_matcher(friendly_names.friendly_names).extended(
+            friendly_names.extra_names
+        )
+    cached = _friendly_name_matchers.get(id(friendly_names))
+    # The dictionary is kept in the cache, so its ID cannot be reused while cached
+    if cached is not None and cached[0] is friendly_names:
+        _friendly_name_matchers.move_to_end(id(friendly_names))
+        return cached[1]
+    matcher = FriendlyNameMatcher(friendly_names)
+    _friendly_name_matchers[id(friendly_names)] = (friendly_names, matcher)
+    while len(_friendly_name_matchers) > _MAX_CACHED_MATCHERS:
+        _friendly_name_matchers.popitem(last=False)
+    return matcher
+
+
+@functools.lru_cache(maxsize=1)
+def parse_friendly_names(raw_friendly_names):
+    """Parse the FRIENDLY_NAMES environment variable once per container.
+    The returned dictionary is shared and must not be modified."""
+    return json.loads(raw_friendly_names)
+
+
 def augment_strings_with_friendly_names(strings, friendly_names):
     """A helper method for augmenting various values (e.g., AWS account ID) in
     a list of strings with a more friendly name"""
-    # We avoid replacing values that are directly prefixed and/or suffixed with ':'
-    # as it is most likely an ARN or similiar. We don't want to replace account IDs
-    # inside ARNs as this would look messy.This is a quite basic heuristic, but it should allow
-    # us to easily replace most relevant values (e.g., principal ID, account ID, etc.) with
-    # friendly names without a complicated regex.
-    pattern = re.compile(
-        "|".join([f"(?<!:)({re.escape(key)})(?!:)" for key in friendly_names])
-    )
-    return [
-        pattern.sub(
-            lambda m: m[0] + f" ({friendly_names[m.string[m.start() : m.end()]]})", s
+    matcher = get_friendly_name_matcher(friendly_names)
+    return [matcher.replace(s) for s in strings]
+
+
+@dataclass(frozen=True)
+class CloudTrailEvent:
+    """A CloudTrail API call received through EventBridge, with the fields used
+    by the renderers parsed once up front"""
+
+    raw: dict
+    account_id: str
+    event_source: str
+    event_name: str
+    event_type: str
+    event_time: str
+    recipient_account_id: str
+    principal_id: str
+    principal_type: str
+    principal_account_id: str
+    principal_arn: str
+    source_ip: str
+    request_parameters: dict
+    response_elements: dict
+    additional_event_data: dict
+    error_message: str
+    resources: list
+
+    @classmethod
+    def from_event(cls, event):
+        event_detail = event["detail"]
+        # Several of these may be None, in which case we force them to empty values
+        user_identity = event_detail.get("userIdentity", {}) or {}
+        return cls(
+            raw=event,
+            account_id=event.get("account", ""),
+            event_source=event_detail.get("eventSource", ""),
+            event_name=event_detail["eventName"],
+            event_type=event_detail.get("eventType", ""),
+            event_time=event_detail.get("eventTime", ""),
+            recipient_account_id=event_detail.get("recipientAccountId", ""),
+            principal_id=user_identity.get("principalId", ""),
+            principal_type=user_identity.get("type", ""),
+            principal_account_id=user_identity.get("accountId", ""),
+            principal_arn=user_identity.get("arn", ""),
+            source_ip=event_detail.get("sourceIPAddress", ""),
+            request_parameters=event_detail.get("requestParameters", {}) or {},
+            response_elements=event_detail.get("responseElements", {}) or {},
+            additional_event_data=event_detail.get("additionalEventData", {}) or {},
+            error_message=event_detail.get("errorMessage", ""),
+            resources=event_detail.get("resources", []) or [],
         )
-        for s in strings
-    ]
 
 
-def get_slack_payload_for_assume_role_event(event, friendly_names):
-    """Parse a CloudTrail event related to the API call sts:AssumeRole,
-    and return a Slack-formatted attachment"""
-    event_detail = event["detail"]
-    recipient_account_id = event_detail["recipientAccountId"]
-    request_parameters = event_detail.get("requestParameters", {}) or {}
-
-    timestamp = event_detail["eventTime"]
-    user_identity = event_detail["userIdentity"]
-    principal_id = user_identity["principalId"]
-    principal_account_id = user_identity["accountId"]
-    source_identity = request_parameters.get("sourceIdentity", "")
-    source_ip = event_detail.get("sourceIPAddress", "")
-    role_arn = request_parameters.get("roleArn", "")
-
-    fallback = f"Sensitive role accessed in '{recipient_account_id}'"
-    pretext_messages = [
-        f":warning: Sensitive role in `{recipient_account_id}` assumed by"
-    ]
-    if principal_id.startswith("AIDA"):
-        pretext_messages.append("IAM user")
-    elif principal_id.startswith("AROA"):
-        # The other part of the principal ID for a role is the name of the session
-        principal_id = principal_id.split(":")[0]
-        pretext_messages.append("IAM role")
-    else:
-        pretext_messages.append("principal")
-    pretext_messages.append(f"in `{principal_account_id}`")
-    pretext = " ".join(pretext_messages)
+class CidrSet:
+    """A set of IP networks. Membership is tested with one set lookup per
+    distinct prefix length, regardless of the number of networks."""
 
-    text = [
-        f"*Role ARN:* `{role_arn}`",
-        f"*Principal Account ID:* `{principal_account_id}`",
-        f"*Principal ID:* `{principal_id}`",
-        f"*Source IP:* `{source_ip}`",
-        f"*Source Identity:* `{source_identity}`" if source_identity else "",
-        f"*Timestamp:* `{timestamp}`",
-    ]
-    text = "\n".join(line for line in text if line)
+    def __init__(self, cidrs):
+        # (IP version, prefix length) -> network addresses as integers
+        self._networks = {}
+        for cidr in cidrs:
+            network = ipaddress.ip_network(cidr, strict=False)
+            self._networks.setdefault((network.version, network.prefixlen), set()).add(
+                int(network.network_address)
+            )
+
+    def __contains__(self, address):
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            # The source IP of calls made by AWS services is the name of the service
+            return False
+        value = int(ip)
+        for (version, prefixlen), networks in self._networks.items():
+            host_bits = ip.max_prefixlen - prefixlen
+            if version == ip.version and (value >> host_bits) << host_bits in networks:
+                return True
+        return False
+
+
+class SuppressionRule:
+    """A rule matching events that are expected, and what to do with them.
+
+    An event matches the rule if it matches all of the conditions that are
+    set, and a condition matches if any of its values match.
+    """
 
+    ACTIONS = ("DROP", "DOWNGRADE")
+
+    def __init__(
+        self,
+        action="DROP",
+        principal_arns=(),
+        source_ip_cidrs=(),
+        event_names=(),
+        account_ids=(),
+    ):
+        if action not in self.ACTIONS:
+            raise ValueError(f"Unsupported suppression action '{action}'")
+        self.action = action
+        self.event_names = frozenset(event_names)
+        self.account_ids = frozenset(account_ids)
+        self._principal_arn_pattern = (
+            re.compile("|".join(fnmatch.translate(arn) for arn in principal_arns))
+            if principal_arns
+            else None
+        )
+        self._source_ips = CidrSet(source_ip_cidrs) if source_ip_cidrs else None
+
+    @classmethod
+    def from_dict(cls, rule):
+        return cls(
+            action=rule.get("action", "DROP"),
+            principal_arns=rule.get("principalArns", []),
+            source_ip_cidrs=rule.get("sourceIpCidrs", []),
+            event_names=rule.get("eventNames", []),
+            account_ids=rule.get("accountIds", []),
+        )
+
+    def matches(self, event):
+        if self.event_names and event.event_name not in self.event_names:
+            return False
+        if self.account_ids and event.recipient_account_id not in self.account_ids:
+            return False
+        if self._principal_arn_pattern and not self._principal_arn_pattern.match(
+            event.principal_arn
+        ):
+            return False
+        if self._source_ips is not None and event.source_ip not in self._source_ips:
+            return False
+        return True
+
+
+class SuppressionRules:
+    """An ordered list of suppression rules where the first matching rule wins.
+
+    Rules are indexed by event name, so only the rules that apply to the
+    event's API call, and the rules without event names, are evaluated.
+    """
+
+    def __init__(self, rules):
+        self._rules_by_event_name = {}
+        self._rules_for_any_event = []
+        for position, rule in enumerate(rules):
+            if rule.event_names:
+                for event_name in rule.event_names:
+                    self._rules_by_event_name.setdefault(event_name, []).append(
+                        (position, rule)
+                    )
+            else:
+                self._rules_for_any_event.append((position, rule))
+
+    @classmethod
+    def from_json(cls, raw_rules):
+        return cls([SuppressionRule.from_dict(rule) for rule in json.loads(raw_rules)])
+
+    def evaluate(self, event):
+        """Return the action of the first rule matching the event, or None"""
+        candidates = heapq.merge(
+            self._rules_by_event_name.get(event.event_name, ()),
+            self._rules_for_any_event,
+            key=lambda candidate: candidate[0],
+        )
+        for _, rule in candidates:
+            if rule.matches(event):
+                return rule.action
+        return None
+
+
+suppression_rules = SuppressionRules.from_json(os.getenv("SUPPRESSION_RULES", "[]"))
+
+
+class RoutingTable:
+    """Routes events to Slack destinations (webhook URL and channel) based on
+    the account receiving the API call, the name of the API call and the type
+    of principal that made it.
+
+    An event is sent to every route whose conditions all match, where a
+    condition that isn't set matches any value. The routes are indexed by each
+    condition when the table is built, so resolving the destinations of an
+    event takes a few set operations regardless of the number of routes.
+    """
+
+    # Route condition -> CloudTrailEvent attribute it is matched against
+    CONDITIONS = {
+        "accountIds": "recipient_account_id",
+        "eventNames": "event_name",
+        "principalTypes": "principal_type",
+    }
+
+    def __init__(self, routes):
+        self._destinations = [
+            (route["slackWebhookUrl"], route["slackChannel"]) for route in routes
+        ]
+        all_routes = frozenset(range(len(routes)))
+        # Condition -> (value -> routes matching it, routes without the condition)
+        self._indexes = {}
+        for condition in self.CONDITIONS:
+            by_value = {}
+            unconditional = set(all_routes)
+            for position, route in enumerate(routes):
+                for value in route.get(condition, []):
+                    by_value.setdefault(value, set()).add(position)
+                    unconditional.discard(position)
+            self._indexes[condition] = (by_value, frozenset(unconditional))
+
+    @classmethod
+    def from_json(cls, raw_routes):
+        return cls(json.loads(raw_routes))
+
+    def resolve(self, event):
+        """Return the distinct destinations of the event in the order of the routes"""
+        matching = None
+        for condition, attribute in self.CONDITIONS.items():
+            by_value, unconditional = self._indexes[condition]
+            candidates = unconditional | by_value.get(getattr(event, attribute), set())
+            matching = candidates if matching is None else matching & candidates
+            if not matching:
+                return []
+        return list(dict.fromkeys(self._destinations[i] for i in sorted(matching)))
+
+
+routing_table = RoutingTable.from_json(os.getenv("SLACK_ROUTES", "[]"))
+
+
+def fan_out(func, items, max_workers=None):
+    """Call `func` with each of the items concurrently, and raise the first error
+    once all of the calls have finished"""
+    if max_workers is None:
+        max_workers = EVENT_TRANSFORMER_MAX_WORKERS
+    if len(items) == 1:
+        func(items[0])
+        return
+    with ThreadPoolExecutor(max_workers=min(len(items), max_workers)) as pool:
+        futures = [pool.submit(func, item) for item in items]
+    errors = [future.exception() for future in futures if future.exception()]
+    if errors:
+        raise errors[0]
+
+
+# Renderers for specific API calls keyed by (eventSource, eventName). Each
+# renderer takes a CloudTrailEvent and returns a tuple of (pretext, fallback, text).
+_renderers = {}
+
+
+def renderer(event_source, event_name):
+    """Register the decorated function as the renderer of an API call"""
+
+    def register(func):
+        _renderers[(event_source, event_name)] = func
+        return func
+
+    return register
+
+
+def get_renderer(cloudtrail_event):
+    """Return the renderer registered for the API call of the event, if any"""
+    return _renderers.get((cloudtrail_event.event_source, cloudtrail_event.event_name))
+
+
+def create_slack_payload(pretext, fallback, text, friendly_names, downgraded=False):
+    """Augment the strings with friendly names, and return a Slack-formatted
+    attachment. Downgraded events are posted as informational messages."""
+    if downgraded:
+        pretext = pretext.replace(":warning:", ":information_source:", 1)
     try:
         pretext, fallback, text = augment_strings_with_friendly_names(
             [pretext, fallback, text], friendly_names
@@ -87,7 +782,7 @@ def get_slack_payload_for_assume_role_event(event, friendly_names):
         "attachments": [
             {
                 "pretext": pretext,
-                "color": "warning",
+                **({} if downgraded else {"color": "warning"}),
                 "text": text,
                 "fallback": fallback,
                 "mrkdwn_in": ["pretext", "text"],
@@ -96,184 +791,675 @@ def get_slack_payload_for_assume_role_event(event, friendly_names):
     }
 
 
+def describe_principal(principal_id):
+    """Return the kind of principal and the principal ID with any session name
+    stripped away"""
+    if principal_id.startswith("AIDA"):
+        return "IAM user", principal_id
+    if principal_id.startswith("AROA"):
+        # The other part of the principal ID for a role is the name of the session
+        return "IAM role", principal_id.split(":")[0]
+    return "principal", principal_id
+
+
+@renderer("sts.amazonaws.com", "AssumeRole")
+def render_assume_role_event(event):
+    """Render a call to sts:AssumeRole"""
+    source_identity = event.request_parameters.get("sourceIdentity", "")
+    role_arn = event.request_parameters.get("roleArn", "")
+    principal_kind, principal_id = describe_principal(event.principal_id)
+
+    fallback = f"Sensitive role accessed in '{event.recipient_account_id}'"
+    pretext = (
+        f":warning: Sensitive role in `{event.recipient_account_id}` assumed by "
+        f"{principal_kind} in `{event.principal_account_id}`"
+    )
+    text = [
+        f"*Role ARN:* `{role_arn}`",
+        f"*Principal Account ID:* `{event.principal_account_id}`",
+        f"*Principal ID:* `{principal_id}`",
+        f"*Source IP:* `{event.source_ip}`",
+        f"*Source Identity:* `{source_identity}`" if source_identity else "",
+        f"*Timestamp:* `{event.event_time}`",
+    ]
+    return pretext, fallback, "\n".join(line for line in text if line)
+
+
+@renderer("signin.amazonaws.com", "ConsoleLogin")
+def render_console_login_event(event):
+    """Render a sign-in to the AWS Management Console"""
+    result = event.response_elements.get("ConsoleLogin", "")
+    mfa_used = event.additional_event_data.get("MFAUsed", "")
+    principal = "Root user" if event.principal_type == "Root" else "Principal"
+    outcome = "failed to log in" if result == "Failure" else "logged in"
+
+    fallback = f"Console login in '{event.recipient_account_id}'"
+    pretext = (
+        f":warning: {principal} {outcome} to the console "
+        f"in `{event.recipient_account_id}`"
+    )
+    text = [
+        f"*Principal ARN:* `{event.principal_arn}`" if event.principal_arn else "",
+        f"*Result:* `{result}`" if result else "",
+        f"*Error Message:* `{event.error_message}`" if event.error_message else "",
+        f"*MFA Used:* `{mfa_used}`" if mfa_used else "",
+        f"*Source IP:* `{event.source_ip}`",
+        f"*Timestamp:* `{event.event_time}`",
+    ]
+    return pretext, fallback, "\n".join(line for line in text if line)
+
+
+@renderer("iam.amazonaws.com", "CreateAccessKey")
+def render_create_access_key_event(event):
+    """Render the creation of long-lived IAM access keys"""
+    # The user of the caller is used if no user name is supplied
+    user_name = event.request_parameters.get("userName", "") or event.principal_arn
+    access_key = event.response_elements.get("accessKey", {}) or {}
+
+    fallback = f"IAM access key created in '{event.recipient_account_id}'"
+    pretext = (
+        f":warning: IAM access key created for `{user_name}` "
+        f"in `{event.recipient_account_id}`"
+    )
+    text = [
+        f"*Access Key ID:* `{access_key['accessKeyId']}`"
+        if access_key.get("accessKeyId")
+        else "",
+        f"*Principal ARN:* `{event.principal_arn}`" if event.principal_arn else "",
+        f"*Error Message:* `{event.error_message}`" if event.error_message else "",
+        f"*Source IP:* `{event.source_ip}`",
+        f"*Timestamp:* `{event.event_time}`",
+    ]
+    return pretext, fallback, "\n".join(line for line in text if line)
+
+
+@renderer("kms.amazonaws.com", "ScheduleKeyDeletion")
+def render_schedule_key_deletion_event(event):
+    """Render the scheduled deletion of a KMS key"""
+    key_id = event.request_parameters.get("keyId", "")
+    pending_window = event.request_parameters.get("pendingWindowInDays", "")
+    deletion_date = event.response_elements.get("deletionDate", "")
+
+    fallback = f"KMS key scheduled for deletion in '{event.recipient_account_id}'"
+    pretext = (
+        f":warning: KMS key scheduled for deletion in `{event.recipient_account_id}`"
+    )
+    text = [
+        f"*Key ID:* `{key_id}`",
+        f"*Pending Window:* `{pending_window} days`" if pending_window else "",
+        f"*Deletion Date:* `{deletion_date}`" if deletion_date else "",
+        f"*Principal ARN:* `{event.principal_arn}`" if event.principal_arn else "",
+        f"*Error Message:* `{event.error_message}`" if event.error_message else "",
+        f"*Source IP:* `{event.source_ip}`",
+        f"*Timestamp:* `{event.event_time}`",
+    ]
+    return pretext, fallback, "\n".join(line for line in text if line)
+
+
+DUMP_EVENT_MAX_BYTES = int(os.getenv("DUMP_EVENT_MAX_BYTES", "8000"))
+DUMP_EVENT_MAX_ARRAY_ITEMS = 5
+DUMP_EVENT_MAX_OBJECT_KEYS = 50
+DUMP_EVENT_MAX_DEPTH = 6
+DUMP_EVENT_MAX_STRING_LENGTH = 512
+# Fields that are dumped first, so that they survive if the dump is truncated
+DUMP_EVENT_PRIORITY_KEYS = (
+    "detail-type",
+    "account",
+    "region",
+    "time",
+    "eventSource",
+    "eventName",
+    "eventType",
+    "eventTime",
+    "recipientAccountId",
+    "userIdentity",
+    "sourceIPAddress",
+    "errorCode",
+    "errorMessage",
+    "requestParameters",
+    "responseElements",
+    "resources",
+    "detail",
+)
+
+
+def _prune_for_dump(value, depth=0):
+    """Return a copy of the value where large arrays, objects and strings and
+    deeply nested values are replaced by short summaries"""
+    if isinstance(value, dict):
+        if depth >= DUMP_EVENT_MAX_DEPTH:
+            return f"<object with {len(value)} key(s) elided>"
+        keys = [key for key in DUMP_EVENT_PRIORITY_KEYS if key in value]
+        priority_keys = set(keys)
+        keys += sorted((key for key in value if key not in priority_keys), key=str)
+        pruned = {
+            key: _prune_for_dump(value[key], depth + 1)
+            for key in keys[:DUMP_EVENT_MAX_OBJECT_KEYS]
+        }
+        if len(keys) > DUMP_EVENT_MAX_OBJECT_KEYS:
+            pruned["..."] = f"{len(keys) - DUMP_EVENT_MAX_OBJECT_KEYS} key(s) elided"
+        return pruned
+    if isinstance(value, list):
+        if depth >= DUMP_EVENT_MAX_DEPTH:
+            return f"<array with {len(value)} item(s) elided>"
+        pruned = [
+            _prune_for_dump(item, depth + 1)
+            for item in value[:DUMP_EVENT_MAX_ARRAY_ITEMS]
+        ]
+        if len(value) > DUMP_EVENT_MAX_ARRAY_ITEMS:
+            pruned.append(
+                f"<{len(value) - DUMP_EVENT_MAX_ARRAY_ITEMS} more item(s) elided>"
+            )
+        return pruned
+    if isinstance(value, str) and len(value) > DUMP_EVENT_MAX_STRING_LENGTH:
+        return (
+            value[:DUMP_EVENT_MAX_STRING_LENGTH]
+            + f"... <{len(value) - DUMP_EVENT_MAX_STRING_LENGTH} char(s) elided>"
+        )
+    return value
+
+
+def dump_event(event, max_bytes=None):
+    """Serialize an event as indented JSON of at most `max_bytes` bytes.
+
+    Key fields are emitted first, and large or deeply nested values are
+    summarized. The JSON is encoded incrementally and encoding stops as soon as
+    the budget is used up, in which case the dump is cut off with a note.
+    """
+    if max_bytes is None:
+        max_bytes = DUMP_EVENT_MAX_BYTES
+    # ensure_ascii makes the length of each chunk equal to its size in bytes
+    encoder = json.JSONEncoder(indent=2, ensure_ascii=True, default=str)
+    truncation_note = "\n... <truncated>"
+    budget = max_bytes - len(truncation_note)
+    chunks = []
+    size = 0
+    for chunk in encoder.iterencode(_prune_for_dump(event)):
+        if size + len(chunk) > budget:
+            chunks.append(chunk[: max(budget - size, 0)])
+            chunks.append(truncation_note)
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    return "".join(chunks)
+
+
 def get_fallback_slack_payload_for_event(
-    event, friendly_names, fallback_parse_behavior=""
+    event, friendly_names, fallback_parse_behavior="", downgraded=False
 ):
     """Parse a generic CloudTrail event related to an API call
     and return a Slack-formatted attachment"""
-    event_detail = event["detail"]
-    event_name = event_detail["eventName"]
-    event_type = event_detail["eventType"]
-    event_time = event_detail["eventTime"]
-    recipient_account_id = event_detail["recipientAccountId"]
-    pretext = f":warning: CloudTrail event in account `{recipient_account_id}`"
-    fallback = f"CloudTrail event in account '{recipient_account_id}'"
+    pretext = f":warning: CloudTrail event in account `{event.recipient_account_id}`"
+    fallback = f"CloudTrail event in account '{event.recipient_account_id}'"
     if fallback_parse_behavior == "DUMP_EVENT":
-        text = "\n".join(
-            ["*Event:*", "```", json.dumps(event, sort_keys=True, indent=2), "```"]
-        )
+        text = "\n".join(["*Event:*", "```", dump_event(event.raw), "```"])
     else:
-        error_message = event_detail.get("errorMessage", "")
-        # This may be None, in which case we force it to an empty dict instead
-        response_element = (event_detail.get("responseElements", {}) or {}).get(
-            event_name, ""
-        )
-        user_identity = event_detail["userIdentity"]
-        principal_id = user_identity.get("principalId", "")
-        principal_type = user_identity.get("type", "")
-        principal_account_id = user_identity.get("accountId", "")
-        principal_arn = user_identity.get("arn", "")
-        source_ip = event_detail.get("sourceIPAddress", "")
-        resources = event_detail.get("resources", []) or []
+        response_element = event.response_elements.get(event.event_name, "")
         text = [
-            f"*Event Type:* `{event_type}`",
-            f"*Event Name:* `{event_name}`",
-            f"*Event Time:* `{event_time}`",
-            f"*Error Message:* `{error_message}`" if error_message else "",
+            f"*Event Type:* `{event.event_type}`",
+            f"*Event Name:* `{event.event_name}`",
+            f"*Event Time:* `{event.event_time}`",
+            f"*Error Message:* `{event.error_message}`" if event.error_message else "",
             f"*Response Code:* `{response_element}`" if response_element else "",
-            f"*Principal Type:* `{principal_type}`" if principal_type else "",
-            f"*Principal Account ID:* `{principal_account_id}`"
-            if principal_account_id
+            f"*Principal Type:* `{event.principal_type}`"
+            if event.principal_type
+            else "",
+            f"*Principal Account ID:* `{event.principal_account_id}`"
+            if event.principal_account_id
             else "",
-            f"*Principal ARN:* `{principal_arn}`" if principal_arn else "",
-            f"*Principal ID:* `{principal_id}`" if principal_id else "",
-            f"*Source IP:* `{source_ip}`" if source_ip else "",
-            f"*Resources:*\n```{json.dumps(resources, indent=2, sort_keys=True)}\n```"
-            if len(resources)
+            f"*Principal ARN:* `{event.principal_arn}`" if event.principal_arn else "",
+            f"*Principal ID:* `{event.principal_id}`" if event.principal_id else "",
+            f"*Source IP:* `{event.source_ip}`" if event.source_ip else "",
+            f"*Resources:*\n```{json.dumps(event.resources, indent=2, sort_keys=True)}\n```"
+            if len(event.resources)
             else "",
         ]
         # Filter out empty strings
         text = "\n".join(line for line in text if line)
 
-    try:
-        pretext, fallback, text = augment_strings_with_friendly_names(
-            [pretext, fallback, text], friendly_names
-        )
-    except:
-        logger.exception("Failed to augment strings with friendly names")
+    return create_slack_payload(pretext, fallback, text, friendly_names, downgraded)
+
+
+def render_event(event, friendly_names, fallback_parse_behavior="", downgraded=False):
+    """Return a Slack-formatted attachment for a CloudTrailEvent using the
+    renderer registered for its API call, or a generic one otherwise"""
+    render = get_renderer(event)
+    if render is not None:
+        try:
+            return create_slack_payload(*render(event), friendly_names, downgraded)
+        except:
+            logger.exception(
+                "Failed to render event using renderer '%s'", render.__name__
+            )
+    return get_fallback_slack_payload_for_event(
+        event,
+        friendly_names,
+        fallback_parse_behavior=fallback_parse_behavior,
+        downgraded=downgraded,
+    )
+
 
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(service_name):
+    """Return a boto3 client for the service, created on first use and reused
+    for the lifetime of the container"""
+    with _clients_lock:
+        client = _clients.get(service_name)
+        if client is None:
+            client = boto3.client(service_name)
+            _clients[service_name] = client
+        return client
+
+
+class AccountDirectory:
+    """Resolve AWS account IDs to names.
+
+    Accounts are loaded in bulk through `load_accounts` and reloaded once the
+    snapshot is older than `ttl_seconds`. Accounts missing from the snapshot
+    may be resolved one by one through `lookup_alias`, and the result of such
+    lookups is cached for the same TTL -- including missing aliases and
+    failures -- so a burst of events doesn't lead to a burst of API calls.
+    """
+
+    def __init__(
+        self, load_accounts=None, lookup_alias=None, ttl_seconds=3600, clock=time.time
+    ):
+        self._load_accounts = load_accounts
+        self._lookup_alias = lookup_alias
+        self._ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._accounts = {}
+        self._loaded_at = None
+        self._aliases = {}
+        self.loads = 0
+        self.alias_lookups = 0
+
+    def _refresh_if_stale(self, now):
+        if self._load_accounts is None:
+            return
+        if self._loaded_at is not None and now - self._loaded_at < self._ttl_seconds:
+            return
+        # Also wait a full TTL before retrying a failed load
+        self._loaded_at = now
+        self.loads += 1
+        try:
+            self._accounts = dict(self._load_accounts())
+        except Exception:
+            logger.exception(
+                "Failed to load account directory, keeping %d cached account(s)",
+                len(self._accounts),
+            )
+
+    def resolve(self, account_id, allow_alias_lookup=False):
+        """Return the name of the account, or None if it is unknown"""
+        with self._lock:
+            now = self._clock()
+            self._refresh_if_stale(now)
+            name = self._accounts.get(account_id)
+            if name or not allow_alias_lookup or self._lookup_alias is None:
+                return name or None
+            cached = self._aliases.get(account_id)
+            if cached is not None and now - cached[1] < self._ttl_seconds:
+                return cached[0]
+            self.alias_lookups += 1
+            try:
+                name = self._lookup_alias(account_id) or None
+            except Exception:
+                logger.exception("Failed to look up alias of account '%s'", account_id)
+                name = None
+            self._aliases[account_id] = (name, now)
+            return name
+
+
+def load_accounts_from_organizations():
+    """Return the names of all accounts in the organization keyed by account ID"""
+    paginator = get_client("organizations").get_paginator("list_accounts")
     return {
-        "attachments": [
-            {
-                "pretext": pretext,
-                "color": "warning",
-                "text": text,
-                "fallback": fallback,
-                "mrkdwn_in": ["pretext", "text"],
-            }
-        ]
+        account["Id"]: account["Name"]
+        for page in paginator.paginate()
+        for account in page["Accounts"]
     }
 
 
-def get_augmented_friendly_names(event, friendly_names):
-    """Return an augmented dictionary containing the alias of the current
-    AWS account as a friendly name for the current account ID if relevant"""
-    augmented_friendly_names = {**friendly_names}
+def lookup_current_account_alias(account_id):
+    """Return the alias of the current AWS account. IAM only exposes the alias
+    of the account the caller belongs to."""
+    aliases = get_client("iam").list_account_aliases()["AccountAliases"]
+    return aliases[0] if aliases else None
+
+
+def account_directory_from_env():
+    source = os.environ.get("ACCOUNT_DIRECTORY_SOURCE", "")
+    if source == "organizations":
+        load_accounts = load_accounts_from_organizations
+    elif not source:
+        load_accounts = None
+    else:
+        raise ValueError(f"Unsupported ACCOUNT_DIRECTORY_SOURCE '{source}'")
+    return AccountDirectory(
+        load_accounts=load_accounts,
+        lookup_alias=lookup_current_account_alias,
+        ttl_seconds=int(os.environ.get("ACCOUNT_DIRECTORY_TTL_SECONDS", "3600")),
+    )
+
+
+account_directory = account_directory_from_env()
+
+
+def get_augmented_friendly_names(event, friendly_names, directory=None):
+    """Return the friendly names augmented with the names of the recipient and
+    principal AWS accounts as friendly names for their account IDs if relevant"""
+    directory = directory or account_directory
+    account_names = {}
     try:
         event_account_id = event["account"]
         event_detail = event["detail"]
-        recipient_account_id = event_detail["recipientAccountId"]
-        if (
-            not friendly_names.get(event_account_id, "")
-            and event_account_id == recipient_account_id
-        ):
-            logger.info(
-                "No friendly name was supplied for current account '%s', so looking up account alias",
-                event_account_id,
+        user_identity = event_detail.get("userIdentity") or {}
+        account_ids = [
+            event_detail["recipientAccountId"],
+            user_identity.get("accountId", ""),
+        ]
+        for account_id in dict.fromkeys(account_ids):
+            if not account_id or friendly_names.get(account_id, ""):
+                continue
+            name = directory.resolve(
+                account_id, allow_alias_lookup=account_id == event_account_id
             )
-            iam = boto3.client("iam")
-            aliases = iam.list_account_aliases()["AccountAliases"]
-            if len(aliases):
-                augmented_friendly_names[event_account_id] = aliases[0]
+            if name:
+                account_names[account_id] = name
     except:
-        logger.exception("Failed to look up alias of current AWS account")
+        logger.exception("Failed to look up names of AWS accounts")
 
-    return augmented_friendly_names
+    if not account_names:
+        return friendly_names
+    return AugmentedFriendlyNames(friendly_names, account_names)
 
 
-def post_to_slack(slack_payload, slack_webhook_url):
-    """Post a payload to Slack's webhook API"""
-    encoded_slack_payload = json.dumps(slack_payload).encode("utf-8")
-    try:
-        slack_request = urllib.request.Request(
-            slack_webhook_url,
-            data=encoded_slack_payload,
-            headers={"Content-Type": "application/json"},
+def post_to_slack(slack_payload, slack_webhook_url, deadline=None):
+    """Post a payload to Slack's webhook API, retrying throttled and failed
+    requests until the deadline. Raises if the payload could not be delivered."""
+    if deadline is None:
+        deadline = deadline_from_context(None)
+    outcome = slack_sender.send(slack_webhook_url, slack_payload, deadline=deadline)
+    logger.info("Slack latency histogram: %s", transport.latency_histogram)
+    if not outcome.delivered:
+        logger.error("Failed to post to Slack: %s", outcome)
+        raise Exception(
+            f"Request to slack failed after {outcome.attempts} attempt(s): "
+            f"{outcome.status} {outcome.reason}"
         )
-        urllib.request.urlopen(slack_request)
-    except:
-        logger.exception("Failed to post to Slack")
-        raise
+    return outcome
+
+
+class DeduplicationCache:
+    """Deduplication IDs of events recently forwarded by this container.
+
+    CloudTrail duplicates often reach the same container within seconds, and
+    catching them here saves a round trip through the SQS FIFO queue. The FIFO
+    queue still deduplicates events across containers. IDs expire after
+    `ttl_seconds`, and the oldest IDs are evicted first once `max_size` is
+    reached.
+    """
+
+    def __init__(self, ttl_seconds=300, max_size=10_000, clock=time.monotonic):
+        self._ttl_seconds = ttl_seconds
+        self._max_size = max_size
+        self._clock = clock
+        # Deduplication ID -> time added, in the order the IDs were added
+        self._added_at = OrderedDict()
+        self.hits = 0
+        self.forwarded = 0
+
+    def _evict_expired(self, now):
+        while self._added_at:
+            oldest = next(iter(self._added_at.values()))
+            if now - oldest < self._ttl_seconds:
+                break
+            self._added_at.popitem(last=False)
+
+    def contains(self, deduplication_id):
+        self._evict_expired(self._clock())
+        if deduplication_id in self._added_at:
+            self.hits += 1
+            return True
+        return False
+
+    def add(self, deduplication_id):
+        now = self._clock()
+        self._evict_expired(now)
+        self._added_at[deduplication_id] = now
+        self._added_at.move_to_end(deduplication_id)
+        while len(self._added_at) > self._max_size:
+            self._added_at.popitem(last=False)
+        self.forwarded += 1
+
+
+deduplication_cache = DeduplicationCache(
+    ttl_seconds=int(os.getenv("DEDUPLICATION_CACHE_TTL_SECONDS", "300")),
+    max_size=int(os.getenv("DEDUPLICATION_CACHE_MAX_SIZE", "10000")),
+)
 
 
 def handler_event_transformer(event, context):
     """Lambda handler for the event transformer Lambda"""
     logger.info("Triggered with event: %s", json.dumps(event, indent=2))
 
-    friendly_names = json.loads(os.environ["FRIENDLY_NAMES"])
+    friendly_names = parse_friendly_names(os.environ["FRIENDLY_NAMES"])
     slack_webhook_url = os.environ["SLACK_WEBHOOK_URL"]
     slack_channel = os.environ["SLACK_CHANNEL"]
     sqs_queue_url = os.environ.get("SQS_QUEUE_URL", "")
     fallback_parse_behavior = os.environ.get("FALLBACK_PARSE_BEHAVIOR", "")
     deduplicate_events = os.environ.get("DEDUPLICATE_EVENTS", "false") == "true"
 
-    friendly_names = get_augmented_friendly_names(event, friendly_names)
-
     if not event["detail-type"].endswith("via CloudTrail"):
         logger.warn("Invalid event received")
         return
 
-    slack_payload = {}
-    try:
-        if event["detail"]["eventName"] == "AssumeRole":
-            slack_payload = get_slack_payload_for_assume_role_event(
-                event, friendly_names
-            )
-    except:
-        logger.exception("Failed to parse event using predefined schema")
-    if not slack_payload:
-        logger.warn("Using a fallback schema to parse event")
-        slack_payload = get_fallback_slack_payload_for_event(
-            event,
-            friendly_names,
-            fallback_parse_behavior=fallback_parse_behavior,
-        )
-    slack_payload = {**slack_payload, "channel": slack_channel}
+    cloudtrail_event = CloudTrailEvent.from_event(event)
+    suppression_action = suppression_rules.evaluate(cloudtrail_event)
+    if suppression_action == "DROP":
+        logger.info("Dropping event as it matches a suppression rule")
+        return
 
     if deduplicate_events and sqs_queue_url:
-        logger.info("Sending message to SQS for deduplication")
         deduplication_id = (
             event["detail"].get("requestID", "")
             or event["detail"].get("eventID", "")
             or event["id"]
         )
-        body = {
-            "slackWebhookUrl": slack_webhook_url,
-            "slackPayload": slack_payload,
-        }
+        if deduplication_cache.contains(deduplication_id):
+            logger.info(
+                "Skipping event '%s' as it has already been forwarded by this container",
+                deduplication_id,
+            )
+            return
+
+    friendly_names = get_augmented_friendly_names(event, friendly_names)
 
-        sqs = boto3.client("sqs")
-        sqs.send_message(
-            QueueUrl=sqs_queue_url,
-            MessageBody=json.dumps(body),
-            MessageDeduplicationId=deduplication_id,
-            MessageGroupId=deduplication_id,
+    slack_payload = render_event(
+        cloudtrail_event,
+        friendly_names,
+        fallback_parse_behavior=fallback_parse_behavior,
+        downgraded=suppression_action == "DOWNGRADE",
+    )
+    destinations = routing_table.resolve(cloudtrail_event) or [
+        (slack_webhook_url, slack_channel)
+    ]
+
+    if deduplicate_events and sqs_queue_url:
+        logger.info(
+            "Sending message for %d destination(s) to SQS for deduplication",
+            len(destinations),
+        )
+        sqs = get_client("sqs")
+
+        def send_to_queue(indexed_destination):
+            index, (destination_webhook_url, destination_channel) = indexed_destination
+            # The FIFO queue would otherwise drop the messages for all but the
+            # first destination as duplicates
+            message_deduplication_id = (
+                f"{deduplication_id}-{index}" if index else deduplication_id
+            )
+            body = {
+                "slackWebhookUrl": destination_webhook_url,
+                "slackPayload": {**slack_payload, "channel": destination_channel},
+            }
+            sqs.send_message(
+                QueueUrl=sqs_queue_url,
+                MessageBody=json.dumps(body),
+                MessageDeduplicationId=message_deduplication_id,
+                MessageGroupId=message_deduplication_id,
+            )
+
+        fan_out(send_to_queue, list(enumerate(destinations)))
+        # Only remember the event once it has been handed off, so that a retry of
+        # a failed invocation is not dropped as a duplicate
+        deduplication_cache.add(deduplication_id)
+        logger.info(
+            "Deduplication cache has %d local hit(s) and %d forwarded event(s)",
+            deduplication_cache.hits,
+            deduplication_cache.forwarded,
         )
     else:
-        logger.info("Sending message directly to Slack")
-        post_to_slack(slack_payload, slack_webhook_url)
+        # A retry of a failed invocation posts to every destination again, which
+        # is why the construct requires deduplication for several destinations
+        logger.info("Sending message directly to %d destination(s)", len(destinations))
+        deadline = deadline_from_context(context)
+        fan_out(
+            lambda destination: post_to_slack(
+                {**slack_payload, "channel": destination[1]}, destination[0], deadline
+            ),
+            destinations,
+        )
+
+
+# Slack recommends no more than 20 attachments per message
+SLACK_MAX_ATTACHMENTS_PER_MESSAGE = 20
+SLACK_MAX_COALESCED_MESSAGE_BYTES = 30_000
+
+
+def coalesce_slack_messages(
+    messages,
+    max_attachments=SLACK_MAX_ATTACHMENTS_PER_MESSAGE,
+    max_bytes=SLACK_MAX_COALESCED_MESSAGE_BYTES,
+):
+    """Merge consecutive messages for the same webhook and channel into
+    multi-attachment messages.
+
+    `messages` is a list of (message IDs, webhook URL, payload) tuples, and the
+    merged messages carry the message IDs of all records they contain. Only
+    payloads consisting of attachments are merged, and a merged message is kept
+    within Slack's attachment and size limits.
+    """
+    coalesced = []
+    # The message that records are currently merged into, and its size
+    current, current_size = None, 0
+    for message_ids, slack_webhook_url, slack_payload in messages:
+        if not set(slack_payload) <= {"attachments", "channel"}:
+            coalesced.append((list(message_ids), slack_webhook_url, slack_payload))
+            current = None
+            continue
+        attachments = slack_payload.get("attachments", [])
+        size = len(json.dumps(attachments))
+        if (
+            current is not None
+            and len(current[2]["attachments"]) + len(attachments) <= max_attachments
+            and current_size + size <= max_bytes
+        ):
+            current[0].extend(message_ids)
+            current[2]["attachments"].extend(attachments)
+            current_size += size
+            continue
+        current = (
+            list(message_ids),
+            slack_webhook_url,
+            {**slack_payload, "attachments": list(attachments)},
+        )
+        current_size = size
+        coalesced.append(current)
+    return coalesced
+
+
+def forward_records_to_slack(records, deadline, max_workers=None, coalesce=None):
+    """Post SQS records to Slack concurrently and return the message IDs of the
+    records that could not be delivered.
+
+    Records for the same webhook and channel are posted in order by a single
+    worker, optionally coalesced into fewer messages. If one of them fails, the
+    remaining records for that webhook and channel are reported as failed as
+    well, so that they are retried in order.
+    """
+    if max_workers is None:
+        max_workers = SLACK_FORWARDER_MAX_WORKERS
+    if coalesce is None:
+        coalesce = SLACK_FORWARDER_COALESCE
+    failed = set()
+    groups = {}
+    for record in records:
+        try:
+            body = json.loads(record["body"])
+            slack_channel = body.get("slackChannel", "")
+            slack_webhook_url = body.get("slackWebhookUrl", "")
+            slack_payload = {
+                **body["slackPayload"],
+                **({"channel": slack_channel} if slack_channel else {}),
+            }
+        except Exception:
+            logger.exception("Failed to parse record '%s'", record["messageId"])
+            failed.add(record["messageId"])
+            continue
+        key = (slack_webhook_url, slack_payload.get("channel", ""))
+        groups.setdefault(key, []).append(
+            ([record["messageId"]], slack_webhook_url, slack_payload)
+        )
+
+    def forward_group(group):
+        messages = coalesce_slack_messages(group) if coalesce else group
+        for i, (message_ids, slack_webhook_url, slack_payload) in enumerate(messages):
+            try:
+                post_to_slack(slack_payload, slack_webhook_url, deadline)
+            except Exception:
+                logger.exception(
+                    "Failed to forward record(s) %s to Slack", ", ".join(message_ids)
+                )
+                return [
+                    message_id
+                    for message_ids, _, _ in messages[i:]
+                    for message_id in message_ids
+                ]
+        return []
+
+    if groups:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(groups))) as pool:
+            for message_ids in pool.map(forward_group, groups.values()):
+                failed.update(message_ids)
+    return [record["messageId"] for record in records if record["messageId"] in failed]
 
 
 def handler_slack_forwarder(event, context):
     """Lambda handler for the Slack forwarder Lambda"""
     logger.info("Triggered with event: %s", json.dumps(event, indent=2))
-    records = event["Records"]
-    for record in records:
-        body = json.loads(record["body"])
-        slack_channel = body.get("slackChannel", "")
-        slack_webhook_url = body.get("slackWebhookUrl", "")
-        slack_payload = {
-            **body["slackPayload"],
-            **({"channel": slack_channel} if slack_channel else {}),
-        }
-        post_to_slack(slack_payload, slack_webhook_url)
+    deadline = deadline_from_context(context)
+    failed_message_ids = forward_records_to_slack(event["Records"], deadline)
+    if failed_message_ids:
+        logger.warning(
+            "Failed to forward %d of %d record(s) to Slack",
+            len(failed_message_ids),
+            len(event["Records"]),
+        )
+    # Failing the invocation makes a persistent failure (e.g., an invalid Slack
+    # webhook URL) visible in the error metric of the function, while partial
+    # failures are left to be retried individually
+    if event["Records"] and len(failed_message_ids) == len(event["Records"]):
+        raise Exception(
+            f"Failed to forward all {len(failed_message_ids)} record(s) to Slack"
+        )
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": message_id} for message_id in failed_message_ids
+        ]
+    }
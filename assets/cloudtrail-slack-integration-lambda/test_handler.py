@@ -0,0 +1,794 @@
+import json
+import random
+import re
+import threading
+
+import pytest
+
+import main
+from main import (
+    AccountDirectory,
+    AugmentedFriendlyNames,
+    CloudTrailEvent,
+    coalesce_slack_messages,
+    DeduplicationCache,
+    dump_event,
+    FriendlyNameMatcher,
+    forward_records_to_slack,
+    get_augmented_friendly_names,
+    augment_strings_with_friendly_names,
+    get_friendly_name_matcher,
+    handler_event_transformer,
+    handler_slack_forwarder,
+    render_event,
+    RoutingTable,
+    SuppressionRule,
+    SuppressionRules,
+    parse_friendly_names,
+)
+
+
+def augment_with_regex(strings, friendly_names):
+    """The original regex-based implementation, used as a reference"""
+    pattern = re.compile(
+        "|".join([f"(?<!:)({re.escape(key)})(?!:)" for key in friendly_names])
+    )
+    return [
+        pattern.sub(lambda m: m[0] + f" ({friendly_names[m[0]]})", s) for s in strings
+    ]
+
+
+FRIENDLY_NAMES = {
+    "123456789012": "prod",
+    "210987654321": "staging",
+    "AROAEXAMPLE": "deploy-role",
+}
+
+
+@pytest.mark.parametrize(
+    "text,expected",
+    [
+        ("Account 123456789012", "Account 123456789012 (prod)"),
+        (
+            "arn:aws:iam::123456789012:role/foo",
+            "arn:aws:iam::123456789012:role/foo",
+        ),
+        ("123456789012:foo", "123456789012:foo"),
+        (":123456789012", ":123456789012"),
+        (
+            "AROAEXAMPLE:session in 210987654321",
+            "AROAEXAMPLE:session in 210987654321 (staging)",
+        ),
+        ("nothing to see here", "nothing to see here"),
+        ("", ""),
+    ],
+)
+def test_augment_strings_with_friendly_names(text, expected):
+    assert augment_strings_with_friendly_names([text], FRIENDLY_NAMES) == [expected]
+
+
+def test_earlier_friendly_name_wins_on_overlap():
+    friendly_names = {"1234": "short", "123456": "long"}
+    assert augment_strings_with_friendly_names(["123456"], friendly_names) == [
+        "1234 (short)56"
+    ]
+    friendly_names = {"123456": "long", "1234": "short"}
+    assert augment_strings_with_friendly_names(["123456"], friendly_names) == [
+        "123456 (long)"
+    ]
+
+
+def test_falls_back_to_shorter_name_when_longer_is_followed_by_colon():
+    friendly_names = {"123456": "long", "1234": "short"}
+    assert augment_strings_with_friendly_names(["123456:x"], friendly_names) == [
+        "1234 (short)56:x"
+    ]
+
+
+def test_empty_friendly_names_leave_strings_untouched():
+    assert augment_strings_with_friendly_names(["123456789012"], {}) == ["123456789012"]
+
+
+def test_matches_regex_implementation_on_random_input():
+    rng = random.Random(42)
+    alphabet = "0123:ab "
+    for _ in range(300):
+        friendly_names = {
+            "".join(rng.choices(alphabet[:5], k=rng.randint(1, 4))): f"name{i}"
+            for i in range(rng.randint(1, 6))
+        }
+        strings = [
+            "".join(rng.choices(alphabet, k=rng.randint(0, 40))) for _ in range(5)
+        ]
+        assert augment_strings_with_friendly_names(
+            strings, friendly_names
+        ) == augment_with_regex(strings, friendly_names)
+
+
+def test_matchers_and_parsed_friendly_names_are_reused():
+    raw = '{"123456789012": "prod"}'
+    assert parse_friendly_names(raw) is parse_friendly_names(raw)
+    assert get_friendly_name_matcher(
+        parse_friendly_names(raw)
+    ) is get_friendly_name_matcher(parse_friendly_names(raw))
+
+
+def test_augmented_names_match_like_a_merged_dictionary():
+    rng = random.Random(7)
+    alphabet = "0123:ab "
+    for _ in range(300):
+        friendly_names = {
+            "".join(rng.choices(alphabet[:5], k=rng.randint(1, 4))): f"name{i}"
+            for i in range(rng.randint(0, 6))
+        }
+        extra_names = {
+            "".join(rng.choices(alphabet[:5], k=rng.randint(1, 4))): f"extra{i}"
+            for i in range(rng.randint(1, 2))
+        }
+        merged = {**friendly_names}
+        for key, name in extra_names.items():
+            if not merged.get(key, ""):
+                merged[key] = name
+        augmented = AugmentedFriendlyNames(
+            friendly_names,
+            {k: v for k, v in extra_names.items() if not friendly_names.get(k, "")},
+        )
+        strings = [
+            "".join(rng.choices(alphabet, k=rng.randint(0, 40))) for _ in range(5)
+        ]
+        assert augmented == merged
+        assert augment_strings_with_friendly_names(
+            strings, augmented
+        ) == augment_strings_with_friendly_names(strings, merged)
+
+
+def test_augmented_names_reuse_the_matcher_of_the_configured_names(monkeypatch):
+    friendly_names = {f"{i:012d}": f"account-{i}" for i in range(5000)}
+    get_friendly_name_matcher(friendly_names)
+    built = []
+    build_trie = FriendlyNameMatcher._build_trie.__func__
+
+    def counting_build_trie(cls, names):
+        built.append(len(names))
+        return build_trie(cls, names)
+
+    monkeypatch.setattr(
+        FriendlyNameMatcher, "_build_trie", classmethod(counting_build_trie)
+    )
+    directory = AccountDirectory(
+        load_accounts=lambda: {"111111111111": "prod", "222222222222": "tooling"}
+    )
+    for principal_account_id in ["111111111111", "222222222222"]:
+        event = make_event("999999999999", "000000004999", principal_account_id)
+        augmented = get_augmented_friendly_names(event, friendly_names, directory)
+        assert augment_strings_with_friendly_names(
+            [f"Role assumed in 000000004999 by {principal_account_id}"], augmented
+        ) == [
+            f"Role assumed in 000000004999 (account-4999) by "
+            f"{principal_account_id} ({augmented[principal_account_id]})"
+        ]
+    # Only the account names of each event were compiled
+    assert built == [1, 1]
+
+
+def test_scales_to_thousands_of_friendly_names():
+    friendly_names = {f"{i:012d}": f"account-{i}" for i in range(5000)}
+    text = "Role assumed in 000000004999 by arn:aws:iam::000000000001:role/x"
+    assert augment_strings_with_friendly_names([text], friendly_names) == [
+        "Role assumed in 000000004999 (account-4999) by "
+        "arn:aws:iam::000000000001:role/x"
+    ]
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_event(account_id, recipient_account_id, principal_account_id):
+    return {
+        "account": account_id,
+        "detail": {
+            "recipientAccountId": recipient_account_id,
+            "userIdentity": {"accountId": principal_account_id},
+        },
+    }
+
+
+def test_account_directory_resolves_recipient_and_principal_accounts():
+    directory = AccountDirectory(
+        load_accounts=lambda: {"111111111111": "prod", "222222222222": "tooling"}
+    )
+    event = make_event("111111111111", "111111111111", "222222222222")
+    friendly_names = get_augmented_friendly_names(event, {}, directory=directory)
+    assert friendly_names == {"111111111111": "prod", "222222222222": "tooling"}
+
+
+def test_account_directory_does_not_override_configured_friendly_names():
+    directory = AccountDirectory(load_accounts=lambda: {"111111111111": "prod"})
+    event = make_event("111111111111", "111111111111", "111111111111")
+    friendly_names = get_augmented_friendly_names(
+        event, {"111111111111": "production"}, directory=directory
+    )
+    assert friendly_names == {"111111111111": "production"}
+
+
+def test_account_directory_reloads_after_ttl():
+    clock = FakeClock()
+    snapshots = iter([{"111111111111": "old"}, {"111111111111": "new"}])
+    directory = AccountDirectory(
+        load_accounts=lambda: next(snapshots), ttl_seconds=60, clock=clock
+    )
+    assert directory.resolve("111111111111") == "old"
+    clock.now = 59
+    assert directory.resolve("111111111111") == "old"
+    clock.now = 60
+    assert directory.resolve("111111111111") == "new"
+    assert directory.loads == 2
+
+
+def test_account_directory_keeps_snapshot_when_reload_fails():
+    clock = FakeClock()
+    calls = []
+
+    def load_accounts():
+        calls.append(clock.now)
+        if len(calls) > 1:
+            raise RuntimeError("AccessDenied")
+        return {"111111111111": "prod"}
+
+    directory = AccountDirectory(
+        load_accounts=load_accounts, ttl_seconds=60, clock=clock
+    )
+    directory.resolve("111111111111")
+    clock.now = 61
+    assert directory.resolve("111111111111") == "prod"
+    clock.now = 62
+    assert directory.resolve("111111111111") == "prod"
+    assert calls == [0, 61]
+
+
+def test_account_directory_caches_missing_aliases():
+    clock = FakeClock()
+    lookups = []
+
+    def lookup_alias(account_id):
+        lookups.append(account_id)
+        return None
+
+    directory = AccountDirectory(lookup_alias=lookup_alias, ttl_seconds=60, clock=clock)
+    event = make_event("111111111111", "111111111111", "222222222222")
+    for _ in range(10):
+        assert get_augmented_friendly_names(event, {}, directory=directory) == {}
+    # Aliases can only be looked up for the account the event was received in
+    assert lookups == ["111111111111"]
+    clock.now = 60
+    get_augmented_friendly_names(event, {}, directory=directory)
+    assert lookups == ["111111111111"] * 2
+
+
+def test_account_directory_caches_failed_alias_lookups():
+    lookups = []
+
+    def lookup_alias(account_id):
+        lookups.append(account_id)
+        raise RuntimeError("Throttling")
+
+    directory = AccountDirectory(lookup_alias=lookup_alias)
+    assert directory.resolve("111111111111", allow_alias_lookup=True) is None
+    assert directory.resolve("111111111111", allow_alias_lookup=True) is None
+    assert lookups == ["111111111111"]
+
+
+def sqs_record(message_id, text, channel="#alerts", webhook="https://hooks/a"):
+    return {
+        "messageId": message_id,
+        "body": json.dumps(
+            {
+                "slackWebhookUrl": webhook,
+                "slackChannel": channel,
+                "slackPayload": {"text": text},
+            }
+        ),
+    }
+
+
+@pytest.fixture
+def posted(monkeypatch):
+    posted = []
+    lock = threading.Lock()
+
+    def fake_post_to_slack(slack_payload, slack_webhook_url, deadline=None):
+        if slack_payload["text"].startswith("fail"):
+            raise Exception("Request to slack failed after 1 attempt(s): 500")
+        with lock:
+            posted.append(
+                (slack_webhook_url, slack_payload["channel"], slack_payload["text"])
+            )
+
+    monkeypatch.setattr(main, "post_to_slack", fake_post_to_slack)
+    return posted
+
+
+def test_forwarder_reports_only_failed_records(posted):
+    event = {
+        "Records": [
+            sqs_record("1", "one", channel="#a"),
+            sqs_record("2", "fail", channel="#b"),
+            sqs_record("3", "three", channel="#c"),
+            {"messageId": "4", "body": "not json"},
+        ]
+    }
+    result = handler_slack_forwarder(event, None)
+    assert result == {
+        "batchItemFailures": [{"itemIdentifier": "2"}, {"itemIdentifier": "4"}]
+    }
+    assert sorted(text for _, _, text in posted) == ["one", "three"]
+
+
+def test_forwarder_preserves_order_per_channel(posted):
+    records = [
+        sqs_record(str(i), f"{channel}-{i}", channel=channel)
+        for i in range(20)
+        for channel in ["#a", "#b", "#c"]
+    ]
+    result = handler_slack_forwarder({"Records": records}, None)
+    assert result == {"batchItemFailures": []}
+    for channel in ["#a", "#b", "#c"]:
+        texts = [text for _, c, text in posted if c == channel]
+        assert texts == [f"{channel}-{i}" for i in range(20)]
+
+
+def test_forwarder_fails_remaining_records_in_channel_after_failure(posted):
+    records = [
+        sqs_record("1", "one", channel="#a"),
+        sqs_record("2", "fail", channel="#a"),
+        sqs_record("3", "three", channel="#a"),
+        sqs_record("4", "four", channel="#b"),
+    ]
+    result = handler_slack_forwarder({"Records": records}, None)
+    assert result == {
+        "batchItemFailures": [{"itemIdentifier": "2"}, {"itemIdentifier": "3"}]
+    }
+    assert sorted(text for _, _, text in posted) == ["four", "one"]
+
+
+def test_forwarder_fails_invocation_when_no_record_was_forwarded(posted):
+    records = [
+        sqs_record("1", "fail", channel="#a"),
+        sqs_record("2", "fail", channel="#b"),
+    ]
+    with pytest.raises(Exception, match="Failed to forward all 2 record"):
+        handler_slack_forwarder({"Records": records}, None)
+
+
+def cloudtrail_event(event_source, event_name, **detail):
+    return {
+        "account": "111111111111",
+        "detail-type": "AWS API Call via CloudTrail",
+        "id": "e1",
+        "detail": {
+            "eventSource": event_source,
+            "eventName": event_name,
+            "eventType": "AwsApiCall",
+            "eventTime": "2024-01-01T00:00:00Z",
+            "recipientAccountId": "111111111111",
+            "sourceIPAddress": "192.0.2.1",
+            "userIdentity": {
+                "type": "AssumedRole",
+                "principalId": "AROAEXAMPLE:jane",
+                "accountId": "222222222222",
+                "arn": "arn:aws:sts::222222222222:assumed-role/admin/jane",
+            },
+            **detail,
+        },
+    }
+
+
+EVENT_CORPUS = [
+    (
+        cloudtrail_event(
+            "sts.amazonaws.com",
+            "AssumeRole",
+            requestParameters={
+                "roleArn": "arn:aws:iam::111111111111:role/deploy",
+                "sourceIdentity": "jane",
+            },
+        ),
+        ":warning: Sensitive role in `111111111111 (prod)` assumed by IAM role "
+        "in `222222222222 (tooling)`",
+    ),
+    (
+        cloudtrail_event(
+            "signin.amazonaws.com",
+            "ConsoleLogin",
+            eventType="AwsConsoleSignIn",
+            userIdentity={"type": "Root", "accountId": "111111111111"},
+            responseElements={"ConsoleLogin": "Failure"},
+            errorMessage="Failed authentication",
+        ),
+        ":warning: Root user failed to log in to the console in `111111111111 (prod)`",
+    ),
+    (
+        cloudtrail_event(
+            "iam.amazonaws.com",
+            "CreateAccessKey",
+            requestParameters={"userName": "ci"},
+            responseElements={"accessKey": {"accessKeyId": "AKIAEXAMPLE"}},
+        ),
+        ":warning: IAM access key created for `ci` in `111111111111 (prod)`",
+    ),
+    (
+        cloudtrail_event(
+            "kms.amazonaws.com",
+            "ScheduleKeyDeletion",
+            requestParameters={"keyId": "1234abcd", "pendingWindowInDays": 7},
+            responseElements={"deletionDate": "Jan 8, 2024, 12:00:00 AM"},
+        ),
+        ":warning: KMS key scheduled for deletion in `111111111111 (prod)`",
+    ),
+    (
+        cloudtrail_event(
+            "iam.amazonaws.com",
+            "PasswordUpdated",
+            responseElements=None,
+        ),
+        ":warning: CloudTrail event in account `111111111111 (prod)`",
+    ),
+]
+
+
+@pytest.mark.parametrize("event,expected_pretext", EVENT_CORPUS)
+def test_render_event_dispatches_to_registered_renderer(event, expected_pretext):
+    friendly_names = {"111111111111": "prod", "222222222222": "tooling"}
+    payload = render_event(CloudTrailEvent.from_event(event), friendly_names)
+    [attachment] = payload["attachments"]
+    assert attachment["pretext"] == expected_pretext
+    assert "*Timestamp:*" in attachment["text"] or "*Event Time:*" in attachment["text"]
+
+
+def test_render_event_falls_back_when_renderer_fails():
+    # A malformed access key in the response makes the renderer fail
+    event = cloudtrail_event(
+        "iam.amazonaws.com", "CreateAccessKey", responseElements={"accessKey": "x"}
+    )
+    payload = render_event(CloudTrailEvent.from_event(event), {})
+    assert payload["attachments"][0]["pretext"] == (
+        ":warning: CloudTrail event in account `111111111111`"
+    )
+
+
+def test_handler_event_transformer_renders_corpus(monkeypatch):
+    monkeypatch.setenv("FRIENDLY_NAMES", "{}")
+    monkeypatch.setenv("SLACK_WEBHOOK_URL", "https://hooks/a")
+    monkeypatch.setenv("SLACK_CHANNEL", "#alerts")
+    posted = []
+    monkeypatch.setattr(
+        main,
+        "post_to_slack",
+        lambda payload, url, deadline=None: posted.append(payload),
+    )
+    monkeypatch.setattr(
+        main, "account_directory", AccountDirectory(lookup_alias=lambda _: None)
+    )
+    for event, _ in EVENT_CORPUS:
+        handler_event_transformer(event, None)
+    assert [payload["channel"] for payload in posted] == ["#alerts"] * len(EVENT_CORPUS)
+
+
+def test_dump_event_is_unchanged_for_small_events():
+    event = cloudtrail_event("iam.amazonaws.com", "PasswordUpdated")
+    assert json.loads(dump_event(event)) == event
+
+
+def test_dump_event_puts_key_fields_first_and_summarizes_large_values():
+    event = cloudtrail_event(
+        "s3.amazonaws.com",
+        "PutBucketPolicy",
+        resources=[{"ARN": f"arn:aws:s3:::bucket-{i}"} for i in range(100)],
+        requestParameters={"policy": "x" * 10_000, "a": {"b": {"c": {"d": {"e": 1}}}}},
+    )
+    dumped = json.loads(dump_event(event, max_bytes=100_000))
+    assert list(dumped)[:2] == ["detail-type", "account"]
+    assert list(dumped["detail"])[:2] == ["eventSource", "eventName"]
+    assert dumped["detail"]["resources"][-1] == "<95 more item(s) elided>"
+    assert dumped["detail"]["requestParameters"]["policy"].endswith(
+        "... <9488 char(s) elided>"
+    )
+    assert dumped["detail"]["requestParameters"]["a"]["b"]["c"]["d"] == (
+        "<object with 1 key(s) elided>"
+    )
+
+
+def test_dump_event_stays_within_budget():
+    event = cloudtrail_event(
+        "s3.amazonaws.com",
+        "PutBucketPolicy",
+        requestParameters={f"key{i}": "ü" * 500 for i in range(40)},
+    )
+    dumped = dump_event(event, max_bytes=2000)
+    assert len(dumped.encode("utf-8")) <= 2000
+    assert dumped.endswith("\n... <truncated>")
+    assert '"eventName": "PutBucketPolicy"' in dumped
+
+
+def test_deduplication_cache_expires_and_evicts_ids():
+    clock = FakeClock()
+    cache = DeduplicationCache(ttl_seconds=300, max_size=2, clock=clock)
+    cache.add("a")
+    cache.add("b")
+    cache.add("c")
+    # "a" is evicted as the cache is full
+    assert not cache.contains("a")
+    assert cache.contains("b")
+    clock.now = 299
+    assert cache.contains("c")
+    clock.now = 300
+    assert not cache.contains("c")
+    assert (cache.hits, cache.forwarded) == (2, 3)
+
+
+def test_handler_event_transformer_skips_duplicates_before_sqs(monkeypatch):
+    monkeypatch.setenv("FRIENDLY_NAMES", "{}")
+    monkeypatch.setenv("SLACK_WEBHOOK_URL", "https://hooks/a")
+    monkeypatch.setenv("SLACK_CHANNEL", "#alerts")
+    monkeypatch.setenv("DEDUPLICATE_EVENTS", "true")
+    monkeypatch.setenv("SQS_QUEUE_URL", "https://sqs/queue.fifo")
+    monkeypatch.setattr(main, "deduplication_cache", DeduplicationCache())
+    monkeypatch.setattr(
+        main, "account_directory", AccountDirectory(lookup_alias=lambda _: None)
+    )
+
+    class FakeSqs:
+        def __init__(self):
+            self.deduplication_ids = []
+            self.fail = False
+
+        def send_message(self, **kwargs):
+            if self.fail:
+                raise RuntimeError("ServiceUnavailable")
+            self.deduplication_ids.append(kwargs["MessageDeduplicationId"])
+
+    sqs = FakeSqs()
+    monkeypatch.setattr(main, "get_client", lambda service_name: sqs)
+
+    first = cloudtrail_event("iam.amazonaws.com", "PasswordUpdated", requestID="r1")
+    second = cloudtrail_event("iam.amazonaws.com", "PasswordUpdated", requestID="r2")
+    sqs.fail = True
+    with pytest.raises(RuntimeError):
+        handler_event_transformer(second, None)
+    sqs.fail = False
+    for event in [first, first, second, first]:
+        handler_event_transformer(event, None)
+    assert sqs.deduplication_ids == ["r1", "r2"]
+    assert main.deduplication_cache.hits == 2
+
+
+def test_suppression_rule_requires_all_conditions_to_match():
+    rule = SuppressionRule.from_dict(
+        {
+            "principalArns": ["arn:aws:sts::222222222222:assumed-role/ci-*"],
+            "sourceIpCidrs": ["192.0.2.0/24", "2001:db8::/32"],
+            "eventNames": ["AssumeRole"],
+        }
+    )
+    event = cloudtrail_event(
+        "sts.amazonaws.com",
+        "AssumeRole",
+        userIdentity={"arn": "arn:aws:sts::222222222222:assumed-role/ci-deploy/x"},
+    )
+    assert rule.matches(CloudTrailEvent.from_event(event))
+    event["detail"]["sourceIPAddress"] = "2001:db8::1"
+    assert rule.matches(CloudTrailEvent.from_event(event))
+    event["detail"]["sourceIPAddress"] = "198.51.100.1"
+    assert not rule.matches(CloudTrailEvent.from_event(event))
+    event["detail"]["sourceIPAddress"] = "sts.amazonaws.com"
+    assert not rule.matches(CloudTrailEvent.from_event(event))
+
+
+def test_suppression_rules_use_first_matching_rule():
+    rules = SuppressionRules.from_json(
+        json.dumps(
+            [
+                {"accountIds": ["111111111111"], "action": "DOWNGRADE"},
+                {"eventNames": ["ConsoleLogin"], "action": "DROP"},
+            ]
+        )
+    )
+    event = cloudtrail_event("signin.amazonaws.com", "ConsoleLogin")
+    assert rules.evaluate(CloudTrailEvent.from_event(event)) == "DOWNGRADE"
+    event["detail"]["recipientAccountId"] = "333333333333"
+    assert rules.evaluate(CloudTrailEvent.from_event(event)) == "DROP"
+    event["detail"]["eventName"] = "CreateAccessKey"
+    assert rules.evaluate(CloudTrailEvent.from_event(event)) is None
+
+
+def test_suppression_rules_reject_unknown_actions():
+    with pytest.raises(ValueError):
+        SuppressionRules.from_json('[{"action": "IGNORE"}]')
+
+
+def test_suppression_rules_scale_to_hundreds_of_rules():
+    rules = SuppressionRules(
+        [
+            SuppressionRule(
+                event_names=[f"Event{i}"],
+                source_ip_cidrs=[f"10.{i // 256}.{i % 256}.0/24"],
+            )
+            for i in range(500)
+        ]
+        + [SuppressionRule(action="DOWNGRADE", source_ip_cidrs=["10.1.244.0/24"])]
+    )
+    event = cloudtrail_event(
+        "iam.amazonaws.com", "Event499", sourceIPAddress="10.1.243.7"
+    )
+    assert rules.evaluate(CloudTrailEvent.from_event(event)) == "DROP"
+    event["detail"]["eventName"] = "Event0"
+    assert rules.evaluate(CloudTrailEvent.from_event(event)) is None
+    event["detail"]["sourceIPAddress"] = "10.1.244.7"
+    assert rules.evaluate(CloudTrailEvent.from_event(event)) == "DOWNGRADE"
+
+
+def test_handler_event_transformer_applies_suppression_rules_first(monkeypatch):
+    monkeypatch.setenv("FRIENDLY_NAMES", "{}")
+    monkeypatch.setenv("SLACK_WEBHOOK_URL", "https://hooks/a")
+    monkeypatch.setenv("SLACK_CHANNEL", "#alerts")
+    monkeypatch.setattr(
+        main,
+        "suppression_rules",
+        SuppressionRules(
+            [
+                SuppressionRule(action="DROP", event_names=["AssumeRole"]),
+                SuppressionRule(action="DOWNGRADE", event_names=["ConsoleLogin"]),
+            ]
+        ),
+    )
+
+    lookups = []
+    monkeypatch.setattr(
+        main, "account_directory", AccountDirectory(lookup_alias=lookups.append)
+    )
+    posted = []
+    monkeypatch.setattr(
+        main,
+        "post_to_slack",
+        lambda payload, url, deadline=None: posted.append(payload),
+    )
+    handler_event_transformer(cloudtrail_event("sts.amazonaws.com", "AssumeRole"), None)
+    assert posted == []
+    assert lookups == []
+
+    handler_event_transformer(
+        cloudtrail_event("signin.amazonaws.com", "ConsoleLogin"), None
+    )
+    [attachment] = posted[0]["attachments"]
+    assert attachment["pretext"].startswith(":information_source:")
+    assert "color" not in attachment
+
+
+ROUTES = [
+    {
+        "accountIds": ["111111111111"],
+        "slackWebhookUrl": "https://hooks/prod",
+        "slackChannel": "#prod",
+    },
+    {
+        "principalTypes": ["Root"],
+        "slackWebhookUrl": "https://hooks/security",
+        "slackChannel": "#security",
+    },
+    {
+        "accountIds": ["111111111111"],
+        "eventNames": ["ConsoleLogin"],
+        "slackWebhookUrl": "https://hooks/security",
+        "slackChannel": "#security",
+    },
+]
+
+
+def test_routing_table_resolves_all_matching_routes():
+    table = RoutingTable(ROUTES)
+    event = cloudtrail_event(
+        "signin.amazonaws.com", "ConsoleLogin", userIdentity={"type": "Root"}
+    )
+    assert table.resolve(CloudTrailEvent.from_event(event)) == [
+        ("https://hooks/prod", "#prod"),
+        ("https://hooks/security", "#security"),
+    ]
+    event["detail"]["recipientAccountId"] = "333333333333"
+    assert table.resolve(CloudTrailEvent.from_event(event)) == [
+        ("https://hooks/security", "#security"),
+    ]
+    event["detail"]["userIdentity"]["type"] = "IAMUser"
+    assert table.resolve(CloudTrailEvent.from_event(event)) == []
+
+
+def test_handler_event_transformer_fans_out_to_routes(monkeypatch):
+    monkeypatch.setenv("FRIENDLY_NAMES", "{}")
+    monkeypatch.setenv("SLACK_WEBHOOK_URL", "https://hooks/default")
+    monkeypatch.setenv("SLACK_CHANNEL", "#default")
+    monkeypatch.setattr(main, "routing_table", RoutingTable(ROUTES))
+    monkeypatch.setattr(
+        main, "account_directory", AccountDirectory(lookup_alias=lambda _: None)
+    )
+    posted = []
+    lock = threading.Lock()
+
+    def fake_post_to_slack(payload, url, deadline=None):
+        with lock:
+            posted.append((url, payload["channel"]))
+
+    monkeypatch.setattr(main, "post_to_slack", fake_post_to_slack)
+
+    handler_event_transformer(
+        cloudtrail_event("signin.amazonaws.com", "ConsoleLogin"), None
+    )
+    assert sorted(posted) == [
+        ("https://hooks/prod", "#prod"),
+        ("https://hooks/security", "#security"),
+    ]
+    posted.clear()
+    event = cloudtrail_event("iam.amazonaws.com", "PasswordUpdated")
+    event["detail"]["recipientAccountId"] = "333333333333"
+    handler_event_transformer(event, None)
+    assert posted == [("https://hooks/default", "#default")]
+
+
+def test_coalesce_slack_messages_respects_slack_limits():
+    def message(message_id, attachments=1, **extra):
+        return (
+            [message_id],
+            "https://hooks/a",
+            {
+                "channel": "#a",
+                "attachments": [{"text": message_id}] * attachments,
+                **extra,
+            },
+        )
+
+    coalesced = coalesce_slack_messages(
+        [
+            message("1"),
+            message("2", attachments=2),
+            message("3"),
+            message("4", text="Not mergeable"),
+            message("5"),
+            message("6", attachments=3),
+        ],
+        max_attachments=4,
+    )
+    assert [(ids, len(payload["attachments"])) for ids, _, payload in coalesced] == [
+        (["1", "2", "3"], 4),
+        (["4"], 1),
+        (["5", "6"], 4),
+    ]
+    coalesced = coalesce_slack_messages(
+        [message("1"), message("2"), message("3")], max_bytes=40
+    )
+    assert [ids for ids, _, _ in coalesced] == [["1", "2"], ["3"]]
+
+
+def test_forwarder_coalesces_records_and_tracks_failures(monkeypatch):
+    records = [
+        sqs_record("1", "one", channel="#a"),
+        sqs_record("2", "two", channel="#a"),
+        sqs_record("3", "three", channel="#b"),
+    ]
+    for record in records:
+        body = json.loads(record["body"])
+        body["slackPayload"] = {"attachments": [{"text": body["slackPayload"]["text"]}]}
+        record["body"] = json.dumps(body)
+    calls = []
+
+    def fake_post_to_slack(slack_payload, slack_webhook_url, deadline=None):
+        calls.append(slack_payload)
+        if slack_payload["channel"] == "#b":
+            raise Exception("Request to slack failed after 1 attempt(s): 500")
+
+    monkeypatch.setattr(main, "post_to_slack", fake_post_to_slack)
+    failed = forward_records_to_slack(records, deadline=None, coalesce=True)
+    assert failed == ["3"]
+    assert sorted(len(call["attachments"]) for call in calls) == [1, 2]
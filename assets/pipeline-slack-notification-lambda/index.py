@@ -1,9 +1,19 @@
+import bisect
+import http.client
+import io
 import json
 import os
+import select
+import threading
+import time
 import typing as t
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime
 from urllib.error import HTTPError, URLError
-from urllib.parse import quote
-from urllib.request import Request, urlopen
+from urllib.parse import quote, urlsplit
+from urllib.request import Request
 
 import boto3
 
@@ -15,6 +25,14 @@ ACCOUNT_FRIENDLY_NAME = os.getenv("ACCOUNT_FRIENDLY_NAME", None)
 SLACK_URL_SECRET_NAME = os.getenv("SLACK_URL_SECRET_NAME", None)
 NOTIFICATION_LEVEL = os.getenv("NOTIFICATION_LEVEL", "WARN")
 SLACK_MENTIONS = os.getenv("SLACK_MENTIONS", None)
+SLACK_URL_SECRET_TTL_SECONDS = float(os.getenv("SLACK_URL_SECRET_TTL_SECONDS", "300"))
+SLACK_URL_SECRET_VERSION_STAGE = os.getenv(
+    "SLACK_URL_SECRET_VERSION_STAGE", "AWSCURRENT"
+)
+
+# Where the recent terminal executions of each pipeline are kept between
+# invocations: "memory", "file:<path>" or "dynamodb:<table name>"
+STATE_STORE = os.getenv("STATE_STORE", "memory")
 
 # Example event:
 #
@@ -33,6 +51,7 @@ SLACK_MENTIONS = os.getenv("SLACK_MENTIONS", None)
 #     pipeline: 'hst-tester-pipeline-PipelineC660917D-OLEMKURBGPBG',
 #     'execution-id': '91daefbf-658a-4c6f-ad9e-13de7df5eaeb',
 #     state: 'SUCCEEDED',
+#     'start-time': '2021-06-11T22:58:02.611Z',
 #     version: 3
 #   }
 # }
@@ -74,15 +93,24 @@ def get_masked_slack_webhook_url(slack_webhook_url: str):
     return "/".join(url + [len(final_path_segment) * "*"])
 
 
-def get_previous_pipeline_execution(
-    pipeline_name: str, execution_id: str
-) -> dict | None:
-    """Return the newest past execution that either succeeded or failed"""
+# The status of an execution in list_pipeline_executions for each state in events
+EXECUTION_STATUSES = {
+    "STARTED": "InProgress",
+    "RESUMED": "InProgress",
+    "STOPPING": "Stopping",
+    "STOPPED": "Stopped",
+    "SUCCEEDED": "Succeeded",
+    "FAILED": "Failed",
+    "SUPERSEDED": "Superseded",
+    "CANCELED": "Cancelled",
+}
 
-    pipeline_executions = client.list_pipeline_executions(
-        pipelineName=pipeline_name,
-    )["pipelineExecutionSummaries"]
 
+def find_previous_execution(
+    pipeline_executions: list[dict], execution_id: str
+) -> dict | None:
+    """Return the newest execution older than the given one that either
+    succeeded or failed, from a list of executions ordered newest first"""
     is_next = False
 
     for item in pipeline_executions:
@@ -97,7 +125,466 @@ def get_previous_pipeline_execution(
     return None
 
 
-def get_text_for_failed(pipeline_name: str, execution_id: str, state: str) -> str:
+# Statuses that an execution can still change from
+NON_TERMINAL_STATUSES = ("InProgress", "Stopping")
+
+
+def has_stale_status_before(
+    pipeline_executions: list[dict],
+    execution_id: str,
+    previous: dict,
+    fresh_execution_ids: set[str],
+) -> bool:
+    """Return whether an execution between the given one and `previous` has a
+    non-terminal status that was not just fetched, and so may since have
+    succeeded or failed"""
+    is_between = False
+
+    for item in pipeline_executions:
+        if item is previous:
+            return False
+        if (
+            is_between
+            and item["status"] in NON_TERMINAL_STATUSES
+            and item["pipelineExecutionId"] not in fresh_execution_ids
+        ):
+            return True
+        if item["pipelineExecutionId"] == execution_id:
+            is_between = True
+
+    return False
+
+
+class PipelineExecutionHistory:
+    """Summaries of the recent executions of each pipeline, kept across warm
+    invocations.
+
+    The summaries of a pipeline are the newest executions as returned by
+    `list_pipeline_executions` (newest first), capped at
+    `max_executions_per_pipeline`. Lookups are answered from the summaries
+    when possible. Otherwise, or when a cached execution the answer depends
+    on has not finished yet and may have since, pages are fetched until the
+    answer is found or the history is exhausted, and since a page that reaches the cached
+    summaries is merged with them, a steady stream of executions costs at
+    most one page each. Statuses are kept up to date from incoming events.
+
+    Lookups abandoned after a deadline may still be running while the next
+    event is handled, so the summaries are never changed in place. The list
+    of a pipeline is replaced as a whole under a lock instead, and pages are
+    fetched without holding it.
+    """
+
+    def __init__(self, client, max_executions_per_pipeline: int = 100):
+        self._client = client
+        self._max_executions_per_pipeline = max_executions_per_pipeline
+        self._executions: dict[str, list[dict]] = {}
+        self._lock = threading.Lock()
+        self.pages_fetched = 0
+
+    def record_state(self, pipeline_name: str, execution_id: str, state: str):
+        """Update the status of a cached execution from a state change event"""
+        status = EXECUTION_STATUSES.get(state)
+        if not status:
+            return
+        with self._lock:
+            cached = self._executions.get(pipeline_name)
+            if cached is None:
+                return
+            self._executions[pipeline_name] = [
+                {**summary, "status": status}
+                if summary["pipelineExecutionId"] == execution_id
+                else summary
+                for summary in cached
+            ]
+
+    def get_previous(self, pipeline_name: str, execution_id: str) -> dict | None:
+        """Return the newest past execution that either succeeded or failed"""
+        with self._lock:
+            cached = self._executions.get(pipeline_name, [])
+        previous = find_previous_execution(cached, execution_id)
+        if previous is not None and not has_stale_status_before(
+            cached, execution_id, previous, set()
+        ):
+            return previous
+
+        cached_by_id = {summary["pipelineExecutionId"]: summary for summary in cached}
+        newer, older = [], []
+        refreshed = {}
+        fetched_ids = set()
+        reached_cached = False
+        kwargs = {"pipelineName": pipeline_name}
+        while True:
+            response = self._client.list_pipeline_executions(**kwargs)
+            self.pages_fetched += 1
+            for summary in response["pipelineExecutionSummaries"]:
+                fetched_ids.add(summary["pipelineExecutionId"])
+                cached_summary = cached_by_id.get(summary["pipelineExecutionId"])
+                if cached_summary is not None:
+                    refreshed[summary["pipelineExecutionId"]] = {
+                        **cached_summary,
+                        **summary,
+                    }
+                    reached_cached = True
+                elif reached_cached:
+                    older.append(summary)
+                else:
+                    newer.append(summary)
+            # The cached summaries can only be used once the pages have reached
+            # them, as there may otherwise be executions missing in between
+            executions = (
+                newer
+                + [
+                    refreshed.get(summary["pipelineExecutionId"], summary)
+                    for summary in cached
+                ]
+                + older
+                if reached_cached
+                else newer
+            )
+            previous = find_previous_execution(executions, execution_id)
+            if "nextToken" not in response or (
+                previous is not None
+                and not has_stale_status_before(
+                    executions, execution_id, previous, fetched_ids
+                )
+            ):
+                break
+            kwargs["nextToken"] = response["nextToken"]
+
+        with self._lock:
+            current_by_id = {
+                summary["pipelineExecutionId"]: summary
+                for summary in self._executions.get(pipeline_name, [])
+            }
+            merged = []
+            for summary in executions[: self._max_executions_per_pipeline]:
+                current = current_by_id.get(summary["pipelineExecutionId"])
+                # A summary replaced while the pages were fetched, e.g. with a
+                # status recorded from an event, is newer than the pages
+                if current is not None and current is not cached_by_id.get(
+                    summary["pipelineExecutionId"]
+                ):
+                    summary = current
+                merged.append(summary)
+            self._executions[pipeline_name] = merged
+        return previous
+
+
+execution_history = PipelineExecutionHistory(client)
+
+
+def get_previous_pipeline_execution(
+    pipeline_name: str, execution_id: str, start_time: float | None = None
+) -> dict | None:
+    """Return the newest past execution that either succeeded or failed.
+
+    The status store is used when the start time of the execution is known,
+    and the execution history of the pipeline otherwise or on a miss.
+    """
+    if start_time is not None:
+        previous = status_store.get_previous(pipeline_name, execution_id, start_time)
+        if previous is not None:
+            return previous
+
+    previous = execution_history.get_previous(pipeline_name, execution_id)
+    previous_start_time = parse_start_time((previous or {}).get("startTime"))
+    if start_time is not None and previous_start_time is not None:
+        status_store.record(
+            pipeline_name,
+            previous["pipelineExecutionId"],
+            previous["status"],
+            previous_start_time,
+        )
+    return previous
+
+
+class MemoryStore:
+    """Store of JSON documents kept in the memory of the container."""
+
+    def __init__(self):
+        self._documents: dict[str, dict] = {}
+
+    def get(self, key: str) -> dict | None:
+        document = self._documents.get(key)
+        return json.loads(json.dumps(document)) if document is not None else None
+
+    def put(self, key: str, document: dict):
+        self._documents[key] = json.loads(json.dumps(document))
+
+    def update(self, key: str, func) -> dict:
+        """Store and return `func` applied to the document, or to None if
+        there is none yet."""
+        document = func(self.get(key))
+        self.put(key, document)
+        return document
+
+
+class FileStore:
+    """Store of JSON documents kept in a single local file, e.g. in /tmp."""
+
+    def __init__(self, path: str):
+        self._path = path
+
+    def _read(self) -> dict:
+        try:
+            with open(self._path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def get(self, key: str) -> dict | None:
+        return self._read().get(key)
+
+    def put(self, key: str, document: dict):
+        documents = self._read()
+        documents[key] = document
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(documents, f)
+        os.replace(tmp_path, self._path)
+
+    def update(self, key: str, func) -> dict:
+        """Store and return `func` applied to the document, or to None if
+        there is none yet."""
+        document = func(self.get(key))
+        self.put(key, document)
+        return document
+
+
+class DynamoDbStore:
+    """Store of JSON documents in a DynamoDB table with the string partition
+    key `pk`. Documents are kept as JSON in the `document` attribute.
+
+    The table is shared by all containers, so `update` only writes a document
+    if its `version` attribute is unchanged since it was read, and otherwise
+    applies the update again to the newer document."""
+
+    def __init__(self, client, table_name: str, max_attempts: int = 10):
+        self._client = client
+        self._table_name = table_name
+        self._max_attempts = max_attempts
+
+    def _get_item(self, key: str) -> dict | None:
+        response = self._client.get_item(
+            TableName=self._table_name,
+            Key={"pk": {"S": key}},
+            ConsistentRead=True,
+        )
+        return response.get("Item")
+
+    def get(self, key: str) -> dict | None:
+        item = self._get_item(key)
+        return json.loads(item["document"]["S"]) if item else None
+
+    def put(self, key: str, document: dict):
+        self._client.put_item(
+            TableName=self._table_name,
+            Item={"pk": {"S": key}, "document": {"S": json.dumps(document)}},
+        )
+
+    def update(self, key: str, func) -> dict:
+        """Store and return `func` applied to the document, or to None if
+        there is none yet. `func` is called again if the document was changed
+        concurrently, so it should only depend on the document it is given."""
+        for _ in range(self._max_attempts):
+            item = self._get_item(key)
+            document = func(json.loads(item["document"]["S"]) if item else None)
+            if item is None:
+                condition = {"ConditionExpression": "attribute_not_exists(pk)"}
+                version = 0
+            elif "version" not in item:
+                condition = {
+                    "ConditionExpression": "attribute_not_exists(#version)",
+                    "ExpressionAttributeNames": {"#version": "version"},
+                }
+                version = 0
+            else:
+                version = int(item["version"]["N"])
+                condition = {
+                    "ConditionExpression": "#version = :version",
+                    "ExpressionAttributeNames": {"#version": "version"},
+                    "ExpressionAttributeValues": {":version": {"N": str(version)}},
+                }
+            try:
+                self._client.put_item(
+                    TableName=self._table_name,
+                    Item={
+                        "pk": {"S": key},
+                        "document": {"S": json.dumps(document)},
+                        "version": {"N": str(version + 1)},
+                    },
+                    **condition,
+                )
+                return document
+            except self._client.exceptions.ConditionalCheckFailedException:
+                print(f"Document {key} was changed concurrently, retrying")
+        raise Exception(
+            f"Could not update document {key}: changed concurrently "
+            f"{self._max_attempts} times"
+        )
+
+
+def store_from_spec(spec: str):
+    """Create a store from a spec such as "memory", "file:/tmp/pipelines.json"
+    or "dynamodb:my-table"."""
+    kind, _, location = spec.partition(":")
+    if kind == "memory":
+        return MemoryStore()
+    if kind == "file" and location:
+        return FileStore(location)
+    if kind == "dynamodb" and location:
+        return DynamoDbStore(boto3.client("dynamodb"), location)
+    raise ValueError(f"Unknown store: {spec}")
+
+
+def parse_start_time(value) -> float | None:
+    """Return a start time from an event or an execution summary as a
+    timestamp"""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+class PipelineStatusStore:
+    """The recent executions of each pipeline that either succeeded or failed,
+    recorded from incoming events.
+
+    Executions are ordered by start time, so events that arrive out of order
+    (e.g. an older execution finishing after a newer one) are placed where
+    they belong. The previous execution of an execution is only answered when
+    one started before it is known, otherwise the caller has to fall back to
+    the CodePipeline API, and should record the answer with `record` so the
+    next lookup is a hit.
+
+    Executions that finished before the store was first used are only known
+    from the answers of the API, which are always the previous execution of
+    an execution that is known too. So apart from executions that were
+    already running when the store was first used, the newest known
+    execution that started before another one is also its previous execution.
+    """
+
+    def __init__(self, store, max_executions_per_pipeline: int = 20):
+        self._store = store
+        self._max_executions_per_pipeline = max_executions_per_pipeline
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, pipeline_name: str) -> str:
+        return f"pipeline#{pipeline_name}"
+
+    def record(
+        self, pipeline_name: str, execution_id: str, status: str, start_time: float
+    ):
+        """Record the terminal status of an execution"""
+        if status not in ("Succeeded", "Failed"):
+            return
+
+        def record(document: dict | None) -> dict:
+            document = document or {"executions": []}
+            executions = [
+                e for e in document["executions"] if e["executionId"] != execution_id
+            ]
+            executions.append(
+                {"executionId": execution_id, "status": status, "startTime": start_time}
+            )
+            executions.sort(key=lambda e: e["startTime"], reverse=True)
+            document["executions"] = executions[: self._max_executions_per_pipeline]
+            return document
+
+        self._store.update(self._key(pipeline_name), record)
+
+    def get_previous(
+        self, pipeline_name: str, execution_id: str, start_time: float
+    ) -> dict | None:
+        """Return the newest known execution that started before the given
+        one, or None on a miss"""
+        document = self._store.get(self._key(pipeline_name)) or {"executions": []}
+        for execution in document["executions"]:
+            if (
+                execution["startTime"] < start_time
+                and execution["executionId"] != execution_id
+            ):
+                self.hits += 1
+                return {
+                    "pipelineExecutionId": execution["executionId"],
+                    "status": execution["status"],
+                }
+        self.misses += 1
+        return None
+
+
+status_store = PipelineStatusStore(store_from_spec(STATE_STORE))
+
+
+def record_terminal_state(event):
+    """Record the state of an execution from a state change event"""
+    detail = event["detail"]
+    start_time = parse_start_time(detail.get("start-time"))
+    status = EXECUTION_STATUSES.get(detail["state"])
+    if start_time is not None and status is not None:
+        status_store.record(
+            detail["pipeline"], detail["execution-id"], status, start_time
+        )
+
+
+class ExecutionContext:
+    """The action executions of a single pipeline execution, fetched once (all
+    pages) on first use and indexed by status and action category."""
+
+    def __init__(self, client, pipeline_name: str, execution_id: str):
+        self._client = client
+        self.pipeline_name = pipeline_name
+        self.execution_id = execution_id
+        self._lock = threading.Lock()
+        self._action_executions: list[dict] | None = None
+        self._by_status: dict[str, list[dict]] = {}
+        self._by_category: dict[str, list[dict]] = {}
+
+    def _fetch(self):
+        action_executions = []
+        kwargs = {
+            "pipelineName": self.pipeline_name,
+            "filter": {"pipelineExecutionId": self.execution_id},
+        }
+        while True:
+            response = self._client.list_action_executions(**kwargs)
+            action_executions.extend(response["actionExecutionDetails"])
+            if "nextToken" not in response:
+                break
+            kwargs["nextToken"] = response["nextToken"]
+        for action_execution in action_executions:
+            self._by_status.setdefault(action_execution["status"], []).append(
+                action_execution
+            )
+            category = action_execution["input"]["actionTypeId"]["category"]
+            self._by_category.setdefault(category, []).append(action_execution)
+        self._action_executions = action_executions
+
+    def _ensure_fetched(self):
+        with self._lock:
+            if self._action_executions is None:
+                self._fetch()
+
+    @property
+    def action_executions(self) -> list[dict]:
+        self._ensure_fetched()
+        return self._action_executions
+
+    def action_executions_with_status(self, status: str) -> list[dict]:
+        self._ensure_fetched()
+        return self._by_status.get(status, [])
+
+    def action_executions_in_category(self, category: str) -> list[dict]:
+        self._ensure_fetched()
+        return self._by_category.get(category, [])
+
+
+def get_text_for_failed(execution_context: ExecutionContext, state: str) -> str:
     """Return a Slack-formatted string that describes failed pipeline execution actions,
     if any, in a failed execution"""
 
@@ -107,23 +594,15 @@ def get_text_for_failed(pipeline_name: str, execution_id: str, state: str) -> st
     if state != "FAILED":
         return ""
 
-    action_executions = client.list_action_executions(
-        pipelineName=pipeline_name,
-        filter={
-            "pipelineExecutionId": execution_id,
-        },
-    )["actionExecutionDetails"]
-
     failures = []
 
-    for action_execution in action_executions:
-        if action_execution["status"] == "Failed":
-            stage = action_execution["stageName"]
-            action = action_execution["actionName"]
-            summary = action_execution["output"]["executionResult"][
-                "externalExecutionSummary"
-            ]
-            failures.append(f"{stage}.{action} failed:\n{summary}")
+    for action_execution in execution_context.action_executions_with_status("Failed"):
+        stage = action_execution["stageName"]
+        action = action_execution["actionName"]
+        summary = action_execution["output"]["executionResult"][
+            "externalExecutionSummary"
+        ]
+        failures.append(f"{stage}.{action} failed:\n{summary}")
 
     result = ""
 
@@ -133,28 +612,77 @@ def get_text_for_failed(pipeline_name: str, execution_id: str, state: str) -> st
     return result
 
 
+class TriggerMetadataCache:
+    """Parsed trigger files kept across warm invocations, evicting the least
+    recently used entry once `max_size` is reached.
+
+    Trigger files are read by S3 version ID, and a given version of an
+    object never changes, so the entries never need to be refreshed.
+    """
+
+    def __init__(self, max_size: int = 128):
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        # (bucket, key, version ID) -> parsed trigger file
+        self._entries: OrderedDict[tuple[str, str, str], TriggerMetadata] = (
+            OrderedDict()
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, bucket: str, key: str, version_id: str) -> TriggerMetadata | None:
+        with self._lock:
+            entry = self._entries.get((bucket, key, version_id))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((bucket, key, version_id))
+            self.hits += 1
+            return entry
+
+    def put(self, bucket: str, key: str, version_id: str, metadata: TriggerMetadata):
+        with self._lock:
+            self._entries[(bucket, key, version_id)] = metadata
+            self._entries.move_to_end((bucket, key, version_id))
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+
+trigger_metadata_cache = TriggerMetadataCache(
+    max_size=int(os.getenv("TRIGGER_METADATA_CACHE_SIZE", "128"))
+)
+
+
 def get_metadata_from_trigger(
-    pipeline_name: str, execution_id: str
+    execution_context: ExecutionContext,
 ) -> TriggerMetadata | None:
     """Returns a dictionary containing the metadata, if any, stored in the trigger file"""
 
-    action_response = client.list_action_executions(
-        pipelineName=pipeline_name, filter={"pipelineExecutionId": execution_id}
-    )
-
     action = next(
         (
             action
-            for action in action_response["actionExecutionDetails"]
-            if action["input"]["actionTypeId"]["category"] == "Source"
-            and action["input"]["actionTypeId"]["provider"] == "S3"
+            for action in execution_context.action_executions_in_category("Source")
+            if action["input"]["actionTypeId"]["provider"] == "S3"
         ),
         None,
     )
-    if action:
+    if not action:
+        return None
+
+    try:
         s3_version_id = action["output"]["outputVariables"]["VersionId"]
         artifacts_bucket = action["input"]["configuration"]["S3Bucket"]
         trigger_file = action["input"]["configuration"]["S3ObjectKey"]
+    except KeyError as e:
+        # E.g., the source action hasn't completed yet
+        print(f"Could not find the trigger file of the source action: {e}")
+        return None
+
+    ci_metadata = trigger_metadata_cache.get(
+        artifacts_bucket, trigger_file, s3_version_id
+    )
+    if ci_metadata is not None:
+        return ci_metadata
 
     try:
         response = s3.get_object(
@@ -162,11 +690,14 @@ def get_metadata_from_trigger(
         )
         file_content = response["Body"].read().decode("utf-8")
         ci_metadata = json.loads(file_content)
-        return ci_metadata
     except Exception as e:
         print(f"Could not obtain metadata from trigger file: {e}")
+        return None
 
-    return None
+    trigger_metadata_cache.put(
+        artifacts_bucket, trigger_file, s3_version_id, ci_metadata
+    )
+    return ci_metadata
 
 
 def get_footer_text(ci_metadata: TriggerMetadata) -> str:
@@ -195,31 +726,409 @@ def get_footer_text(ci_metadata: TriggerMetadata) -> str:
     return footer_text
 
 
+# BEGIN shared secret-cache (assets/shared/slack.py)
+class SecretCache:
+    """Cache secret strings from Secrets Manager across warm invocations.
+
+    Entries are keyed by secret ID and version stage and expire after
+    `ttl_seconds`. A TTL of 0 disables caching.
+    """
+
+    def __init__(
+        self,
+        client,
+        *,
+        ttl_seconds: float = 300,
+        version_stage: str = "AWSCURRENT",
+        clock=time.monotonic,
+    ):
+        self._client = client
+        self._ttl_seconds = ttl_seconds
+        self._version_stage = version_stage
+        self._clock = clock
+        # (secret_id, version_stage) -> (secret_string, expires_at)
+        self._entries: dict[tuple[str, str], tuple[str, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, secret_id: str, *, force_refresh: bool = False) -> str:
+        """Return the secret string, fetching it if missing, expired or forced."""
+        key = (secret_id, self._version_stage)
+        entry = self._entries.get(key)
+        if entry is not None and not force_refresh and self._clock() < entry[1]:
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        try:
+            # Secrets Manager defaults to AWSCURRENT when no stage is given
+            if self._version_stage == "AWSCURRENT":
+                response = self._client.get_secret_value(SecretId=secret_id)
+            else:
+                response = self._client.get_secret_value(
+                    SecretId=secret_id, VersionStage=self._version_stage
+                )
+        except Exception as e:
+            raise RuntimeError(f"Error retrieving secret '{secret_id}': {e}") from e
+        secret_string = response["SecretString"]
+        self._entries[key] = (secret_string, self._clock() + self._ttl_seconds)
+        return secret_string
+
+
+# END shared secret-cache
+secret_cache = SecretCache(
+    secrets_manager,
+    ttl_seconds=SLACK_URL_SECRET_TTL_SECONDS,
+    version_stage=SLACK_URL_SECRET_VERSION_STAGE,
+)
+
+
+# BEGIN shared transport (assets/shared/slack.py)
+SLACK_CONNECT_TIMEOUT_SECONDS = float(os.getenv("SLACK_CONNECT_TIMEOUT_SECONDS", "2"))
+SLACK_READ_TIMEOUT_SECONDS = float(os.getenv("SLACK_READ_TIMEOUT_SECONDS", "4"))
+
+
+class LatencyHistogram:
+    """Counts of request latencies in fixed millisecond buckets."""
+
+    BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, seconds * 1000)] += 1
+
+    def __str__(self):
+        labels = [f"<={bucket}ms" for bucket in self.BUCKETS_MS]
+        labels.append(f">{self.BUCKETS_MS[-1]}ms")
+        return " ".join(f"{label}:{n}" for label, n in zip(labels, self.counts))
+
+
+class TransportResponse:
+    def __init__(self, status: int, headers, body: bytes):
+        self.status = status
+        self.headers = headers
+        self._body = body
+
+    def read(self) -> bytes:
+        return self._body
+
+
+class RequestNotSentError(URLError):
+    """A request failed before it was sent, so retrying it cannot post the
+    message twice."""
+
+
+class KeepAliveTransport:
+    """Send HTTP(S) requests over persistent connections that are reused
+    across warm Lambda invocations.
+
+    `urlopen` is a drop-in replacement for `urllib.request.urlopen`: it
+    raises HTTPError for 4xx/5xx responses and URLError for connection
+    failures and timeouts. Idle connections are pooled per origin, and one
+    that the server has closed while idle is discarded before it is reused.
+    Requests are not retried, since a request that fails once sent (e.g. a
+    read timeout) may already have been processed. Failures before the
+    request was sent raise RequestNotSentError, which is safe to retry.
+    """
+
+    def __init__(
+        self,
+        *,
+        connect_timeout: float = SLACK_CONNECT_TIMEOUT_SECONDS,
+        read_timeout: float = SLACK_READ_TIMEOUT_SECONDS,
+        max_idle_per_origin: int = 4,
+        ssl_context=None,
+    ):
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._max_idle_per_origin = max_idle_per_origin
+        self._ssl_context = ssl_context
+        self._lock = threading.Lock()
+        self._idle: dict[tuple[str, str, int], list[http.client.HTTPConnection]] = {}
+        self.latency_histogram = LatencyHistogram()
+        self.connections_opened = 0
+
+    def _connect(self, origin: tuple[str, str, int]) -> http.client.HTTPConnection:
+        scheme, host, port = origin
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                host, port, timeout=self._connect_timeout, context=self._ssl_context
+            )
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self._connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self._read_timeout)
+        with self._lock:
+            self.connections_opened += 1
+        return conn
+
+    def _acquire(self, origin) -> http.client.HTTPConnection:
+        while True:
+            with self._lock:
+                idle = self._idle.get(origin)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                return self._connect(origin)
+            # An idle connection is only readable once the server has closed it
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+            if not readable:
+                return conn
+            conn.close()
+
+    def _release(self, origin, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self._max_idle_per_origin:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def urlopen(self, req: Request) -> TransportResponse:
+        url = urlsplit(req.full_url)
+        origin = (
+            url.scheme,
+            url.hostname,
+            url.port or (443 if url.scheme == "https" else 80),
+        )
+        path = (url.path or "/") + (f"?{url.query}" if url.query else "")
+        headers = dict(req.header_items())
+        if not req.has_header("Content-type"):
+            headers["Content-Type"] = "application/json"
+
+        start = time.monotonic()
+        try:
+            conn = self._acquire(origin)
+        except (OSError, http.client.HTTPException) as e:
+            raise RequestNotSentError(e) from e
+        try:
+            # A request that could not be written in full cannot be processed
+            conn.request(req.get_method(), path, body=req.data, headers=headers)
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise RequestNotSentError(e) from e
+        try:
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise URLError(e) from e
+        self.latency_histogram.observe(time.monotonic() - start)
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(origin, conn)
+
+        if response.status >= 400:
+            raise HTTPError(
+                req.full_url,
+                response.status,
+                response.reason,
+                response.headers,
+                io.BytesIO(body),
+            )
+        return TransportResponse(response.status, response.headers, body)
+
+
+# END shared transport
+transport = KeepAliveTransport()
+
+
 def get_secret(secret):
+    return secret_cache.get(secret)
+
+
+def post_to_slack(slack_url: str, slack_message: dict):
+    req = Request(slack_url, json.dumps(slack_message).encode("utf-8"))
+    print(f"Posting message to Slack URL {get_masked_slack_webhook_url(slack_url)}")
     try:
-        return secrets_manager.get_secret_value(SecretId=secret)["SecretString"]
-    except Exception as e:
-        raise Exception(f"Error retrieving secret: {e}")
+        transport.urlopen(req).read()
+    finally:
+        print(f"Slack latency histogram: {transport.latency_histogram}")
 
 
-def handler(event, context):
-    print("Event: " + json.dumps(event))
+def post_to_slack_with_secret_refresh(secret_name: str, slack_message: dict):
+    """Post to the webhook stored in the secret. If Slack rejects the webhook
+    with 403/404 it may have been rotated, so the secret is refreshed and the
+    post retried once if the webhook changed."""
+    slack_url = get_secret(secret_name)
+    try:
+        post_to_slack(slack_url, slack_message)
+    except HTTPError as e:
+        if e.code not in (403, 404):
+            raise
+        refreshed_slack_url = secret_cache.get(secret_name, force_refresh=True)
+        if refreshed_slack_url == slack_url:
+            raise
+        print("Slack rejected the webhook URL, retrying with refreshed secret")
+        post_to_slack(refreshed_slack_url, slack_message)
+    finally:
+        print(f"Secret cache hits={secret_cache.hits} misses={secret_cache.misses}")
+
+
+# Time to leave for posting to Slack after the lookups
+LOOKUP_TIME_RESERVE_SECONDS = (
+    SLACK_CONNECT_TIMEOUT_SECONDS + SLACK_READ_TIMEOUT_SECONDS + 0.5
+)
+MIN_LOOKUP_SECONDS = 1.0
+
+
+def lookup_deadline_from_context(context) -> float:
+    """Return the deadline (on the time.monotonic() clock) for lookups, leaving
+    enough of the invocation's remaining time to post to Slack"""
+    remaining_seconds = (
+        context.get_remaining_time_in_millis() / 1000 if context is not None else 10
+    )
+    return time.monotonic() + max(
+        remaining_seconds - LOOKUP_TIME_RESERVE_SECONDS, MIN_LOOKUP_SECONDS
+    )
 
-    region = event["region"]
-    account_id = event["account"]
+
+class Lookups:
+    """Run independent lookups concurrently, and wait for each of them until a
+    shared deadline. A lookup that misses the deadline is abandoned and
+    recorded in `timed_out`, and one that fails is recorded in `failed`, so
+    that a degraded message can still be sent."""
+
+    def __init__(self, deadline: float, max_workers: int = 4):
+        self._deadline = deadline
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.timed_out: list[str] = []
+        self.failed: list[str] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # Don't wait for abandoned lookups
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, func, *args) -> Future:
+        return self._executor.submit(func, *args)
+
+    def remaining_seconds(self) -> float:
+        return max(self._deadline - time.monotonic(), 0)
+
+    def result(self, future: Future, description: str, default=None):
+        """Return the result of the lookup, or `default` if it missed the
+        deadline or failed"""
+        try:
+            return future.result(timeout=self.remaining_seconds())
+        except TimeoutError:
+            print(f"Lookup of {description} did not complete in time")
+            self.timed_out.append(description)
+            return default
+        except Exception as e:
+            print(f"Lookup of {description} failed: {e}")
+            self.failed.append(description)
+            return default
+
+
+@dataclass(frozen=True)
+class NotificationSettings:
+    """How to notify about the executions of a pipeline"""
+
+    slack_url_secret_name: str | None
+    notification_level: str = "WARN"
+    account_friendly_name: str | None = None
+    slack_mentions: str | None = None
+
+    @classmethod
+    def from_env(cls) -> "NotificationSettings":
+        return cls(
+            slack_url_secret_name=SLACK_URL_SECRET_NAME,
+            notification_level=NOTIFICATION_LEVEL,
+            account_friendly_name=ACCOUNT_FRIENDLY_NAME,
+            slack_mentions=SLACK_MENTIONS,
+        )
+
+    @classmethod
+    def from_dict(cls, settings: dict) -> "NotificationSettings":
+        """Parse the settings included in events buffered for a digest"""
+        return cls(
+            slack_url_secret_name=settings["slackUrlSecretName"],
+            notification_level=settings.get("notificationLevel", "WARN"),
+            account_friendly_name=settings.get("accountFriendlyName"),
+            slack_mentions=settings.get("slackMentions"),
+        )
+
+
+def is_relevant(event, settings: NotificationSettings) -> bool:
+    """Return whether the event may lead to a notification, recording the state
+    of the execution along the way"""
     pipeline_name = event["detail"]["pipeline"]
     state = event["detail"]["state"]
     execution_id = event["detail"]["execution-id"]
 
-    if state in ("STARTED", "SUPERSEDED") and NOTIFICATION_LEVEL != "DEBUG":
-        return
+    execution_history.record_state(pipeline_name, execution_id, state)
+    record_terminal_state(event)
+
+    if state in ("STARTED", "SUPERSEDED") and settings.notification_level != "DEBUG":
+        return False
 
     if event["detail-type"] != "CodePipeline Pipeline Execution State Change":
         print("Ignoring unknown event")
+        return False
+
+    return True
+
+
+def handler(event, context):
+    print("Event: " + json.dumps(event))
+
+    if event.get("Records", [{}])[0].get("eventSource") == "aws:sqs":
+        return handle_digest(event["Records"], context)
+
+    settings = NotificationSettings.from_env()
+    if not is_relevant(event, settings):
         return
 
-    previous_pipeline_execution = get_previous_pipeline_execution(
-        pipeline_name, execution_id
+    with Lookups(lookup_deadline_from_context(context)) as lookups:
+        return notify(event, lookups, settings)
+
+
+def notify(
+    event,
+    lookups: Lookups,
+    settings: NotificationSettings,
+    execution_context: ExecutionContext | None = None,
+):
+    """Post a message about the pipeline execution state change to Slack, if
+    relevant, using `lookups` for the lookups needed along the way"""
+    region = event["region"]
+    account_id = event["account"]
+    pipeline_name = event["detail"]["pipeline"]
+    state = event["detail"]["state"]
+    execution_id = event["detail"]["execution-id"]
+    if execution_context is None:
+        execution_context = ExecutionContext(client, pipeline_name, execution_id)
+
+    def start_enrichment():
+        return (
+            lookups.submit(get_metadata_from_trigger, execution_context),
+            lookups.submit(get_text_for_failed, execution_context, state),
+            lookups.submit(get_secret, settings.slack_url_secret_name),
+        )
+
+    previous_pipeline_execution_future = lookups.submit(
+        get_previous_pipeline_execution,
+        pipeline_name,
+        execution_id,
+        parse_start_time(event["detail"].get("start-time")),
+    )
+    # Succeeded events are usually ignored depending on the previous execution,
+    # so only look up the rest once we know the event is going to be posted
+    may_be_ignored = state == "SUCCEEDED" and settings.notification_level == "WARN"
+    enrichment = None if may_be_ignored else start_enrichment()
+
+    previous_pipeline_execution = lookups.result(
+        previous_pipeline_execution_future, "previous pipeline execution"
+    )
+    previous_unknown = (
+        "previous pipeline execution" in lookups.timed_out
+        or "previous pipeline execution" in lookups.failed
     )
 
     previous_failed = (
@@ -239,22 +1148,28 @@ def handler(event, context):
         had_prior_failure = False
 
     # We still show succeeded for the first event or when
-    # the previous execution was not success.
-    if state == "SUCCEEDED" and (NOTIFICATION_LEVEL == "WARN"):
-        if not had_prior_failure:
+    # the previous execution was not success. If the previous execution could
+    # not be looked up, it may have failed, so rather post a degraded message
+    # than risk swallowing a recovery.
+    if state == "SUCCEEDED" and (settings.notification_level == "WARN"):
+        if not had_prior_failure and not previous_unknown:
             print("Ignoring succeeded event")
             return
 
+    if enrichment is None:
+        enrichment = start_enrichment()
+    ci_metadata_future, text_for_failed_future, slack_url_future = enrichment
+
     pipeline_url = f"https://{region}.console.aws.amazon.com/codesuite/codepipeline/pipelines/{quote(pipeline_name, safe='')}/view"
     execution_url = f"https://{region}.console.aws.amazon.com/codesuite/codepipeline/pipelines/{quote(pipeline_name, safe='')}/executions/{execution_id}/timeline"
 
-    account_friendly_name = f"in {ACCOUNT_FRIENDLY_NAME or account_id}"
+    account_friendly_name = f"in {settings.account_friendly_name or account_id}"
 
     state_text = state
     if had_prior_failure and state == "SUCCEEDED":
         state_text += " (previously failed)"
 
-    ci_metadata = get_metadata_from_trigger(pipeline_name, execution_id)
+    ci_metadata = lookups.result(ci_metadata_future, "trigger metadata")
 
     footer_text = get_footer_text(ci_metadata)
 
@@ -265,15 +1180,34 @@ def handler(event, context):
     emoji_prefix = style["emoji_prefix"]
     message_color = style["message_color"]
 
-    text_for_failed = get_text_for_failed(pipeline_name, execution_id, state)
+    text_for_failed = lookups.result(text_for_failed_future, "failed actions", "")
+
+    degraded_text = "\n".join(
+        s
+        for s in [
+            f"_Could not look up {', '.join(lookups.timed_out)} in time_"
+            if lookups.timed_out
+            else "",
+            f"_Could not look up {', '.join(lookups.failed)}_"
+            if lookups.failed
+            else "",
+        ]
+        if s
+    )
 
     text = "\n".join(
         s
-        for s in [f"*Execution:* <{execution_url}|{execution_id}>", text_for_failed]
+        for s in [
+            f"*Execution:* <{execution_url}|{execution_id}>",
+            text_for_failed,
+            degraded_text,
+        ]
         if s
     )
 
-    mentions_str = SLACK_MENTIONS if state == "FAILED" and not previous_failed else ""
+    mentions_str = (
+        settings.slack_mentions if state == "FAILED" and not previous_failed else ""
+    )
 
     pretext = " ".join(
         s
@@ -305,14 +1239,181 @@ def handler(event, context):
         "attachments": attachments,
     }
 
-    slack_url = get_secret(SLACK_URL_SECRET_NAME)
+    # The webhook URL is looked up in advance to warm the secret cache. The
+    # message cannot be sent without it, so any error is raised here
+    done, _ = wait([slack_url_future], timeout=lookups.remaining_seconds())
+    if not done:
+        raise Exception("Slack webhook URL not looked up within the time budget")
+    slack_url_future.result()
 
-    req = Request(slack_url, json.dumps(slack_message).encode("utf-8"))
-    print(f"Posting message to Slack URL {get_masked_slack_webhook_url(slack_url)}")
+    send_slack_message(settings.slack_url_secret_name, slack_message)
+
+
+def send_slack_message(secret_name: str, slack_message: dict):
     try:
-        response = urlopen(req)
-        response.read()
+        post_to_slack_with_secret_refresh(secret_name, slack_message)
     except HTTPError as e:
-        raise Exception(f"Request to slack failed: {e.code} {e.reason}")
+        raise Exception(f"Request to slack failed: {e.code} {e.reason}") from e
     except URLError as e:
-        raise Exception(f"Server connection to slack failed: {e.reason}")
+        raise Exception(f"Server connection to slack failed: {e.reason}") from e
+
+
+# The maximum number of pipelines listed in a digest message
+DIGEST_MAX_LISTED_PIPELINES = 30
+
+
+def get_failure_signature(execution_context: ExecutionContext) -> tuple[str, ...]:
+    """Return what identifies the failure of an execution across pipelines,
+    i.e. the failed actions and their summaries"""
+    return tuple(
+        sorted(
+            f"{action['stageName']}.{action['actionName']}: "
+            + action["output"]["executionResult"]["externalExecutionSummary"]
+            for action in execution_context.action_executions_with_status("Failed")
+        )
+    )
+
+
+def create_digest_message(
+    failures: list[tuple[dict, ExecutionContext]], settings: NotificationSettings
+) -> dict:
+    """Return a Slack message listing the pipelines that failed the same way"""
+    first_event, first_execution_context = failures[0]
+    account_ids = sorted({event["account"] for event, _ in failures})
+    account_friendly_name = settings.account_friendly_name or ", ".join(account_ids)
+
+    pipeline_lines = []
+    for event, _ in failures[:DIGEST_MAX_LISTED_PIPELINES]:
+        pipeline_name = event["detail"]["pipeline"]
+        execution_id = event["detail"]["execution-id"]
+        execution_url = f"https://{event['region']}.console.aws.amazon.com/codesuite/codepipeline/pipelines/{quote(pipeline_name, safe='')}/executions/{execution_id}/timeline"
+        pipeline_lines.append(f"• <{execution_url}|{pipeline_name}>")
+    if len(failures) > DIGEST_MAX_LISTED_PIPELINES:
+        pipeline_lines.append(
+            f"• ... and {len(failures) - DIGEST_MAX_LISTED_PIPELINES} more"
+        )
+
+    text = "\n".join(
+        s
+        for s in [
+            "*Pipelines:*",
+            *pipeline_lines,
+            get_text_for_failed(first_execution_context, "FAILED"),
+        ]
+        if s
+    )
+    pretext = " ".join(
+        s
+        for s in [
+            f"{STYLES['FAILED']['emoji_prefix']} *{len(failures)} pipelines FAILED*",
+            f"in {account_friendly_name}",
+            settings.slack_mentions,
+        ]
+        if s
+    )
+    return {
+        "attachments": [
+            {
+                "color": STYLES["FAILED"]["message_color"],
+                "text": text,
+                "mrkdwn_in": ["text", "pretext"],
+                "pretext": pretext,
+                "fallback": f"{len(failures)} pipelines FAILED",
+            }
+        ]
+    }
+
+
+def handle_digest(records, context):
+    """Handle pipeline events buffered in an SQS queue.
+
+    Failed executions that are notified through the same webhook and failed
+    the same way are posted as a single message listing the pipelines, while
+    other events are notified one by one. Returns the records that failed so
+    that only those are retried.
+    """
+    failed_message_ids = []
+    # Records of failed executions by (settings, failure signature)
+    failures: dict[tuple, list[tuple[str, dict, ExecutionContext]]] = {}
+    individual: list[tuple[str, dict, NotificationSettings, ExecutionContext]] = []
+
+    with Lookups(lookup_deadline_from_context(context)) as lookups:
+        signatures = []
+        for record in records:
+            try:
+                body = json.loads(record["body"])
+                event = body["event"]
+                settings = NotificationSettings.from_dict(body["settings"])
+            except Exception as e:
+                print(f"Ignoring malformed record {record['messageId']}: {e}")
+                continue
+            if not is_relevant(event, settings):
+                continue
+            execution_context = ExecutionContext(
+                client, event["detail"]["pipeline"], event["detail"]["execution-id"]
+            )
+            if event["detail"]["state"] != "FAILED":
+                individual.append(
+                    (record["messageId"], event, settings, execution_context)
+                )
+                continue
+            future = lookups.submit(get_failure_signature, execution_context)
+            signatures.append(
+                (record["messageId"], event, settings, execution_context, future)
+            )
+
+        for message_id, event, settings, execution_context, future in signatures:
+            signature = lookups.result(
+                future, f"failed actions of {event['detail']['pipeline']}"
+            )
+            # Failures without details are not known to have a common cause
+            if not signature:
+                individual.append((message_id, event, settings, execution_context))
+                continue
+            failures.setdefault((settings, signature), []).append(
+                (message_id, event, execution_context)
+            )
+
+    for (settings, _), group in failures.items():
+        if len(group) == 1:
+            individual.append((*group[0][:2], settings, group[0][2]))
+            continue
+        print(f"Posting digest of {len(group)} failed pipelines")
+        try:
+            send_slack_message(
+                settings.slack_url_secret_name,
+                create_digest_message(
+                    [
+                        (event, execution_context)
+                        for _, event, execution_context in group
+                    ],
+                    settings,
+                ),
+            )
+        except Exception as e:
+            print(f"Failed to post digest: {e}")
+            failed_message_ids.extend(message_id for message_id, _, _ in group)
+
+    for i, (message_id, event, settings, execution_context) in enumerate(individual):
+        # Each notification gets its own lookup deadline, so the rest of the
+        # records are left to be retried once there is no time for another
+        if (
+            context is not None
+            and context.get_remaining_time_in_millis() / 1000
+            < LOOKUP_TIME_RESERVE_SECONDS + MIN_LOOKUP_SECONDS
+        ):
+            print(f"Leaving {len(individual) - i} records to be retried")
+            failed_message_ids.extend(message_id for message_id, *_ in individual[i:])
+            break
+        try:
+            with Lookups(lookup_deadline_from_context(context)) as lookups:
+                notify(event, lookups, settings, execution_context)
+        except Exception as e:
+            print(f"Failed to notify about record {message_id}: {e}")
+            failed_message_ids.append(message_id)
+
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": message_id} for message_id in failed_message_ids
+        ]
+    }
@@ -0,0 +1,678 @@
+import io
+import json
+import os
+import threading
+import time
+
+import pytest
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+
+import index
+from index import (
+    DynamoDbStore,
+    ExecutionContext,
+    FileStore,
+    MemoryStore,
+    PipelineExecutionHistory,
+    PipelineStatusStore,
+    TriggerMetadataCache,
+    get_metadata_from_trigger,
+    get_text_for_failed,
+    handler,
+)
+
+
+def execution(execution_id, status):
+    return {"pipelineExecutionId": execution_id, "status": status}
+
+
+class FakeCodePipeline:
+    """Serves `list_pipeline_executions` from a list of executions ordered
+    newest first, in pages of `page_size`"""
+
+    def __init__(self, executions, page_size=3):
+        self.executions = executions
+        self.page_size = page_size
+        self.calls = []
+
+    def list_pipeline_executions(self, pipelineName, nextToken=None):
+        self.calls.append(nextToken)
+        start = int(nextToken or 0)
+        end = start + self.page_size
+        response = {"pipelineExecutionSummaries": self.executions[start:end]}
+        if end < len(self.executions):
+            response["nextToken"] = str(end)
+        return response
+
+
+def test_previous_execution_is_found_beyond_the_first_page():
+    codepipeline = FakeCodePipeline(
+        [execution("5", "InProgress")]
+        + [execution(str(i), "Superseded") for i in (4, 3, 2)]
+        + [execution("1", "Failed"), execution("0", "Succeeded")]
+    )
+    history = PipelineExecutionHistory(codepipeline)
+    assert history.get_previous("pipeline", "5") == execution("1", "Failed")
+    # Pagination stops as soon as the previous execution is found
+    assert codepipeline.calls == [None, "3"]
+
+
+def test_previous_execution_is_none_without_prior_terminal_execution():
+    codepipeline = FakeCodePipeline([execution(str(i), "Superseded") for i in range(7)])
+    history = PipelineExecutionHistory(codepipeline)
+    assert history.get_previous("pipeline", "0") is None
+    assert codepipeline.calls == [None, "3", "6"]
+
+
+def test_new_executions_cost_at_most_one_page():
+    executions = [execution(str(i), "Superseded") for i in range(9, 0, -1)]
+    executions.append(execution("0", "Failed"))
+    codepipeline = FakeCodePipeline(executions)
+    history = PipelineExecutionHistory(codepipeline)
+    assert history.get_previous("pipeline", "9") == execution("0", "Failed")
+    pages_for_first_lookup = len(codepipeline.calls)
+
+    for i in range(10, 15):
+        # Each execution supersedes the one before it
+        codepipeline.executions[0] = execution(str(i - 1), "Superseded")
+        history.record_state("pipeline", str(i - 1), "SUPERSEDED")
+        codepipeline.executions.insert(0, execution(str(i), "InProgress"))
+        assert history.get_previous("pipeline", str(i)) == execution("0", "Failed")
+    assert len(codepipeline.calls) == pages_for_first_lookup + 5
+
+
+def test_cached_statuses_are_updated_from_events():
+    codepipeline = FakeCodePipeline(
+        [
+            execution("2", "InProgress"),
+            execution("1", "InProgress"),
+            execution("0", "Failed"),
+        ]
+    )
+    history = PipelineExecutionHistory(codepipeline)
+    assert history.get_previous("pipeline", "2") == execution("0", "Failed")
+    history.record_state("pipeline", "1", "SUCCEEDED")
+    assert history.get_previous("pipeline", "2") == execution("1", "Succeeded")
+    assert len(codepipeline.calls) == 1
+
+
+def test_statuses_recorded_during_a_lookup_are_kept():
+    codepipeline = FakeCodePipeline(
+        [
+            execution("3", "Superseded"),
+            execution("2", "InProgress"),
+            execution("1", "Failed"),
+        ]
+    )
+    history = PipelineExecutionHistory(codepipeline)
+    assert history.get_previous("pipeline", "3") == execution("1", "Failed")
+
+    class ConcurrentEventCodePipeline(FakeCodePipeline):
+        def list_pipeline_executions(self, pipelineName, nextToken=None):
+            # The event of execution 2 is handled while the page is fetched
+            history.record_state("pipeline", "2", "SUCCEEDED")
+            return super().list_pipeline_executions(pipelineName, nextToken)
+
+    history._client = ConcurrentEventCodePipeline(
+        [
+            execution("4", "InProgress"),
+            execution("3", "Superseded"),
+            execution("2", "InProgress"),
+            execution("1", "Failed"),
+        ]
+    )
+    history.get_previous("pipeline", "4")
+    assert history.get_previous("pipeline", "4") == execution("2", "Succeeded")
+    assert len(history._client.calls) == 1
+
+
+def test_unfinished_cached_executions_are_refreshed():
+    codepipeline = FakeCodePipeline(
+        [
+            execution("3", "InProgress"),
+            execution("2", "Superseded"),
+            execution("1", "InProgress"),
+            execution("0", "Failed"),
+        ],
+        page_size=2,
+    )
+    history = PipelineExecutionHistory(codepipeline)
+    assert history.get_previous("pipeline", "3") == execution("0", "Failed")
+    assert len(codepipeline.calls) == 2
+
+    # Execution 1 finished without its event reaching this container
+    codepipeline.executions[2] = execution("1", "Succeeded")
+    assert history.get_previous("pipeline", "3") == execution("1", "Succeeded")
+    assert len(codepipeline.calls) == 4
+
+    # Once finished, it is answered from the cache
+    assert history.get_previous("pipeline", "3") == execution("1", "Succeeded")
+    assert len(codepipeline.calls) == 4
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 5])
+def test_lookups_of_older_executions_match_a_full_scan(page_size):
+    executions = [
+        execution(str(i), ["Succeeded", "Failed", "Superseded", "Stopped"][i % 4])
+        for i in range(20, 0, -1)
+    ]
+    codepipeline = FakeCodePipeline(executions, page_size=page_size)
+    history = PipelineExecutionHistory(codepipeline, max_executions_per_pipeline=8)
+    for i in [20, 3, 15, 1, 19, 8]:
+        ids = [e["pipelineExecutionId"] for e in executions]
+        expected = next(
+            (
+                e
+                for e in executions[ids.index(str(i)) + 1 :]
+                if e["status"] in ("Succeeded", "Failed")
+            ),
+            None,
+        )
+        assert history.get_previous("pipeline", str(i)) == expected
+
+
+def action_execution(stage, action, status, category="Build", summary=""):
+    return {
+        "stageName": stage,
+        "actionName": action,
+        "status": status,
+        "input": {"actionTypeId": {"category": category, "provider": "CodeBuild"}},
+        "output": {"executionResult": {"externalExecutionSummary": summary}},
+    }
+
+
+class FakeActionExecutions:
+    def __init__(self, action_executions, page_size=2):
+        self.action_executions = action_executions
+        self.page_size = page_size
+        self.calls = 0
+
+    def list_action_executions(self, pipelineName, filter, nextToken=None):
+        self.calls += 1
+        start = int(nextToken or 0)
+        end = start + self.page_size
+        response = {"actionExecutionDetails": self.action_executions[start:end]}
+        if end < len(self.action_executions):
+            response["nextToken"] = str(end)
+        return response
+
+
+def test_execution_context_fetches_all_pages_once():
+    codepipeline = FakeActionExecutions(
+        [
+            action_execution("Source", "S3", "Succeeded", category="Source"),
+            action_execution("Build", "Synth", "Succeeded"),
+            action_execution("Deploy", "Dev", "Succeeded", category="Deploy"),
+            action_execution("Deploy", "Prod", "Failed", category="Deploy"),
+            action_execution("Test", "Smoke", "Failed", summary="Tests failed"),
+        ]
+    )
+    execution_context = ExecutionContext(codepipeline, "pipeline", "1")
+    assert [
+        a["actionName"]
+        for a in execution_context.action_executions_in_category("Deploy")
+    ] == ["Dev", "Prod"]
+    assert get_text_for_failed(execution_context, "FAILED") == (
+        "```\nDeploy.Prod failed:\n\n\nTest.Smoke failed:\nTests failed\n```"
+    )
+    assert codepipeline.calls == 3
+
+
+def test_text_for_failed_is_empty_for_other_states():
+    codepipeline = FakeActionExecutions([])
+    execution_context = ExecutionContext(codepipeline, "pipeline", "1")
+    assert get_text_for_failed(execution_context, "SUCCEEDED") == ""
+    assert codepipeline.calls == 0
+
+
+class FakeContext:
+    def __init__(self, remaining_seconds):
+        self.remaining_seconds = remaining_seconds
+
+    def get_remaining_time_in_millis(self):
+        return int(self.remaining_seconds * 1000)
+
+
+class FakeCodePipelineForHandler(FakeCodePipeline):
+    def __init__(self, executions, action_executions):
+        super().__init__(executions)
+        self.action_executions = FakeActionExecutions(action_executions)
+
+    def list_action_executions(self, **kwargs):
+        return self.action_executions.list_action_executions(**kwargs)
+
+
+class SlowS3:
+    def __init__(self):
+        self.release = threading.Event()
+
+    def get_object(self, Bucket, Key, VersionId):
+        self.release.wait(5)
+        return {"Body": io.BytesIO(json.dumps({"version": "0.1"}).encode())}
+
+
+def pipeline_event(state, execution_id="2", pipeline="my-pipeline", start_time=None):
+    event = {
+        "detail-type": "CodePipeline Pipeline Execution State Change",
+        "region": "eu-west-1",
+        "account": "123456789012",
+        "detail": {
+            "pipeline": pipeline,
+            "execution-id": execution_id,
+            "state": state,
+        },
+    }
+    if start_time is not None:
+        event["detail"]["start-time"] = start_time
+    return event
+
+
+@pytest.fixture
+def notifier(monkeypatch):
+    posted = []
+    monkeypatch.setattr(index, "execution_history", PipelineExecutionHistory(None))
+    monkeypatch.setattr(index, "status_store", PipelineStatusStore(MemoryStore()))
+    monkeypatch.setattr(index, "trigger_metadata_cache", TriggerMetadataCache())
+    monkeypatch.setattr(index, "get_secret", lambda secret_name: "https://hooks/a")
+    monkeypatch.setattr(
+        index,
+        "post_to_slack_with_secret_refresh",
+        lambda secret_name, slack_message: posted.append(slack_message),
+    )
+    monkeypatch.setattr(index, "MIN_LOOKUP_SECONDS", 0.2)
+
+    def use(codepipeline, s3=None):
+        monkeypatch.setattr(index, "client", codepipeline)
+        monkeypatch.setattr(index.execution_history, "_client", codepipeline)
+        monkeypatch.setattr(index, "s3", s3 or SlowS3())
+        return posted
+
+    return use
+
+
+def test_handler_sends_degraded_message_when_lookup_misses_deadline(notifier):
+    codepipeline = FakeCodePipelineForHandler(
+        [execution("2", "Failed"), execution("1", "Succeeded")],
+        [
+            {
+                **action_execution("Source", "S3", "Succeeded", category="Source"),
+                "input": {
+                    "actionTypeId": {"category": "Source", "provider": "S3"},
+                    "configuration": {"S3Bucket": "bucket", "S3ObjectKey": "key"},
+                },
+                "output": {"outputVariables": {"VersionId": "v1"}},
+            },
+            action_execution("Build", "Synth", "Failed", summary="Synth failed"),
+        ],
+    )
+    s3 = SlowS3()
+    posted = notifier(codepipeline, s3)
+    try:
+        handler(
+            pipeline_event("FAILED"),
+            FakeContext(index.LOOKUP_TIME_RESERVE_SECONDS),
+        )
+    finally:
+        s3.release.set()
+    [attachment] = posted[0]["attachments"]
+    assert "Build.Synth failed:\nSynth failed" in attachment["text"]
+    assert "_Could not look up trigger metadata in time_" in attachment["text"]
+    assert attachment["footer"] == ""
+
+
+def test_handler_sends_degraded_message_when_lookup_fails(notifier):
+    class ThrottledCodePipeline(FakeCodePipelineForHandler):
+        def list_action_executions(self, **kwargs):
+            raise Exception("Rate exceeded")
+
+    codepipeline = ThrottledCodePipeline(
+        [execution("2", "Failed"), execution("1", "Succeeded")], []
+    )
+    posted = notifier(codepipeline)
+    handler(pipeline_event("FAILED"), FakeContext(10))
+
+    [attachment] = posted[0]["attachments"]
+    assert "_Could not look up trigger metadata, failed actions_" in attachment["text"]
+
+
+def test_handler_does_not_wait_for_secret_past_deadline(notifier, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(index, "get_secret", lambda secret_name: release.wait(5))
+    codepipeline = FakeCodePipelineForHandler(
+        [execution("2", "Failed"), execution("1", "Succeeded")],
+        [action_execution("Build", "Synth", "Failed", summary="Synth failed")],
+    )
+    posted = notifier(codepipeline)
+    started = time.monotonic()
+    try:
+        with pytest.raises(Exception, match="time budget"):
+            handler(
+                pipeline_event("FAILED"),
+                FakeContext(index.LOOKUP_TIME_RESERVE_SECONDS),
+            )
+    finally:
+        release.set()
+    assert time.monotonic() - started < 2
+    assert posted == []
+
+
+def test_handler_only_looks_up_history_for_ignored_succeeded_events(
+    notifier, monkeypatch
+):
+    monkeypatch.setattr(index, "NOTIFICATION_LEVEL", "WARN")
+    codepipeline = FakeCodePipelineForHandler(
+        [execution("2", "Succeeded"), execution("1", "Succeeded")], []
+    )
+    posted = notifier(codepipeline)
+    handler(pipeline_event("SUCCEEDED"), FakeContext(10))
+    assert posted == []
+    assert codepipeline.calls == [None]
+    assert codepipeline.action_executions.calls == 0
+
+
+def test_handler_posts_succeeded_event_when_previous_execution_is_unknown(
+    notifier, monkeypatch
+):
+    monkeypatch.setattr(index, "NOTIFICATION_LEVEL", "WARN")
+
+    class ThrottledCodePipeline(FakeCodePipelineForHandler):
+        def list_pipeline_executions(self, **kwargs):
+            raise Exception("Rate exceeded")
+
+    codepipeline = ThrottledCodePipeline([], [])
+    posted = notifier(codepipeline)
+    handler(pipeline_event("SUCCEEDED"), FakeContext(10))
+
+    [attachment] = posted[0]["attachments"]
+    assert "_Could not look up previous pipeline execution_" in attachment["text"]
+
+
+def s3_source_action(version_id="v1", key="trigger.json"):
+    return {
+        **action_execution("Source", "S3", "Succeeded", category="Source"),
+        "input": {
+            "actionTypeId": {"category": "Source", "provider": "S3"},
+            "configuration": {"S3Bucket": "bucket", "S3ObjectKey": key},
+        },
+        "output": {"outputVariables": {"VersionId": version_id}},
+    }
+
+
+class CountingS3:
+    def __init__(self):
+        self.calls = []
+
+    def get_object(self, Bucket, Key, VersionId):
+        self.calls.append((Bucket, Key, VersionId))
+        metadata = {"version": "0.1", "ci": {"triggeredBy": VersionId}}
+        return {"Body": io.BytesIO(json.dumps(metadata).encode())}
+
+
+def test_trigger_metadata_is_cached_by_version_id(monkeypatch):
+    s3 = CountingS3()
+    monkeypatch.setattr(index, "s3", s3)
+    monkeypatch.setattr(index, "trigger_metadata_cache", TriggerMetadataCache())
+    for version_id in ["v1", "v1", "v2", "v1"]:
+        execution_context = ExecutionContext(
+            FakeActionExecutions([s3_source_action(version_id)]), "pipeline", "1"
+        )
+        metadata = get_metadata_from_trigger(execution_context)
+        assert metadata["ci"]["triggeredBy"] == version_id
+    assert s3.calls == [
+        ("bucket", "trigger.json", "v1"),
+        ("bucket", "trigger.json", "v2"),
+    ]
+
+
+def test_trigger_metadata_cache_evicts_least_recently_used():
+    cache = TriggerMetadataCache(max_size=2)
+    cache.put("bucket", "key", "v1", {"version": "0.1"})
+    cache.put("bucket", "key", "v2", {"version": "0.1"})
+    assert cache.get("bucket", "key", "v1") is not None
+    cache.put("bucket", "key", "v3", {"version": "0.1"})
+    assert cache.get("bucket", "key", "v2") is None
+    assert cache.get("bucket", "key", "v1") is not None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_trigger_metadata_without_s3_source_action(monkeypatch):
+    s3 = CountingS3()
+    monkeypatch.setattr(index, "s3", s3)
+    execution_context = ExecutionContext(
+        FakeActionExecutions([action_execution("Build", "Synth", "Succeeded")]),
+        "pipeline",
+        "1",
+    )
+    assert get_metadata_from_trigger(execution_context) is None
+    assert s3.calls == []
+
+
+def digest_record(message_id, event, slack_url_secret_name="slack-url"):
+    return {
+        "messageId": message_id,
+        "eventSource": "aws:sqs",
+        "body": json.dumps(
+            {
+                "event": event,
+                "settings": {
+                    "slackUrlSecretName": slack_url_secret_name,
+                    "notificationLevel": "WARN",
+                    "slackMentions": "<!here>",
+                },
+            }
+        ),
+    }
+
+
+def test_digest_groups_pipelines_that_failed_the_same_way(notifier, monkeypatch):
+    codepipeline = FakeCodePipelineForHandler(
+        [],
+        [action_execution("Build", "Synth", "Failed", summary="Image not found")],
+    )
+    notifier(codepipeline)
+    posted = []
+    monkeypatch.setattr(
+        index,
+        "post_to_slack_with_secret_refresh",
+        lambda secret_name, slack_message: posted.append((secret_name, slack_message)),
+    )
+    records = [
+        digest_record("1", pipeline_event("FAILED", pipeline="pipeline-a")),
+        digest_record("2", pipeline_event("FAILED", pipeline="pipeline-b")),
+        digest_record("3", pipeline_event("FAILED", pipeline="pipeline-c")),
+        digest_record("4", pipeline_event("FAILED"), "other-slack-url"),
+        digest_record("5", pipeline_event("STARTED", pipeline="pipeline-d")),
+    ]
+
+    response = handler({"Records": records}, FakeContext(10))
+
+    assert response == {"batchItemFailures": []}
+    [(secret_name, digest), (other_secret_name, single)] = posted
+    assert secret_name == "slack-url"
+    [attachment] = digest["attachments"]
+    assert "*3 pipelines FAILED*" in attachment["pretext"]
+    assert attachment["pretext"].endswith("<!here>")
+    assert [
+        line for line in attachment["text"].split("\n") if line.startswith("•")
+    ] == [
+        f"• <https://eu-west-1.console.aws.amazon.com/codesuite/codepipeline/pipelines/{name}/executions/2/timeline|{name}>"
+        for name in ["pipeline-a", "pipeline-b", "pipeline-c"]
+    ]
+    assert "Build.Synth failed:\nImage not found" in attachment["text"]
+    assert other_secret_name == "other-slack-url"
+    assert "my-pipeline" in single["attachments"][0]["pretext"]
+
+
+def test_digest_reports_records_that_could_not_be_posted(notifier, monkeypatch):
+    codepipeline = FakeCodePipelineForHandler(
+        [], [action_execution("Build", "Synth", "Failed", summary="Synth failed")]
+    )
+    notifier(codepipeline)
+
+    def fail(secret_name, slack_message):
+        raise index.URLError("unreachable")
+
+    monkeypatch.setattr(index, "post_to_slack_with_secret_refresh", fail)
+    records = [
+        digest_record("1", pipeline_event("FAILED", pipeline="pipeline-a")),
+        digest_record("2", pipeline_event("FAILED", pipeline="pipeline-b")),
+        {"messageId": "3", "eventSource": "aws:sqs", "body": "not json"},
+    ]
+
+    response = handler({"Records": records}, FakeContext(10))
+
+    assert response == {
+        "batchItemFailures": [{"itemIdentifier": "1"}, {"itemIdentifier": "2"}]
+    }
+
+
+def test_digest_leaves_records_to_retry_when_out_of_time(notifier, monkeypatch):
+    notifier(FakeCodePipelineForHandler([], []))
+    context = FakeContext(14)
+    posted = []
+
+    def post(secret_name, slack_message):
+        posted.append(slack_message)
+        # Each notification uses up most of the remaining time
+        context.remaining_seconds -= 4
+
+    monkeypatch.setattr(index, "post_to_slack_with_secret_refresh", post)
+    records = [
+        digest_record(str(i), pipeline_event("FAILED", pipeline=f"pipeline-{i}"))
+        for i in range(4)
+    ]
+
+    response = handler({"Records": records}, context)
+
+    assert len(posted) == 2
+    assert response == {
+        "batchItemFailures": [{"itemIdentifier": "2"}, {"itemIdentifier": "3"}]
+    }
+
+
+class FakeDynamoDb:
+    """Local stand-in for the DynamoDB client calls used by DynamoDbStore."""
+
+    class exceptions:
+        class ConditionalCheckFailedException(Exception):
+            pass
+
+    def __init__(self):
+        self.items = {}
+        # Called after each get_item, e.g. to simulate a concurrent writer
+        self.after_get = lambda: None
+
+    def get_item(self, TableName, Key, ConsistentRead):
+        item = self.items.get((TableName, Key["pk"]["S"]))
+        self.after_get()
+        return {"Item": item} if item else {}
+
+    def put_item(
+        self,
+        TableName,
+        Item,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+    ):
+        assert set(Item) <= {"pk", "document", "version"}
+        current = self.items.get((TableName, Item["pk"]["S"]))
+        if ConditionExpression == "attribute_not_exists(pk)":
+            satisfied = current is None
+        elif ConditionExpression == "attribute_not_exists(#version)":
+            satisfied = current is not None and "version" not in current
+        elif ConditionExpression == "#version = :version":
+            satisfied = (
+                current is not None
+                and current.get("version") == ExpressionAttributeValues[":version"]
+            )
+        else:
+            assert ConditionExpression is None
+            satisfied = True
+        if not satisfied:
+            raise self.exceptions.ConditionalCheckFailedException()
+        self.items[(TableName, Item["pk"]["S"])] = Item
+
+
+@pytest.fixture(params=["memory", "file", "dynamodb"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryStore()
+    if request.param == "file":
+        return FileStore(str(tmp_path / "pipelines.json"))
+    return DynamoDbStore(FakeDynamoDb(), "table")
+
+
+def test_status_store_keeps_executions_recorded_concurrently():
+    dynamodb = FakeDynamoDb()
+    status_store = PipelineStatusStore(DynamoDbStore(dynamodb, "table"))
+    other_status_store = PipelineStatusStore(DynamoDbStore(dynamodb, "table"))
+    # A document written before documents were versioned
+    DynamoDbStore(dynamodb, "table").put(
+        "pipeline#pipeline",
+        {"executions": [{"executionId": "1", "status": "Failed", "startTime": 10.0}]},
+    )
+
+    def concurrent_record():
+        dynamodb.after_get = lambda: None
+        other_status_store.record("pipeline", "2", "Succeeded", 20.0)
+
+    # Another container records an execution between the read and the write
+    dynamodb.after_get = concurrent_record
+    status_store.record("pipeline", "3", "Failed", 30.0)
+
+    assert status_store.get_previous("pipeline", "3", 30.0) == {
+        "pipelineExecutionId": "2",
+        "status": "Succeeded",
+    }
+    assert status_store.get_previous("pipeline", "2", 20.0) == {
+        "pipelineExecutionId": "1",
+        "status": "Failed",
+    }
+
+
+def test_status_store_orders_executions_by_start_time(store):
+    status_store = PipelineStatusStore(store, max_executions_per_pipeline=3)
+    assert status_store.get_previous("pipeline", "3", 30.0) is None
+
+    status_store.record("pipeline", "3", "Succeeded", 30.0)
+    # An older execution finishing after a newer one
+    status_store.record("pipeline", "1", "Failed", 10.0)
+    status_store.record("pipeline", "2", "Superseded", 20.0)
+    status_store.record("other-pipeline", "4", "Succeeded", 25.0)
+
+    assert status_store.get_previous("pipeline", "3", 30.0) == {
+        "pipelineExecutionId": "1",
+        "status": "Failed",
+    }
+    assert status_store.get_previous("pipeline", "1", 10.0) is None
+    # A retried execution is updated in place
+    status_store.record("pipeline", "1", "Succeeded", 10.0)
+    assert status_store.get_previous("pipeline", "3", 30.0)["status"] == "Succeeded"
+    assert (status_store.hits, status_store.misses) == (2, 2)
+
+
+def test_handler_falls_back_to_api_only_on_status_store_miss(notifier):
+    codepipeline = FakeCodePipelineForHandler(
+        [
+            {**execution("2", "Failed"), "startTime": "2024-01-01T10:00:00Z"},
+            {**execution("1", "Failed"), "startTime": "2024-01-01T09:00:00Z"},
+        ],
+        [action_execution("Build", "Synth", "Failed", summary="Synth failed")],
+    )
+    posted = notifier(codepipeline)
+
+    handler(
+        pipeline_event("FAILED", "2", start_time="2024-01-01T10:00:00Z"),
+        FakeContext(10),
+    )
+    assert codepipeline.calls == [None]
+    handler(
+        pipeline_event("SUCCEEDED", "3", start_time="2024-01-01T11:00:00Z"),
+        FakeContext(10),
+    )
+    assert codepipeline.calls == [None]
+
+    assert "<!" not in posted[0]["attachments"][0]["pretext"]
+    assert "SUCCEEDED (previously failed)" in posted[1]["attachments"][0]["pretext"]
@@ -1,19 +1,40 @@
+import copy
 import datetime
+import io
 import json
 import os
 import re
-import shutil
+import resource
+import struct
 import tempfile
+import threading
+import time
 import zipfile
-from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 from boto3.session import Session
 
 s3 = boto3.client("s3")
 codepipeline = boto3.client("codepipeline")
 ssm = boto3.client("ssm")
 
+# Whether the CDK source is read from and written to S3 as streams, instead
+# of being downloaded to and uploaded from /tmp
+STREAMING_TRANSFER = os.getenv("STREAMING_TRANSFER", "false") == "true"
+# The number of parts transferred in parallel, and the size of the parts
+TRANSFER_MAX_CONCURRENCY = int(os.getenv("TRANSFER_MAX_CONCURRENCY", "10"))
+TRANSFER_PART_SIZE = int(os.getenv("TRANSFER_PART_SIZE", str(8 * 1024 * 1024)))
+# Objects smaller than this are transferred in a single request
+TRANSFER_MULTIPART_THRESHOLD = int(
+    os.getenv("TRANSFER_MULTIPART_THRESHOLD", str(8 * 1024 * 1024))
+)
+# The size of the ranges read from the source object when streaming
+STREAMING_READ_BLOCK_SIZE = int(
+    os.getenv("STREAMING_READ_BLOCK_SIZE", str(TRANSFER_PART_SIZE))
+)
+
 
 def get_variables_from_parameters(namespace):
     next_token = None
@@ -43,6 +64,375 @@ def get_variables_from_parameters(namespace):
     return result
 
 
+# The fixed part of the local file header of an entry in a zip file
+LOCAL_FILE_HEADER = struct.Struct("<4s5H3L2H")
+LOCAL_FILE_HEADER_SIGNATURE = b"PK\x03\x04"
+# Flag set when the CRC and sizes follow the data in a data descriptor
+DATA_DESCRIPTOR_FLAG = 0x08
+ZIP64_EXTRA_HEADER_ID = 0x0001
+
+
+def without_zip64_extra(extra: bytes) -> bytes:
+    """Return the extra fields of an entry without the Zip64 field, which is
+    recreated as needed when the entry is written"""
+    result = b""
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, size = struct.unpack("<HH", extra[offset : offset + 4])
+        if header_id != ZIP64_EXTRA_HEADER_ID:
+            result += extra[offset : offset + 4 + size]
+        offset += 4 + size
+    return result
+
+
+def copy_raw_entry(source_fp, info: zipfile.ZipInfo, target: zipfile.ZipFile):
+    """Copy an entry to another zip file as is, without decompressing it"""
+    source_fp.seek(info.header_offset)
+    header = LOCAL_FILE_HEADER.unpack(source_fp.read(LOCAL_FILE_HEADER.size))
+    if header[0] != LOCAL_FILE_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Bad local file header for {info.filename}")
+    filename_length, extra_length = header[-2:]
+    source_fp.seek(filename_length + extra_length, os.SEEK_CUR)
+
+    # The central directory of the source has the CRC and sizes, so they are
+    # written in the local file header instead of a data descriptor
+    copied = copy.copy(info)
+    copied.flag_bits &= ~DATA_DESCRIPTOR_FLAG
+    copied.extra = without_zip64_extra(info.extra)
+    copied.header_offset = target.fp.tell()
+    target.fp.write(copied.FileHeader())
+
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = source_fp.read(min(remaining, 1024 * 1024))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated data for {info.filename}")
+        target.fp.write(chunk)
+        remaining -= len(chunk)
+
+    # Register the entry so it is included in the central directory
+    target.filelist.append(copied)
+    target.NameToInfo[copied.filename] = copied
+    target.start_dir = target.fp.tell()
+    target._didModify = True
+
+
+def rewrite_zip(source_fp, target_fp, replacements: dict[str, bytes]):
+    """Write a copy of a zip file where the given files are replaced or
+    added.
+
+    The other entries are copied without being decompressed and compressed
+    again, which is most of the time spent for large cloud assemblies. The
+    source must be seekable, but the target may be a stream.
+    """
+    date_time = time.localtime()[:6]
+    with (
+        zipfile.ZipFile(source_fp) as source,
+        zipfile.ZipFile(target_fp, "w") as target,
+    ):
+        copied = 0
+        for info in source.infolist():
+            if info.filename not in replacements:
+                copy_raw_entry(source_fp, info, target)
+                copied += 1
+        print(f"Copied {copied} files")
+
+        for name, data in replacements.items():
+            info = zipfile.ZipInfo(name, date_time=date_time)
+            info.external_attr = 0o644 << 16
+            print(f"Adding {name}")
+            target.writestr(info, data, compress_type=zipfile.ZIP_DEFLATED)
+
+
+class S3RangeReader(io.RawIOBase):
+    """Seekable file-like object reading an S3 object with ranged requests.
+
+    The object is read in blocks of `block_size`. The block around the last
+    read is kept in memory, so small reads such as those of zip headers do
+    not each cost a request, and up to `max_concurrency` of the following
+    blocks are read ahead in parallel, so sequential reads do not wait for
+    each request in turn.
+    """
+
+    def __init__(
+        self, client, bucket: str, key: str, block_size: int, max_concurrency: int = 1
+    ):
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._block_size = block_size
+        self._read_ahead = max_concurrency if max_concurrency > 1 else 0
+        self._executor = ThreadPoolExecutor(max_workers=max(max_concurrency, 1))
+        self._size = client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self._position = 0
+        # Block index -> future of the data of the block, for the current
+        # block and the blocks read ahead of it
+        self._blocks: dict[int, Future] = {}
+        self._bytes_read_lock = threading.Lock()
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._position + offset
+        elif whence == os.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise OSError(f"Negative seek position {position}")
+        self._position = position
+        return self._position
+
+    def _get_range(self, start: int, end: int) -> bytes:
+        response = self._client.get_object(
+            Bucket=self._bucket, Key=self._key, Range=f"bytes={start}-{end - 1}"
+        )
+        data = response["Body"].read()
+        with self._bytes_read_lock:
+            self.bytes_read += len(data)
+        return data
+
+    def _get_block(self, block_index: int) -> bytes:
+        last_block_index = (self._size - 1) // self._block_size
+        wanted = range(
+            block_index, min(block_index + self._read_ahead, last_block_index) + 1
+        )
+        # Blocks behind the current one, or too far ahead after a seek, are
+        # not needed anymore
+        for index in list(self._blocks):
+            if index not in wanted:
+                self._blocks.pop(index).cancel()
+        for index in wanted:
+            if index not in self._blocks:
+                start = index * self._block_size
+                self._blocks[index] = self._executor.submit(
+                    self._get_range, start, min(start + self._block_size, self._size)
+                )
+        return self._blocks[block_index].result()
+
+    def readinto(self, buffer):
+        size = max(min(len(buffer), self._size - self._position), 0)
+        filled = 0
+        while filled < size:
+            block_index, offset = divmod(self._position, self._block_size)
+            block = self._get_block(block_index)
+            data = block[offset : offset + size - filled]
+            buffer[filled : filled + len(data)] = data
+            filled += len(data)
+            self._position += len(data)
+        return filled
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._blocks = {}
+        super().close()
+
+
+class MultipartUploadWriter(io.RawIOBase):
+    """Stream writing to an S3 object through a multipart upload.
+
+    Up to `max_concurrency` parts are uploaded in parallel, and at most one
+    more is buffered in memory. Objects smaller than `multipart_threshold` are
+    uploaded in a single request instead. The upload is completed when the
+    writer is closed, or aborted by `abort`.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        key: str,
+        part_size: int,
+        max_concurrency: int = 1,
+        multipart_threshold: int = 0,
+    ):
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._part_size = part_size
+        self._multipart_threshold = multipart_threshold
+        self._max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._buffer = bytearray()
+        self._parts: list[Future] = []
+        self._position = 0
+        self._upload_id = None
+        self.bytes_written = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        if self._upload_id is None and len(self._buffer) < max(
+            self._part_size, self._multipart_threshold
+        ):
+            return len(data)
+        while len(self._buffer) >= self._part_size:
+            self._upload_part(self._buffer[: self._part_size])
+            del self._buffer[: self._part_size]
+        return len(data)
+
+    def _upload_part(self, data):
+        if self._upload_id is None:
+            self._upload_id = self._client.create_multipart_upload(
+                Bucket=self._bucket, Key=self._key
+            )["UploadId"]
+        # Wait for a part to be uploaded before buffering more
+        in_flight = [part for part in self._parts if not part.done()]
+        if len(in_flight) >= self._max_concurrency:
+            wait(in_flight, return_when=FIRST_COMPLETED)
+        for part in self._parts:
+            if part.done():
+                part.result()
+        self._parts.append(
+            self._executor.submit(
+                self._client.upload_part,
+                Bucket=self._bucket,
+                Key=self._key,
+                UploadId=self._upload_id,
+                PartNumber=len(self._parts) + 1,
+                Body=bytes(data),
+            )
+        )
+        self.bytes_written += len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        if self._upload_id is None:
+            self._client.put_object(
+                Bucket=self._bucket, Key=self._key, Body=bytes(self._buffer)
+            )
+            self.bytes_written += len(self._buffer)
+        else:
+            # The last part may be smaller than the minimum part size
+            if self._buffer:
+                self._upload_part(self._buffer)
+            parts = [
+                {"PartNumber": part_number, "ETag": part.result()["ETag"]}
+                for part_number, part in enumerate(self._parts, start=1)
+            ]
+            self._client.complete_multipart_upload(
+                Bucket=self._bucket,
+                Key=self._key,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        self._buffer = bytearray()
+        self._executor.shutdown()
+        super().close()
+
+    def abort(self):
+        self._executor.shutdown(cancel_futures=True)
+        if self._upload_id is not None:
+            self._client.abort_multipart_upload(
+                Bucket=self._bucket, Key=self._key, UploadId=self._upload_id
+            )
+        self._buffer = bytearray()
+        super().close()
+
+
+def get_transfer_config() -> TransferConfig:
+    """Return the settings of transfers through files in /tmp"""
+    return TransferConfig(
+        multipart_threshold=TRANSFER_MULTIPART_THRESHOLD,
+        multipart_chunksize=TRANSFER_PART_SIZE,
+        max_concurrency=TRANSFER_MAX_CONCURRENCY,
+        use_threads=TRANSFER_MAX_CONCURRENCY > 1,
+    )
+
+
+def get_peak_memory_mib() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rewrite_zip_streaming(
+    source_client, source: dict, target_client, target: dict, variables: dict
+):
+    """Rewrite the CDK source from S3 to S3 without staging it in /tmp, with
+    memory bounded by the read block size times the number of blocks read
+    ahead, and the part size times the number of parts uploaded in parallel"""
+    reader = S3RangeReader(
+        source_client,
+        source["bucketName"],
+        source["bucketKey"],
+        STREAMING_READ_BLOCK_SIZE,
+        max_concurrency=TRANSFER_MAX_CONCURRENCY,
+    )
+    writer = MultipartUploadWriter(
+        target_client,
+        target["bucketName"],
+        target["objectKey"],
+        TRANSFER_PART_SIZE,
+        max_concurrency=TRANSFER_MAX_CONCURRENCY,
+        multipart_threshold=TRANSFER_MULTIPART_THRESHOLD,
+    )
+    try:
+        rewrite_zip(reader, writer, {"variables.json": json.dumps(variables).encode()})
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        reader.close()
+
+    print(
+        f"Streamed {reader.bytes_read} bytes in and {writer.bytes_written} "
+        f"bytes out, peak memory {get_peak_memory_mib():.0f} MiB"
+    )
+
+
+def rewrite_zip_with_tmp_files(
+    source_client, source: dict, target_client, target: dict, variables: dict
+):
+    """Rewrite the CDK source from S3 to S3 through files in /tmp"""
+    with (
+        tempfile.NamedTemporaryFile() as source_file,
+        tempfile.NamedTemporaryFile() as tmp_file,
+    ):
+        source_client.download_file(
+            Bucket=source["bucketName"],
+            Key=source["bucketKey"],
+            Filename=source_file.name,
+            Config=get_transfer_config(),
+        )
+
+        print(f"Downloaded zip size: {os.path.getsize(source_file.name)}")
+
+        # The download replaces the file, so it is opened again by name
+        with open(source_file.name, "rb") as source_fp:
+            rewrite_zip(
+                source_fp, tmp_file, {"variables.json": json.dumps(variables).encode()}
+            )
+        tmp_file.flush()
+
+        print(f"Generated zip size: {os.path.getsize(tmp_file.name)}")
+
+        target_client.upload_file(
+            Filename=tmp_file.name,
+            Bucket=target["bucketName"],
+            Key=target["objectKey"],
+            Config=get_transfer_config(),
+        )
+
+
 def handler(event, context):
     job = event["CodePipeline.job"]
     job_id = job["id"]
@@ -96,50 +486,24 @@ def handler(event, context):
 
         s3_loc = job["data"]["outputArtifacts"][0]["location"]["s3Location"]
 
-        temp_dir = tempfile.mkdtemp()
-
-        with tempfile.NamedTemporaryFile() as tmp_file:
-            s3.download_file(
-                Bucket=cdk_source_ref["bucketName"],
-                Key=cdk_source_ref["bucketKey"],
-                Filename=tmp_file.name,
-            )
-
-            print(f"Downloaded zip size: {os.path.getsize(tmp_file.name)}")
-
-            with zipfile.ZipFile(tmp_file.name, "r") as zip_file:
-                zip_file.extractall(temp_dir)
-
         for name, value in variables.items():
             print(f"Variable: {name}={value}")
 
-        Path(os.path.join(temp_dir, "variables.json")).write_text(json.dumps(variables))
-
-        with tempfile.NamedTemporaryFile() as tmp_file:
-            with zipfile.ZipFile(tmp_file.name, "w", zipfile.ZIP_DEFLATED) as zip_file:
-                for root, dirs, files in os.walk(temp_dir):
-                    for file in files:
-                        fullpath = os.path.join(root, file)
-                        arcname = str(Path(fullpath).relative_to(temp_dir))
-                        print(f"Adding {arcname}")
-                        zip_file.write(filename=fullpath, arcname=arcname)
-
-            credentials = job["data"]["artifactCredentials"]
-            s3_upload_client = Session(
-                aws_access_key_id=credentials["accessKeyId"],
-                aws_secret_access_key=credentials["secretAccessKey"],
-                aws_session_token=credentials["sessionToken"],
-            ).client("s3")
-
-            print(f"Generated zip size: {os.path.getsize(tmp_file.name)}")
-
-            s3_upload_client.upload_file(
-                Filename=tmp_file.name,
-                Bucket=s3_loc["bucketName"],
-                Key=s3_loc["objectKey"],
-            )
+        credentials = job["data"]["artifactCredentials"]
+        s3_upload_client = Session(
+            aws_access_key_id=credentials["accessKeyId"],
+            aws_secret_access_key=credentials["secretAccessKey"],
+            aws_session_token=credentials["sessionToken"],
+        ).client("s3")
 
-        shutil.rmtree(temp_dir)
+        if STREAMING_TRANSFER:
+            rewrite_zip_streaming(
+                s3, cdk_source_ref, s3_upload_client, s3_loc, variables
+            )
+        else:
+            rewrite_zip_with_tmp_files(
+                s3, cdk_source_ref, s3_upload_client, s3_loc, variables
+            )
 
         codepipeline.put_job_success_result(
             jobId=job_id,
@@ -0,0 +1,346 @@
+import http.server
+import io
+import json
+import os
+import random
+import threading
+import time
+import zipfile
+
+import boto3
+import pytest
+from botocore.config import Config
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+
+import index
+from index import MultipartUploadWriter, S3RangeReader, rewrite_zip
+
+
+def synthetic_assembly(path, files=200, stored=("asset.zip",)):
+    """Write a zip resembling a cloud assembly, with a mix of compressible
+    templates, incompressible assets and stored entries"""
+    rng = random.Random(1)
+    contents = {}
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.mkdir("assembly-Stage")
+        for i in range(files):
+            name = f"assembly-Stage/Stack{i}.template.json"
+            contents[name] = json.dumps({"Resources": {f"R{i}": i}} | {"x": "a" * i})
+            zip_file.writestr(name, contents[name])
+        for name in stored:
+            contents[name] = rng.randbytes(100_000)
+            zip_file.writestr(name, contents[name], compress_type=zipfile.ZIP_STORED)
+        contents["variables.json"] = "{}"
+        zip_file.writestr("variables.json", "{}")
+    return contents
+
+
+def read_zip(path):
+    with zipfile.ZipFile(path) as zip_file:
+        assert zip_file.testzip() is None
+        return {
+            info.filename: zip_file.read(info)
+            for info in zip_file.infolist()
+            if not info.is_dir()
+        }
+
+
+def test_rewrite_zip_copies_entries_and_replaces_variables(tmp_path):
+    source = tmp_path / "source.zip"
+    target = tmp_path / "target.zip"
+    contents = synthetic_assembly(source)
+
+    with open(source, "rb") as source_fp, open(target, "wb") as target_fp:
+        rewrite_zip(source_fp, target_fp, {"variables.json": b'{"a": "b"}'})
+
+    result = read_zip(target)
+    assert result.pop("variables.json") == b'{"a": "b"}'
+    del contents["variables.json"]
+    assert result == {
+        name: data.encode() if isinstance(data, str) else data
+        for name, data in contents.items()
+    }
+    with zipfile.ZipFile(source) as s, zipfile.ZipFile(target) as t:
+        assert t.getinfo("asset.zip").compress_type == zipfile.ZIP_STORED
+        assert [i.compress_size for i in s.infolist()[:-1]] == [
+            i.compress_size for i in t.infolist()[:-1]
+        ]
+
+
+def test_rewrite_zip_adds_variables_and_handles_data_descriptors(tmp_path):
+    # Entries written to an unseekable stream have their CRC and sizes in a
+    # data descriptor after the data
+    class Unseekable(io.RawIOBase):
+        def __init__(self, fp):
+            self.fp = fp
+
+        def writable(self):
+            return True
+
+        def write(self, b):
+            return self.fp.write(b)
+
+    source = tmp_path / "source.zip"
+    with open(source, "wb") as fp:
+        with zipfile.ZipFile(Unseekable(fp), "w", zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr("cdk.out/manifest.json", '{"version": "1"}')
+    with zipfile.ZipFile(source) as zip_file:
+        assert zip_file.getinfo("cdk.out/manifest.json").flag_bits & 0x08
+
+    target = tmp_path / "target.zip"
+    with open(source, "rb") as source_fp, open(target, "wb") as target_fp:
+        rewrite_zip(source_fp, target_fp, {"variables.json": b"{}"})
+
+    assert read_zip(target) == {
+        "cdk.out/manifest.json": b'{"version": "1"}',
+        "variables.json": b"{}",
+    }
+
+
+class FakeS3:
+    """Local stand-in for the S3 client calls used when streaming"""
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.uploads = {}
+        self.range_requests = 0
+        self.ranges = []
+        self.part_sizes = []
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def get_object(self, Bucket, Key, Range):
+        self.range_requests += 1
+        self.ranges.append(Range)
+        start, end = map(int, Range.removeprefix("bytes=").split("-"))
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)][start : end + 1])}
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = str(len(self.uploads))
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.part_sizes.append(len(Body))
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[(Bucket, Key)] = b"".join(
+            parts[part["PartNumber"]] for part in MultipartUpload["Parts"]
+        )
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        del self.uploads[UploadId]
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+
+
+def test_rewrite_zip_streaming_between_s3_objects(tmp_path, monkeypatch):
+    source = tmp_path / "source.zip"
+    contents = synthetic_assembly(source, stored=("a.zip", "b.zip", "c.zip"))
+    s3 = FakeS3({("cdk", "source.zip"): source.read_bytes()})
+    monkeypatch.setattr(index, "STREAMING_READ_BLOCK_SIZE", 64 * 1024)
+    monkeypatch.setattr(index, "TRANSFER_PART_SIZE", 64 * 1024)
+    monkeypatch.setattr(index, "TRANSFER_MAX_CONCURRENCY", 3)
+    monkeypatch.setattr(index, "TRANSFER_MULTIPART_THRESHOLD", 0)
+
+    index.rewrite_zip_streaming(
+        s3,
+        {"bucketName": "cdk", "bucketKey": "source.zip"},
+        s3,
+        {"bucketName": "artifacts", "objectKey": "output.zip"},
+        {"a": "b"},
+    )
+
+    target = tmp_path / "target.zip"
+    target.write_bytes(s3.objects[("artifacts", "output.zip")])
+    result = read_zip(target)
+    assert json.loads(result.pop("variables.json")) == {"a": "b"}
+    del contents["variables.json"]
+    assert result.keys() == contents.keys()
+    # Parts are bounded by the part size, and only the last one is smaller
+    assert max(s3.part_sizes) == 64 * 1024
+    assert sorted(s3.part_sizes)[1:] == [64 * 1024] * (len(s3.part_sizes) - 1)
+    # Each byte of the source is fetched about once
+    assert s3.range_requests < 2 * len(source.read_bytes()) / (64 * 1024) + 10
+
+
+def test_range_reader_serves_small_reads_from_the_current_block():
+    s3 = FakeS3({("b", "k"): bytes(range(256)) * 10})
+    reader = S3RangeReader(s3, "b", "k", block_size=1000)
+    assert reader.read(4) == bytes(range(4))
+    reader.seek(10)
+    assert reader.read(2) == bytes([10, 11])
+    assert s3.range_requests == 1
+    reader.seek(-2, os.SEEK_END)
+    assert reader.read(10) == bytes([254, 255])
+    assert reader.read(1) == b""
+    assert s3.range_requests == 2
+    assert reader.bytes_read == 1000 + 560
+    with pytest.raises(OSError):
+        reader.seek(-1)
+
+
+def test_range_reader_reads_ahead_of_sequential_reads():
+    data = bytes(range(256)) * 40
+    s3 = FakeS3({("b", "k"): data})
+    reader = S3RangeReader(s3, "b", "k", block_size=1000, max_concurrency=3)
+    assert reader.read(10) == data[:10]
+    # The blocks read ahead are requested in the background
+    deadline = time.monotonic() + 5
+    while len(s3.ranges) < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(s3.ranges) == [
+        "bytes=0-999",
+        "bytes=1000-1999",
+        "bytes=2000-2999",
+        "bytes=3000-3999",
+    ]
+    # Reads spanning blocks are served from the blocks read ahead
+    assert reader.read(2500) == data[10:2510]
+    reader.seek(-100, os.SEEK_END)
+    assert reader.read() == data[-100:]
+    reader.close()
+    assert len(s3.ranges) == len(set(s3.ranges))
+
+
+def test_multipart_upload_writer_is_aborted_on_failure():
+    s3 = FakeS3({("cdk", "source.zip"): b"not a zip"})
+
+    with pytest.raises(zipfile.BadZipFile):
+        index.rewrite_zip_streaming(
+            s3,
+            {"bucketName": "cdk", "bucketKey": "source.zip"},
+            s3,
+            {"bucketName": "artifacts", "objectKey": "output.zip"},
+            {},
+        )
+
+    assert s3.uploads == {}
+    assert ("artifacts", "output.zip") not in s3.objects
+
+
+def test_multipart_upload_writer_uploads_small_objects_in_one_request():
+    s3 = FakeS3()
+    writer = MultipartUploadWriter(s3, "b", "k", part_size=10, multipart_threshold=25)
+    writer.write(b"a" * 24)
+    writer.close()
+    assert s3.objects[("b", "k")] == b"a" * 24
+    assert s3.part_sizes == []
+
+    writer = MultipartUploadWriter(s3, "b", "empty", part_size=10)
+    writer.close()
+    assert s3.objects[("b", "empty")] == b""
+
+
+def test_multipart_upload_writer_bounds_parts_in_flight():
+    class SlowS3(FakeS3):
+        def __init__(self):
+            super().__init__()
+            self.lock = threading.Lock()
+            self.in_flight = 0
+            self.max_in_flight = 0
+
+        def upload_part(self, **kwargs):
+            with self.lock:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            time.sleep(0.01)
+            with self.lock:
+                self.in_flight -= 1
+            return super().upload_part(**kwargs)
+
+    s3 = SlowS3()
+    writer = MultipartUploadWriter(s3, "b", "k", part_size=10, max_concurrency=3)
+    data = bytes(range(256)) * 4
+    for i in range(0, len(data), 7):
+        writer.write(data[i : i + 7])
+    writer.close()
+
+    assert s3.objects[("b", "k")] == data
+    assert s3.max_in_flight == 3
+
+
+class S3StubHandler(http.server.BaseHTTPRequestHandler):
+    """Minimal S3-compatible endpoint with path-style object requests"""
+
+    objects: dict[str, bytes] = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_object(self, include_body):
+        data = self.objects.get(self.path.split("?")[0])
+        if data is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", '"etag"')
+        self.send_header("Last-Modified", "Mon, 01 Jan 2024 00:00:00 GMT")
+        self.end_headers()
+        if include_body:
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+        self._send_object(include_body=False)
+
+    def do_GET(self):
+        self._send_object(include_body=True)
+
+    def do_PUT(self):
+        length = int(self.headers["Content-Length"])
+        self.objects[self.path.split("?")[0]] = self.rfile.read(length)
+        self.send_response(200)
+        self.send_header("ETag", '"etag"')
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+@pytest.fixture
+def s3_stub():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), S3StubHandler)
+    S3StubHandler.objects = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield (
+            S3StubHandler.objects,
+            boto3.client(
+                "s3",
+                endpoint_url=f"http://127.0.0.1:{server.server_port}",
+                aws_access_key_id="test",
+                aws_secret_access_key="test",
+                config=Config(s3={"addressing_style": "path"}),
+            ),
+        )
+    finally:
+        server.shutdown()
+
+
+def test_rewrite_zip_with_tmp_files_through_download_file(tmp_path, s3_stub):
+    objects, client = s3_stub
+    source = tmp_path / "source.zip"
+    contents = synthetic_assembly(source)
+    objects["/cdk/source.zip"] = source.read_bytes()
+
+    index.rewrite_zip_with_tmp_files(
+        client,
+        {"bucketName": "cdk", "bucketKey": "source.zip"},
+        client,
+        {"bucketName": "artifacts", "objectKey": "output.zip"},
+        {"a": "b"},
+    )
+
+    target = tmp_path / "target.zip"
+    target.write_bytes(objects["/artifacts/output.zip"])
+    result = read_zip(target)
+    assert json.loads(result.pop("variables.json")) == {"a": "b"}
+    assert result.keys() == contents.keys() - {"variables.json"}
@@ -0,0 +1,385 @@
+"""Code shared by the Lambda functions that post to Slack.
+
+Each Lambda function is packaged from its own directory, so instead of being
+imported, the regions below are copied into the functions between the same
+"# BEGIN shared" and "# END shared" markers. Edit them here and run
+`make py-shared-sync` to update the copies. `make py-shared-check` fails if a
+copy differs from this file.
+"""
+
+import bisect
+import http.client
+import io
+import json
+import os
+import random
+import select
+import threading
+import time
+from dataclasses import dataclass
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from urllib.request import Request
+
+
+# BEGIN shared secret-cache (assets/shared/slack.py)
+class SecretCache:
+    """Cache secret strings from Secrets Manager across warm invocations.
+
+    Entries are keyed by secret ID and version stage and expire after
+    `ttl_seconds`. A TTL of 0 disables caching.
+    """
+
+    def __init__(
+        self,
+        client,
+        *,
+        ttl_seconds: float = 300,
+        version_stage: str = "AWSCURRENT",
+        clock=time.monotonic,
+    ):
+        self._client = client
+        self._ttl_seconds = ttl_seconds
+        self._version_stage = version_stage
+        self._clock = clock
+        # (secret_id, version_stage) -> (secret_string, expires_at)
+        self._entries: dict[tuple[str, str], tuple[str, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, secret_id: str, *, force_refresh: bool = False) -> str:
+        """Return the secret string, fetching it if missing, expired or forced."""
+        key = (secret_id, self._version_stage)
+        entry = self._entries.get(key)
+        if entry is not None and not force_refresh and self._clock() < entry[1]:
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        try:
+            # Secrets Manager defaults to AWSCURRENT when no stage is given
+            if self._version_stage == "AWSCURRENT":
+                response = self._client.get_secret_value(SecretId=secret_id)
+            else:
+                response = self._client.get_secret_value(
+                    SecretId=secret_id, VersionStage=self._version_stage
+                )
+        except Exception as e:
+            raise RuntimeError(f"Error retrieving secret '{secret_id}': {e}") from e
+        secret_string = response["SecretString"]
+        self._entries[key] = (secret_string, self._clock() + self._ttl_seconds)
+        return secret_string
+
+
+# END shared secret-cache
+
+
+# BEGIN shared transport (assets/shared/slack.py)
+SLACK_CONNECT_TIMEOUT_SECONDS = float(os.getenv("SLACK_CONNECT_TIMEOUT_SECONDS", "2"))
+SLACK_READ_TIMEOUT_SECONDS = float(os.getenv("SLACK_READ_TIMEOUT_SECONDS", "4"))
+
+
+class LatencyHistogram:
+    """Counts of request latencies in fixed millisecond buckets."""
+
+    BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, seconds * 1000)] += 1
+
+    def __str__(self):
+        labels = [f"<={bucket}ms" for bucket in self.BUCKETS_MS]
+        labels.append(f">{self.BUCKETS_MS[-1]}ms")
+        return " ".join(f"{label}:{n}" for label, n in zip(labels, self.counts))
+
+
+class TransportResponse:
+    def __init__(self, status: int, headers, body: bytes):
+        self.status = status
+        self.headers = headers
+        self._body = body
+
+    def read(self) -> bytes:
+        return self._body
+
+
+class RequestNotSentError(URLError):
+    """A request failed before it was sent, so retrying it cannot post the
+    message twice."""
+
+
+class KeepAliveTransport:
+    """Send HTTP(S) requests over persistent connections that are reused
+    across warm Lambda invocations.
+
+    `urlopen` is a drop-in replacement for `urllib.request.urlopen`: it
+    raises HTTPError for 4xx/5xx responses and URLError for connection
+    failures and timeouts. Idle connections are pooled per origin, and one
+    that the server has closed while idle is discarded before it is reused.
+    Requests are not retried, since a request that fails once sent (e.g. a
+    read timeout) may already have been processed. Failures before the
+    request was sent raise RequestNotSentError, which is safe to retry.
+    """
+
+    def __init__(
+        self,
+        *,
+        connect_timeout: float = SLACK_CONNECT_TIMEOUT_SECONDS,
+        read_timeout: float = SLACK_READ_TIMEOUT_SECONDS,
+        max_idle_per_origin: int = 4,
+        ssl_context=None,
+    ):
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._max_idle_per_origin = max_idle_per_origin
+        self._ssl_context = ssl_context
+        self._lock = threading.Lock()
+        self._idle: dict[tuple[str, str, int], list[http.client.HTTPConnection]] = {}
+        self.latency_histogram = LatencyHistogram()
+        self.connections_opened = 0
+
+    def _connect(self, origin: tuple[str, str, int]) -> http.client.HTTPConnection:
+        scheme, host, port = origin
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                host, port, timeout=self._connect_timeout, context=self._ssl_context
+            )
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self._connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self._read_timeout)
+        with self._lock:
+            self.connections_opened += 1
+        return conn
+
+    def _acquire(self, origin) -> http.client.HTTPConnection:
+        while True:
+            with self._lock:
+                idle = self._idle.get(origin)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                return self._connect(origin)
+            # An idle connection is only readable once the server has closed it
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+            if not readable:
+                return conn
+            conn.close()
+
+    def _release(self, origin, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self._max_idle_per_origin:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def urlopen(self, req: Request) -> TransportResponse:
+        url = urlsplit(req.full_url)
+        origin = (
+            url.scheme,
+            url.hostname,
+            url.port or (443 if url.scheme == "https" else 80),
+        )
+        path = (url.path or "/") + (f"?{url.query}" if url.query else "")
+        headers = dict(req.header_items())
+        if not req.has_header("Content-type"):
+            headers["Content-Type"] = "application/json"
+
+        start = time.monotonic()
+        try:
+            conn = self._acquire(origin)
+        except (OSError, http.client.HTTPException) as e:
+            raise RequestNotSentError(e) from e
+        try:
+            # A request that could not be written in full cannot be processed
+            conn.request(req.get_method(), path, body=req.data, headers=headers)
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise RequestNotSentError(e) from e
+        try:
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise URLError(e) from e
+        self.latency_histogram.observe(time.monotonic() - start)
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(origin, conn)
+
+        if response.status >= 400:
+            raise HTTPError(
+                req.full_url,
+                response.status,
+                response.reason,
+                response.headers,
+                io.BytesIO(body),
+            )
+        return TransportResponse(response.status, response.headers, body)
+
+
+# END shared transport
+
+
+# BEGIN shared sender (assets/shared/slack.py)
+SLACK_RATE_LIMIT_PER_SECOND = float(os.getenv("SLACK_RATE_LIMIT_PER_SECOND", "1"))
+SLACK_RATE_LIMIT_BURST = float(os.getenv("SLACK_RATE_LIMIT_BURST", "5"))
+# Time kept in reserve at the end of the Lambda invocation when retrying
+SLACK_RETRY_SAFETY_MARGIN_SECONDS = 1.0
+
+
+class TokenBucket:
+    """Token bucket limiting the rate of posts to a single webhook."""
+
+    def __init__(self, rate: float, capacity: float, *, clock=time.monotonic):
+        self._rate = rate
+        self._capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated_at = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how many seconds to wait before using it."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._updated_at) * self._rate
+            )
+            self._updated_at = now
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+            return max(wait, self._blocked_until - now)
+
+    def block_for(self, seconds: float):
+        """Hold back all posts for `seconds`, e.g. after a 429 with Retry-After."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+
+@dataclass
+class SendOutcome:
+    delivered: bool
+    attempts: int
+    waited_seconds: float
+    status: int | None = None
+    reason: str = ""
+
+
+class SlackSender:
+    """Post messages to Slack webhooks without making rate limiting worse.
+
+    Posts are paced by a token bucket per webhook URL. Throttled (429) and
+    server (5xx) errors, and requests that could not be sent, are retried
+    with jittered exponential backoff, honouring Retry-After, for as long as
+    the deadline allows. Other client errors are not retried, and neither
+    are connection errors once the request was sent (e.g. a read timeout),
+    as Slack may have posted the message already.
+    """
+
+    def __init__(
+        self,
+        urlopen_func,
+        *,
+        rate: float = SLACK_RATE_LIMIT_PER_SECOND,
+        burst: float = SLACK_RATE_LIMIT_BURST,
+        base_backoff_seconds: float = 0.5,
+        max_backoff_seconds: float = 8.0,
+        clock=time.monotonic,
+        sleep=time.sleep,
+        random_func=random.random,
+    ):
+        self._urlopen = urlopen_func
+        self._rate = rate
+        self._burst = burst
+        self._base_backoff_seconds = base_backoff_seconds
+        self._max_backoff_seconds = max_backoff_seconds
+        self._clock = clock
+        self._sleep = sleep
+        self._random = random_func
+        self._buckets: dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+
+    def _bucket(self, slack_url: str) -> TokenBucket:
+        with self._buckets_lock:
+            if slack_url not in self._buckets:
+                self._buckets[slack_url] = TokenBucket(
+                    self._rate, self._burst, clock=self._clock
+                )
+            return self._buckets[slack_url]
+
+    def _wait(self, seconds: float, deadline: float) -> bool:
+        """Sleep for `seconds` unless that would pass the deadline."""
+        if self._clock() + seconds > deadline:
+            return False
+        if seconds > 0:
+            self._sleep(seconds)
+        return True
+
+    def send(self, slack_url: str, slack_message: dict, *, deadline: float):
+        """Post the message, retrying until `deadline` (on the sender's clock)."""
+        bucket = self._bucket(slack_url)
+        body = json.dumps(slack_message).encode("utf-8")
+        start = self._clock()
+        attempts = 0
+        status, reason = None, ""
+
+        while True:
+            if not self._wait(bucket.reserve(), deadline):
+                reason = reason or "rate limited"
+                break
+            attempts += 1
+            try:
+                self._urlopen(
+                    Request(
+                        slack_url,
+                        data=body,
+                        headers={"Content-Type": "application/json"},
+                    )
+                ).read()
+                return SendOutcome(True, attempts, self._clock() - start, 200)
+            except HTTPError as e:
+                status, reason = e.code, str(e.reason)
+                if e.code != 429 and e.code < 500:
+                    break
+                retry_after = _parse_retry_after(e.headers)
+                if e.code == 429 and retry_after is not None:
+                    bucket.block_for(retry_after)
+            except URLError as e:
+                status, reason = None, str(e.reason)
+                # Once sent, the request may have been processed already
+                if not isinstance(e, RequestNotSentError):
+                    break
+
+            backoff = min(
+                self._max_backoff_seconds,
+                self._base_backoff_seconds * 2 ** (attempts - 1),
+            )
+            if not self._wait(backoff * self._random(), deadline):
+                break
+
+        return SendOutcome(False, attempts, self._clock() - start, status, reason)
+
+
+def _parse_retry_after(headers) -> float | None:
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def deadline_from_context(context) -> float:
+    """Return the time on the monotonic clock by which retries must stop."""
+    remaining_seconds = (
+        context.get_remaining_time_in_millis() / 1000 if context else 5.0
+    )
+    return time.monotonic() + remaining_seconds - SLACK_RETRY_SAFETY_MARGIN_SECONDS
+
+
+# END shared sender
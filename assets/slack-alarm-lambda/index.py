@@ -1,6 +1,15 @@
+import bisect
+import http.client
+import io
 import json
 import os
-from urllib.request import Request, urlopen
+import random
+import select
+import threading
+import time
+from dataclasses import asdict, dataclass
+from urllib.parse import urlsplit
+from urllib.request import Request
 from urllib.error import URLError, HTTPError
 
 import boto3
@@ -11,30 +20,742 @@ cloudwatch = boto3.client("cloudwatch")
 SLACK_URL_SECRET_NAME = os.getenv("SLACK_URL_SECRET_NAME", None)
 PROJECT_NAME = os.getenv("PROJECT_NAME", "undefined")
 ENVIRONMENT_NAME = os.getenv("ENVIRONMENT_NAME", "undefined")
+# Max number of transitions listed individually in a digest message
+DIGEST_MAX_LISTED_TRANSITIONS = int(os.getenv("DIGEST_MAX_LISTED_TRANSITIONS", "30"))
+
+ALARM_EMOJIS = {
+    "ALARM": ":rotating_light:",
+    "INSUFFICIENT_DATA": ":warning:",
+    "OK": ":white_check_mark:",
+}
+
+# Where state shared between invocations (the index of active alarms and
+# flap tracking) is kept: "memory", "file:<path>" or "dynamodb:<table name>"
+STATE_STORE = os.getenv("STATE_STORE", "memory")
+ACTIVE_ALARMS_RECONCILE_INTERVAL_SECONDS = float(
+    os.getenv("ACTIVE_ALARMS_RECONCILE_INTERVAL_SECONDS", "30")
+)
+# An alarm with more than FLAP_THRESHOLD transitions within FLAP_WINDOW_SECONDS
+# is considered flapping. A threshold of 0 disables flap detection.
+FLAP_THRESHOLD = int(os.getenv("FLAP_THRESHOLD", "0"))
+FLAP_WINDOW_SECONDS = float(os.getenv("FLAP_WINDOW_SECONDS", "900"))
+SLACK_URL_SECRET_TTL_SECONDS = float(os.getenv("SLACK_URL_SECRET_TTL_SECONDS", "300"))
+SLACK_URL_SECRET_VERSION_STAGE = os.getenv(
+    "SLACK_URL_SECRET_VERSION_STAGE", "AWSCURRENT"
+)
+
+
+# BEGIN shared secret-cache (assets/shared/slack.py)
+class SecretCache:
+    """Cache secret strings from Secrets Manager across warm invocations.
+
+    Entries are keyed by secret ID and version stage and expire after
+    `ttl_seconds`. A TTL of 0 disables caching.
+    """
+
+    def __init__(
+        self,
+        client,
+        *,
+        ttl_seconds: float = 300,
+        version_stage: str = "AWSCURRENT",
+        clock=time.monotonic,
+    ):
+        self._client = client
+        self._ttl_seconds = ttl_seconds
+        self._version_stage = version_stage
+        self._clock = clock
+        # (secret_id, version_stage) -> (secret_string, expires_at)
+        self._entries: dict[tuple[str, str], tuple[str, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, secret_id: str, *, force_refresh: bool = False) -> str:
+        """Return the secret string, fetching it if missing, expired or forced."""
+        key = (secret_id, self._version_stage)
+        entry = self._entries.get(key)
+        if entry is not None and not force_refresh and self._clock() < entry[1]:
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        try:
+            # Secrets Manager defaults to AWSCURRENT when no stage is given
+            if self._version_stage == "AWSCURRENT":
+                response = self._client.get_secret_value(SecretId=secret_id)
+            else:
+                response = self._client.get_secret_value(
+                    SecretId=secret_id, VersionStage=self._version_stage
+                )
+        except Exception as e:
+            raise RuntimeError(f"Error retrieving secret '{secret_id}': {e}") from e
+        secret_string = response["SecretString"]
+        self._entries[key] = (secret_string, self._clock() + self._ttl_seconds)
+        return secret_string
+
+
+# END shared secret-cache
+secret_cache = SecretCache(
+    secrets_manager,
+    ttl_seconds=SLACK_URL_SECRET_TTL_SECONDS,
+    version_stage=SLACK_URL_SECRET_VERSION_STAGE,
+)
+
+
+# BEGIN shared transport (assets/shared/slack.py)
+SLACK_CONNECT_TIMEOUT_SECONDS = float(os.getenv("SLACK_CONNECT_TIMEOUT_SECONDS", "2"))
+SLACK_READ_TIMEOUT_SECONDS = float(os.getenv("SLACK_READ_TIMEOUT_SECONDS", "4"))
+
+
+class LatencyHistogram:
+    """Counts of request latencies in fixed millisecond buckets."""
+
+    BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, seconds * 1000)] += 1
+
+    def __str__(self):
+        labels = [f"<={bucket}ms" for bucket in self.BUCKETS_MS]
+        labels.append(f">{self.BUCKETS_MS[-1]}ms")
+        return " ".join(f"{label}:{n}" for label, n in zip(labels, self.counts))
+
+
+class TransportResponse:
+    def __init__(self, status: int, headers, body: bytes):
+        self.status = status
+        self.headers = headers
+        self._body = body
+
+    def read(self) -> bytes:
+        return self._body
+
+
+class RequestNotSentError(URLError):
+    """A request failed before it was sent, so retrying it cannot post the
+    message twice."""
+
+
+class KeepAliveTransport:
+    """Send HTTP(S) requests over persistent connections that are reused
+    across warm Lambda invocations.
+
+    `urlopen` is a drop-in replacement for `urllib.request.urlopen`: it
+    raises HTTPError for 4xx/5xx responses and URLError for connection
+    failures and timeouts. Idle connections are pooled per origin, and one
+    that the server has closed while idle is discarded before it is reused.
+    Requests are not retried, since a request that fails once sent (e.g. a
+    read timeout) may already have been processed. Failures before the
+    request was sent raise RequestNotSentError, which is safe to retry.
+    """
+
+    def __init__(
+        self,
+        *,
+        connect_timeout: float = SLACK_CONNECT_TIMEOUT_SECONDS,
+        read_timeout: float = SLACK_READ_TIMEOUT_SECONDS,
+        max_idle_per_origin: int = 4,
+        ssl_context=None,
+    ):
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._max_idle_per_origin = max_idle_per_origin
+        self._ssl_context = ssl_context
+        self._lock = threading.Lock()
+        self._idle: dict[tuple[str, str, int], list[http.client.HTTPConnection]] = {}
+        self.latency_histogram = LatencyHistogram()
+        self.connections_opened = 0
+
+    def _connect(self, origin: tuple[str, str, int]) -> http.client.HTTPConnection:
+        scheme, host, port = origin
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                host, port, timeout=self._connect_timeout, context=self._ssl_context
+            )
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self._connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self._read_timeout)
+        with self._lock:
+            self.connections_opened += 1
+        return conn
+
+    def _acquire(self, origin) -> http.client.HTTPConnection:
+        while True:
+            with self._lock:
+                idle = self._idle.get(origin)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                return self._connect(origin)
+            # An idle connection is only readable once the server has closed it
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+            if not readable:
+                return conn
+            conn.close()
+
+    def _release(self, origin, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self._max_idle_per_origin:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def urlopen(self, req: Request) -> TransportResponse:
+        url = urlsplit(req.full_url)
+        origin = (
+            url.scheme,
+            url.hostname,
+            url.port or (443 if url.scheme == "https" else 80),
+        )
+        path = (url.path or "/") + (f"?{url.query}" if url.query else "")
+        headers = dict(req.header_items())
+        if not req.has_header("Content-type"):
+            headers["Content-Type"] = "application/json"
+
+        start = time.monotonic()
+        try:
+            conn = self._acquire(origin)
+        except (OSError, http.client.HTTPException) as e:
+            raise RequestNotSentError(e) from e
+        try:
+            # A request that could not be written in full cannot be processed
+            conn.request(req.get_method(), path, body=req.data, headers=headers)
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise RequestNotSentError(e) from e
+        try:
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise URLError(e) from e
+        self.latency_histogram.observe(time.monotonic() - start)
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(origin, conn)
+
+        if response.status >= 400:
+            raise HTTPError(
+                req.full_url,
+                response.status,
+                response.reason,
+                response.headers,
+                io.BytesIO(body),
+            )
+        return TransportResponse(response.status, response.headers, body)
+
+
+# END shared transport
+transport = KeepAliveTransport()
+
+
+# BEGIN shared sender (assets/shared/slack.py)
+SLACK_RATE_LIMIT_PER_SECOND = float(os.getenv("SLACK_RATE_LIMIT_PER_SECOND", "1"))
+SLACK_RATE_LIMIT_BURST = float(os.getenv("SLACK_RATE_LIMIT_BURST", "5"))
+# Time kept in reserve at the end of the Lambda invocation when retrying
+SLACK_RETRY_SAFETY_MARGIN_SECONDS = 1.0
+
+
+class TokenBucket:
+    """Token bucket limiting the rate of posts to a single webhook."""
+
+    def __init__(self, rate: float, capacity: float, *, clock=time.monotonic):
+        self._rate = rate
+        self._capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated_at = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how many seconds to wait before using it."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._updated_at) * self._rate
+            )
+            self._updated_at = now
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+            return max(wait, self._blocked_until - now)
+
+    def block_for(self, seconds: float):
+        """Hold back all posts for `seconds`, e.g. after a 429 with Retry-After."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+
+@dataclass
+class SendOutcome:
+    delivered: bool
+    attempts: int
+    waited_seconds: float
+    status: int | None = None
+    reason: str = ""
+
+
+class SlackSender:
+    """Post messages to Slack webhooks without making rate limiting worse.
+
+    Posts are paced by a token bucket per webhook URL. Throttled (429) and
+    server (5xx) errors, and requests that could not be sent, are retried
+    with jittered exponential backoff, honouring Retry-After, for as long as
+    the deadline allows. Other client errors are not retried, and neither
+    are connection errors once the request was sent (e.g. a read timeout),
+    as Slack may have posted the message already.
+    """
+
+    def __init__(
+        self,
+        urlopen_func,
+        *,
+        rate: float = SLACK_RATE_LIMIT_PER_SECOND,
+        burst: float = SLACK_RATE_LIMIT_BURST,
+        base_backoff_seconds: float = 0.5,
+        max_backoff_seconds: float = 8.0,
+        clock=time.monotonic,
+        sleep=time.sleep,
+        random_func=random.random,
+    ):
+        self._urlopen = urlopen_func
+        self._rate = rate
+        self._burst = burst
+        self._base_backoff_seconds = base_backoff_seconds
+        self._max_backoff_seconds = max_backoff_seconds
+        self._clock = clock
+        self._sleep = sleep
+        self._random = random_func
+        self._buckets: dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+
+    def _bucket(self, slack_url: str) -> TokenBucket:
+        with self._buckets_lock:
+            if slack_url not in self._buckets:
+                self._buckets[slack_url] = TokenBucket(
+                    self._rate, self._burst, clock=self._clock
+                )
+            return self._buckets[slack_url]
+
+    def _wait(self, seconds: float, deadline: float) -> bool:
+        """Sleep for `seconds` unless that would pass the deadline."""
+        if self._clock() + seconds > deadline:
+            return False
+        if seconds > 0:
+            self._sleep(seconds)
+        return True
+
+    def send(self, slack_url: str, slack_message: dict, *, deadline: float):
+        """Post the message, retrying until `deadline` (on the sender's clock)."""
+        bucket = self._bucket(slack_url)
+        body = json.dumps(slack_message).encode("utf-8")
+        start = self._clock()
+        attempts = 0
+        status, reason = None, ""
+
+        while True:
+            if not self._wait(bucket.reserve(), deadline):
+                reason = reason or "rate limited"
+                break
+            attempts += 1
+            try:
+                self._urlopen(
+                    Request(
+                        slack_url,
+                        data=body,
+                        headers={"Content-Type": "application/json"},
+                    )
+                ).read()
+                return SendOutcome(True, attempts, self._clock() - start, 200)
+            except HTTPError as e:
+                status, reason = e.code, str(e.reason)
+                if e.code != 429 and e.code < 500:
+                    break
+                retry_after = _parse_retry_after(e.headers)
+                if e.code == 429 and retry_after is not None:
+                    bucket.block_for(retry_after)
+            except URLError as e:
+                status, reason = None, str(e.reason)
+                # Once sent, the request may have been processed already
+                if not isinstance(e, RequestNotSentError):
+                    break
+
+            backoff = min(
+                self._max_backoff_seconds,
+                self._base_backoff_seconds * 2 ** (attempts - 1),
+            )
+            if not self._wait(backoff * self._random(), deadline):
+                break
+
+        return SendOutcome(False, attempts, self._clock() - start, status, reason)
+
+
+def _parse_retry_after(headers) -> float | None:
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def deadline_from_context(context) -> float:
+    """Return the time on the monotonic clock by which retries must stop."""
+    remaining_seconds = (
+        context.get_remaining_time_in_millis() / 1000 if context else 5.0
+    )
+    return time.monotonic() + remaining_seconds - SLACK_RETRY_SAFETY_MARGIN_SECONDS
+
+
+# END shared sender
+slack_sender = SlackSender(transport.urlopen)
 
 
 def handler(event, context):
     print("Event: " + json.dumps(event))
+    if event["Records"] and event["Records"][0].get("eventSource") == "aws:sqs":
+        return handle_digest(event["Records"], context)
+
     message = json.loads(event["Records"][0]["Sns"]["Message"])
     topic_arn = event["Records"][0]["Sns"]["TopicArn"]
     region = topic_arn.split(":")[3]
 
-    active_alarms = list_all_active_alarms(topic_arn)
-    return send_slack_notification(message, region, active_alarms)
+    # Failed invocations are retried with the same event, which must not
+    # count as another transition
+    decision, transitions = flap_detector.check(
+        message["AlarmName"], event["Records"][0]["Sns"].get("MessageId")
+    )
+    # Every transition updates the index, including suppressed ones
+    active_alarms = list_all_active_alarms(
+        topic_arn, message["AlarmName"], message["NewStateValue"]
+    )
+    if decision == FlapDetector.SUPPRESSED:
+        print(f"Suppressing notification for flapping alarm {message['AlarmName']}")
+        return {"delivered": False, "suppressed": True}
 
+    outcome = send_slack_notification(
+        message,
+        region,
+        active_alarms,
+        deadline=deadline_from_context(context),
+        flapping_transitions=transitions if decision == FlapDetector.FLAPPING else 0,
+    )
+    return asdict(outcome)
 
-def list_all_active_alarms(topic_arn: str) -> list[str]:
-    try:
-        response: dict = cloudwatch.describe_alarms(
-            AlarmTypes=["CompositeAlarm", "MetricAlarm"],
-            StateValue="ALARM",
-            ActionPrefix=topic_arn,
-        )
-        all_alarms = response["CompositeAlarms"] + response["MetricAlarms"]
-        names: list[str] = [
+
+def describe_active_alarms(topic_arn: str) -> list[str]:
+    """Return the names of all alarms in ALARM state with actions on the topic,
+    following NextToken across all pages."""
+    paginator = cloudwatch.get_paginator("describe_alarms")
+    names: list[str] = []
+    for page in paginator.paginate(
+        AlarmTypes=["CompositeAlarm", "MetricAlarm"],
+        StateValue="ALARM",
+        ActionPrefix=topic_arn,
+    ):
+        all_alarms = page.get("CompositeAlarms", []) + page.get("MetricAlarms", [])
+        names.extend(
             alarm["AlarmName"] for alarm in all_alarms if alarm["ActionsEnabled"]
-        ]
-        return names
+        )
+    return names
+
+
+class MemoryStore:
+    """Store of JSON documents kept in the memory of the container."""
+
+    def __init__(self):
+        self._documents: dict[str, dict] = {}
+
+    def get(self, key: str) -> dict | None:
+        document = self._documents.get(key)
+        return json.loads(json.dumps(document)) if document is not None else None
+
+    def put(self, key: str, document: dict):
+        self._documents[key] = json.loads(json.dumps(document))
+
+    def update(self, key: str, func) -> dict:
+        """Store and return `func` applied to the document, or to None if
+        there is none yet."""
+        document = func(self.get(key))
+        self.put(key, document)
+        return document
+
+
+class FileStore:
+    """Store of JSON documents kept in a single local file, e.g. in /tmp."""
+
+    def __init__(self, path: str):
+        self._path = path
+
+    def _read(self) -> dict:
+        try:
+            with open(self._path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def get(self, key: str) -> dict | None:
+        return self._read().get(key)
+
+    def put(self, key: str, document: dict):
+        documents = self._read()
+        documents[key] = document
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(documents, f)
+        os.replace(tmp_path, self._path)
+
+    def update(self, key: str, func) -> dict:
+        """Store and return `func` applied to the document, or to None if
+        there is none yet."""
+        document = func(self.get(key))
+        self.put(key, document)
+        return document
+
+
+class DynamoDbStore:
+    """Store of JSON documents in a DynamoDB table with the string partition
+    key `pk`. Documents are kept as JSON in the `document` attribute.
+
+    The table is shared by all containers, so `update` only writes a document
+    if its `version` attribute is unchanged since it was read, and otherwise
+    applies the update again to the newer document."""
+
+    def __init__(self, client, table_name: str, max_attempts: int = 10):
+        self._client = client
+        self._table_name = table_name
+        self._max_attempts = max_attempts
+
+    def _get_item(self, key: str) -> dict | None:
+        response = self._client.get_item(
+            TableName=self._table_name,
+            Key={"pk": {"S": key}},
+            ConsistentRead=True,
+        )
+        return response.get("Item")
+
+    def get(self, key: str) -> dict | None:
+        item = self._get_item(key)
+        return json.loads(item["document"]["S"]) if item else None
+
+    def put(self, key: str, document: dict):
+        self._client.put_item(
+            TableName=self._table_name,
+            Item={"pk": {"S": key}, "document": {"S": json.dumps(document)}},
+        )
+
+    def update(self, key: str, func) -> dict:
+        """Store and return `func` applied to the document, or to None if
+        there is none yet. `func` is called again if the document was changed
+        concurrently, so it should only depend on the document it is given."""
+        for _ in range(self._max_attempts):
+            item = self._get_item(key)
+            document = func(json.loads(item["document"]["S"]) if item else None)
+            if item is None:
+                condition = {"ConditionExpression": "attribute_not_exists(pk)"}
+                version = 0
+            elif "version" not in item:
+                condition = {
+                    "ConditionExpression": "attribute_not_exists(#version)",
+                    "ExpressionAttributeNames": {"#version": "version"},
+                }
+                version = 0
+            else:
+                version = int(item["version"]["N"])
+                condition = {
+                    "ConditionExpression": "#version = :version",
+                    "ExpressionAttributeNames": {"#version": "version"},
+                    "ExpressionAttributeValues": {":version": {"N": str(version)}},
+                }
+            try:
+                self._client.put_item(
+                    TableName=self._table_name,
+                    Item={
+                        "pk": {"S": key},
+                        "document": {"S": json.dumps(document)},
+                        "version": {"N": str(version + 1)},
+                    },
+                    **condition,
+                )
+                return document
+            except self._client.exceptions.ConditionalCheckFailedException:
+                print(f"Document {key} was changed concurrently, retrying")
+        raise Exception(
+            f"Could not update document {key}: changed concurrently "
+            f"{self._max_attempts} times"
+        )
+
+
+def store_from_spec(spec: str):
+    """Create a store from a spec such as "memory", "file:/tmp/alarms.json"
+    or "dynamodb:my-table"."""
+    kind, _, location = spec.partition(":")
+    if kind == "memory":
+        return MemoryStore()
+    if kind == "file" and location:
+        return FileStore(location)
+    if kind == "dynamodb" and location:
+        return DynamoDbStore(boto3.client("dynamodb"), location)
+    raise ValueError(f"Unknown store: {spec}")
+
+
+class ActiveAlarmIndex:
+    """Alarms currently in ALARM per SNS topic, maintained from the state
+    transitions the Lambda receives instead of scanning CloudWatch for every
+    notification.
+
+    Every transition adds or removes its alarm. The index is reconciled
+    against a full listing when it is missing or older than
+    `reconcile_interval_seconds`, which also corrects transitions that were
+    lost, delivered out of order or handled by another container.
+    """
+
+    def __init__(
+        self,
+        store,
+        list_func,
+        *,
+        reconcile_interval_seconds: float,
+        clock=time.time,
+    ):
+        self._store = store
+        self._list_func = list_func
+        self._reconcile_interval_seconds = reconcile_interval_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def apply(self, topic_arn: str, alarm_name: str, new_state: str) -> list[str]:
+        """Record a state transition and return the active alarms for the topic."""
+        return self.apply_all(topic_arn, [(alarm_name, new_state)])
+
+    def apply_all(
+        self, topic_arn: str, transitions: list[tuple[str, str]]
+    ) -> list[str]:
+        """Record state transitions, ordered oldest first, and return the
+        active alarms for the topic."""
+        with self._lock:
+            now = self._clock()
+
+            def apply(document: dict | None) -> dict:
+                if (
+                    document is None
+                    or now - document["reconciledAt"]
+                    >= self._reconcile_interval_seconds
+                ):
+                    document = {
+                        "alarms": self._list_func(topic_arn),
+                        "reconciledAt": now,
+                    }
+
+                alarms = document["alarms"]
+                for alarm_name, new_state in transitions:
+                    alarms = [name for name in alarms if name != alarm_name]
+                    if new_state == "ALARM":
+                        alarms.append(alarm_name)
+                document["alarms"] = alarms
+                return document
+
+            return self._store.update(f"active-alarms:{topic_arn}", apply)["alarms"]
+
+
+class FlapDetector:
+    """Track the state transitions of each alarm in a sliding window.
+
+    An alarm with more than `threshold` transitions within `window_seconds`
+    is flapping. The transition that starts the flapping is reported once as
+    FLAPPING, and later transitions are SUPPRESSED until the window has
+    passed, after which FLAPPING is reported again if it is still flapping.
+
+    A transition identified by `transition_id` (e.g. the ID of the message
+    that carried it) is only counted once, and a redelivered transition gets
+    the decision it got the first time.
+    """
+
+    NOTIFY = "NOTIFY"
+    FLAPPING = "FLAPPING"
+    SUPPRESSED = "SUPPRESSED"
+
+    def __init__(
+        self, store, *, threshold: int, window_seconds: float, clock=time.time
+    ):
+        self._store = store
+        self._threshold = threshold
+        self._window_seconds = window_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def check(
+        self, alarm_name: str, transition_id: str | None = None
+    ) -> tuple[str, int]:
+        """Record a transition of the alarm. Return the decision and the number
+        of transitions within the window."""
+        if self._threshold <= 0:
+            return self.NOTIFY, 1
+        with self._lock:
+            now = self._clock()
+            result = (self.NOTIFY, 1)
+
+            def check(document: dict | None) -> dict:
+                nonlocal result
+                document = document or {"transitions": []}
+                transitions = [
+                    t for t in document["transitions"] if now - t < self._window_seconds
+                ]
+                # Transition ID -> [time, decision, number of transitions]
+                seen = {
+                    seen_id: entry
+                    for seen_id, entry in document.get("seen", {}).items()
+                    if now - entry[0] < self._window_seconds
+                }
+                if transition_id is not None and transition_id in seen:
+                    _, decision, count = seen[transition_id]
+                    result = (decision, count)
+                    return document
+                transitions.append(now)
+                notified_at = document.get("flappingNotifiedAt")
+
+                if len(transitions) <= self._threshold:
+                    decision, notified_at = self.NOTIFY, None
+                elif notified_at is None or now - notified_at >= self._window_seconds:
+                    decision, notified_at = self.FLAPPING, now
+                else:
+                    decision = self.SUPPRESSED
+
+                if transition_id is not None:
+                    seen[transition_id] = [now, decision, len(transitions)]
+                result = (decision, len(transitions))
+                return {
+                    "transitions": transitions,
+                    "flappingNotifiedAt": notified_at,
+                    "seen": seen,
+                }
+
+            self._store.update(f"flap:{alarm_name}", check)
+            return result
+
+
+state_store = store_from_spec(STATE_STORE)
+
+flap_detector = FlapDetector(
+    state_store, threshold=FLAP_THRESHOLD, window_seconds=FLAP_WINDOW_SECONDS
+)
+
+active_alarm_index = ActiveAlarmIndex(
+    state_store,
+    describe_active_alarms,
+    reconcile_interval_seconds=ACTIVE_ALARMS_RECONCILE_INTERVAL_SECONDS,
+)
+
+
+def list_all_active_alarms(
+    topic_arn: str, current_alarm: str, current_state: str
+) -> list[str]:
+    try:
+        return active_alarm_index.apply(topic_arn, current_alarm, current_state)
     except Exception as e:
         print(f"Failed to list alarms: {e}")
         return []
@@ -51,19 +772,43 @@ def get_masked_slack_webhook_url(slack_webhook_url: str):
 
 
 def get_secret(secret):
-    try:
-        return secrets_manager.get_secret_value(SecretId=secret)["SecretString"]
-    except Exception as e:
-        raise Exception(f"Error retrieving secret: {e}")
+    return secret_cache.get(secret)
 
 
-def send_slack_notification(message: str, region: str, active_alarms: list[str]):
-    alarm_emojis = {
-        "ALARM": ":rotating_light:",
-        "INSUFFICIENT_DATA": ":warning:",
-        "OK": ":white_check_mark:",
-    }
-    if message["NewStateValue"] == "ALARM":
+def post_to_slack_with_secret_refresh(
+    secret_name: str, slack_message: dict, *, deadline: float
+) -> SendOutcome:
+    """Post to the webhook stored in the secret. If Slack rejects the webhook
+    with 403/404 it may have been rotated, so the secret is refreshed and the
+    post retried once if the webhook changed."""
+    slack_url = get_secret(secret_name)
+    print(f"Posting message to Slack URL {get_masked_slack_webhook_url(slack_url)}")
+    outcome = slack_sender.send(slack_url, slack_message, deadline=deadline)
+    if outcome.status in (403, 404):
+        refreshed_slack_url = secret_cache.get(secret_name, force_refresh=True)
+        if refreshed_slack_url != slack_url:
+            print("Slack rejected the webhook URL, retrying with refreshed secret")
+            outcome = slack_sender.send(
+                refreshed_slack_url, slack_message, deadline=deadline
+            )
+    print(f"Secret cache hits={secret_cache.hits} misses={secret_cache.misses}")
+    print(f"Slack latency histogram: {transport.latency_histogram}")
+    print(f"Slack outcome: {outcome}")
+    return outcome
+
+
+def send_slack_notification(
+    message: str,
+    region: str,
+    active_alarms: list[str],
+    *,
+    deadline: float,
+    flapping_transitions: int = 0,
+) -> SendOutcome:
+    alarm_emojis = ALARM_EMOJIS
+    if flapping_transitions:
+        color = "warning"
+    elif message["NewStateValue"] == "ALARM":
         color = "danger"
     else:
         color = "good"
@@ -114,18 +859,194 @@ def send_slack_notification(message: str, region: str, active_alarms: list[str])
         }
     ]
 
+    if flapping_transitions:
+        window_minutes = round(FLAP_WINDOW_SECONDS / 60)
+        attachments[0]["fields"].insert(
+            0,
+            {
+                "title": "Flapping :repeat:",
+                "value": f"{flapping_transitions} state changes in the last "
+                f"{window_minutes} minutes. Further notifications for this alarm "
+                f"are suppressed for {window_minutes} minutes.",
+                "short": False,
+            },
+        )
+
     slackMessage = {
         "attachments": attachments,
     }
 
-    slack_url = get_secret(SLACK_URL_SECRET_NAME)
+    outcome = post_to_slack_with_secret_refresh(
+        SLACK_URL_SECRET_NAME, slackMessage, deadline=deadline
+    )
+    raise_for_outcome(outcome)
+    return outcome
 
-    req = Request(slack_url, json.dumps(slackMessage).encode("utf-8"))
-    print(f"Posting message to Slack URL {get_masked_slack_webhook_url(slack_url)}")
+
+def raise_for_outcome(outcome: SendOutcome):
+    if not outcome.delivered:
+        if outcome.status is not None:
+            raise Exception(
+                f"Request to slack failed: {outcome.status} {outcome.reason}"
+            )
+        if outcome.attempts == 0:
+            raise Exception("Request to slack not sent within the time budget")
+        raise Exception(f"Server connection to slack failed: {outcome.reason}")
+
+
+def parse_digest_record(record: dict) -> tuple[str, str, dict]:
+    """Return the topic ARN, region and alarm message of a buffered SNS
+    notification, raising ValueError if it is malformed."""
     try:
-        response = urlopen(req)
-        response.read()
-    except HTTPError as e:
-        raise Exception(f"Request to slack failed: {e.code} {e.reason}")
-    except URLError as e:
-        raise Exception(f"Server connection to slack failed: {e.reason}")
+        notification = json.loads(record["body"])
+        topic_arn = notification["TopicArn"]
+        message = json.loads(notification["Message"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"not an SNS notification: {e!r}") from e
+    if not isinstance(topic_arn, str) or len(topic_arn.split(":")) != 6:
+        raise ValueError(f"invalid topic ARN: {topic_arn!r}")
+    if not isinstance(message, dict):
+        raise ValueError("message is not an object")
+    for field in ("AlarmName", "NewStateValue"):
+        if not isinstance(message.get(field), str):
+            raise ValueError(f"message has no {field}")
+    return topic_arn, topic_arn.split(":")[3], message
+
+
+def handle_digest(records: list[dict], context) -> dict:
+    """Handle a batch of SNS alarm notifications buffered through SQS.
+
+    Transitions are grouped per topic and posted as one digest message per
+    topic. Records of topics whose digest could not be delivered are
+    reported as batch item failures so only they are retried.
+    """
+    deadline = deadline_from_context(context)
+    messages_by_topic: dict[str, list[tuple[str, dict]]] = {}
+    regions: dict[str, str] = {}
+    for record in records:
+        try:
+            topic_arn, region, message = parse_digest_record(record)
+        except ValueError as e:
+            print(f"Ignoring malformed record {record.get('messageId')}: {e}")
+            continue
+        regions[topic_arn] = region
+        messages_by_topic.setdefault(topic_arn, []).append(
+            (record["messageId"], message)
+        )
+
+    failures = []
+    for topic_arn, entries in messages_by_topic.items():
+        entries = sorted(entries, key=lambda entry: entry[1].get("StateChangeTime", ""))
+        # Every transition updates the index, including suppressed ones
+        try:
+            active_alarms = active_alarm_index.apply_all(
+                topic_arn,
+                [
+                    (message["AlarmName"], message["NewStateValue"])
+                    for _, message in entries
+                ],
+            )
+        except Exception as e:
+            print(f"Failed to list alarms: {e}")
+            active_alarms = []
+
+        # (message, number of transitions if flapping, else 0)
+        notified = []
+        for message_id, message in entries:
+            decision, transitions = flap_detector.check(
+                message["AlarmName"], message_id
+            )
+            if decision != FlapDetector.SUPPRESSED:
+                notified.append(
+                    (message, transitions if decision == FlapDetector.FLAPPING else 0)
+                )
+        if not notified:
+            continue
+        try:
+            if len(notified) == 1:
+                [(message, flapping_transitions)] = notified
+                send_slack_notification(
+                    message,
+                    regions[topic_arn],
+                    active_alarms,
+                    deadline=deadline,
+                    flapping_transitions=flapping_transitions,
+                )
+            else:
+                outcome = post_to_slack_with_secret_refresh(
+                    SLACK_URL_SECRET_NAME,
+                    create_digest_message(notified, regions[topic_arn], active_alarms),
+                    deadline=deadline,
+                )
+                raise_for_outcome(outcome)
+        except Exception as e:
+            print(f"Failed to send digest for {topic_arn}: {e}")
+            failures.extend(message_id for message_id, _ in entries)
+
+    return {
+        "batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]
+    }
+
+
+def create_digest_message(
+    transitions: list[tuple[dict, int]], region: str, active_alarms: list[str]
+) -> dict:
+    """Summarize many alarm transitions, ordered oldest first, in one message.
+
+    Each transition is given with its number of recent transitions if the
+    alarm is flapping, and 0 otherwise.
+    """
+    messages = [message for message, _ in transitions]
+    counts: dict[str, int] = {}
+    for message in messages:
+        state = message["NewStateValue"]
+        counts[state] = counts.get(state, 0) + 1
+
+    lines = [
+        f"{ALARM_EMOJIS.get(message['NewStateValue'], '')} {message['AlarmName']}: "
+        f"{message.get('OldStateValue', 'Unknown')} -> {message['NewStateValue']}"
+        + (
+            f" :repeat: flapping ({flapping_transitions} state changes)"
+            if flapping_transitions
+            else ""
+        )
+        for message, flapping_transitions in transitions[
+            -DIGEST_MAX_LISTED_TRANSITIONS:
+        ]
+    ]
+    if len(messages) > DIGEST_MAX_LISTED_TRANSITIONS:
+        lines.insert(
+            0, f"...and {len(messages) - DIGEST_MAX_LISTED_TRANSITIONS} earlier"
+        )
+
+    summary = ", ".join(f"{state}: {count}" for state, count in sorted(counts.items()))
+    return {
+        "attachments": [
+            {
+                "color": "danger" if active_alarms else "good",
+                "title": f"{len(messages)} alarm state changes",
+                "title_link": "https://console.aws.amazon.com/cloudwatch/home?region="
+                + region
+                + "#alarmsV2:",
+                "fallback": f"{len(messages)} alarm state changes ({summary})",
+                "fields": [
+                    {"title": "New States", "value": summary, "short": False},
+                    {"title": "Project", "value": PROJECT_NAME, "short": True},
+                    {"title": "Environment", "value": ENVIRONMENT_NAME, "short": True},
+                    {
+                        "title": "State Transitions",
+                        "value": "\n".join(lines),
+                        "short": False,
+                    },
+                    {
+                        "title": "All active alarms "
+                        + (ALARM_EMOJIS["ALARM"] if len(active_alarms) else ""),
+                        "value": "\n".join(["- " + alarm for alarm in active_alarms])
+                        if len(active_alarms)
+                        else "None",
+                        "short": False,
+                    },
+                ],
+            }
+        ]
+    }
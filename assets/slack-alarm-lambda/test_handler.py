@@ -0,0 +1,553 @@
+import json
+import os
+from email.message import Message
+from urllib.error import HTTPError, URLError
+
+import pytest
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+
+import index as handler_module
+
+from index import (
+    ActiveAlarmIndex,
+    SendOutcome,
+    DynamoDbStore,
+    FileStore,
+    FlapDetector,
+    MemoryStore,
+    RequestNotSentError,
+    SecretCache,
+    SlackSender,
+    TokenBucket,
+)
+
+
+class FakeClock:
+    """Clock that only moves when something sleeps."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse:
+    def read(self):
+        return b"ok"
+
+
+def http_error(code, retry_after=None):
+    headers = Message()
+    if retry_after is not None:
+        headers["Retry-After"] = str(retry_after)
+    return HTTPError("https://hooks.slack.com/x", code, "error", headers, None)
+
+
+class ScriptedUrlopen:
+    """urlopen replacement that raises or responds according to a script."""
+
+    def __init__(self, *results):
+        self._results = list(results)
+        self.urls = []
+
+    def __call__(self, req):
+        self.urls.append(req.full_url)
+        result = self._results.pop(0) if self._results else None
+        if isinstance(result, Exception):
+            raise result
+        return FakeResponse()
+
+
+def make_sender(urlopen, clock, **kwargs):
+    return SlackSender(
+        urlopen, clock=clock, sleep=clock.sleep, random_func=lambda: 1.0, **kwargs
+    )
+
+
+def test_token_bucket_paces_after_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+
+    bucket.block_for(10)
+    clock.now = 1
+    assert bucket.reserve() == pytest.approx(9)
+
+
+def test_sender_honours_retry_after_on_429():
+    clock = FakeClock()
+    urlopen = ScriptedUrlopen(http_error(429, retry_after=3))
+    sender = make_sender(urlopen, clock, base_backoff_seconds=0.5)
+
+    outcome = sender.send("https://hooks.slack.com/x", {}, deadline=10)
+
+    assert outcome.delivered
+    assert outcome.attempts == 2
+    assert clock.now >= 3
+
+
+def test_sender_gives_up_when_retry_after_exceeds_deadline():
+    clock = FakeClock()
+    urlopen = ScriptedUrlopen(http_error(429, retry_after=30))
+    sender = make_sender(urlopen, clock)
+
+    outcome = sender.send("https://hooks.slack.com/x", {}, deadline=5)
+
+    assert not outcome.delivered
+    assert outcome.status == 429
+    assert outcome.attempts == 1
+    assert clock.now < 5
+
+
+def test_sender_retries_requests_that_were_not_sent_with_backoff():
+    clock = FakeClock()
+    urlopen = ScriptedUrlopen(
+        RequestNotSentError("refused"), RequestNotSentError("refused")
+    )
+    sender = make_sender(urlopen, clock, base_backoff_seconds=0.5, burst=10)
+
+    outcome = sender.send("https://hooks.slack.com/x", {}, deadline=10)
+
+    assert outcome.delivered
+    assert outcome.attempts == 3
+    assert clock.sleeps == [0.5, 1.0]
+
+
+def test_sender_does_not_retry_connection_errors_once_sent():
+    clock = FakeClock()
+    urlopen = ScriptedUrlopen(URLError("timed out"))
+    sender = make_sender(urlopen, clock)
+
+    outcome = sender.send("https://hooks.slack.com/x", {}, deadline=10)
+
+    assert not outcome.delivered
+    assert (outcome.attempts, outcome.reason) == (1, "timed out")
+
+
+def test_sender_does_not_retry_client_errors():
+    clock = FakeClock()
+    urlopen = ScriptedUrlopen(http_error(400))
+    sender = make_sender(urlopen, clock)
+
+    outcome = sender.send("https://hooks.slack.com/x", {}, deadline=10)
+
+    assert not outcome.delivered
+    assert (outcome.status, outcome.attempts) == (400, 1)
+
+
+def test_post_refreshes_rotated_webhook_secret(monkeypatch):
+    class RotatingSecretsClient:
+        def __init__(self):
+            self.secrets = [
+                "https://hooks.slack.com/OLD",
+                "https://hooks.slack.com/NEW",
+            ]
+
+        def get_secret_value(self, SecretId):
+            return {"SecretString": self.secrets.pop(0)}
+
+    clock = FakeClock()
+    urlopen = ScriptedUrlopen(http_error(404))
+    monkeypatch.setattr(
+        handler_module,
+        "secret_cache",
+        SecretCache(RotatingSecretsClient(), clock=clock),
+    )
+    monkeypatch.setattr(handler_module, "slack_sender", make_sender(urlopen, clock))
+
+    outcome = handler_module.post_to_slack_with_secret_refresh(
+        "secret", {}, deadline=10
+    )
+
+    assert outcome.delivered
+    assert urlopen.urls == [
+        "https://hooks.slack.com/OLD",
+        "https://hooks.slack.com/NEW",
+    ]
+
+
+def test_secret_errors_keep_their_cause():
+    class FailingSecretsClient:
+        def get_secret_value(self, SecretId):
+            raise KeyError("AccessDenied")
+
+    with pytest.raises(Exception, match="Error retrieving secret") as excinfo:
+        SecretCache(FailingSecretsClient(), clock=FakeClock()).get("secret")
+    assert isinstance(excinfo.value.__cause__, KeyError)
+
+
+def test_describe_active_alarms_follows_all_pages(monkeypatch):
+    class FakePaginator:
+        def paginate(self, **kwargs):
+            assert kwargs["ActionPrefix"] == "topic"
+            yield {
+                "CompositeAlarms": [{"AlarmName": "c1", "ActionsEnabled": True}],
+                "MetricAlarms": [{"AlarmName": "m1", "ActionsEnabled": True}],
+                "NextToken": "t",
+            }
+            yield {
+                "CompositeAlarms": [],
+                "MetricAlarms": [
+                    {"AlarmName": "m2", "ActionsEnabled": True},
+                    {"AlarmName": "m3", "ActionsEnabled": False},
+                ],
+            }
+
+    class FakeCloudWatch:
+        def get_paginator(self, name):
+            assert name == "describe_alarms"
+            return FakePaginator()
+
+    monkeypatch.setattr(handler_module, "cloudwatch", FakeCloudWatch())
+
+    assert handler_module.describe_active_alarms("topic") == ["c1", "m1", "m2"]
+
+
+@pytest.fixture(params=["memory", "file", "dynamodb"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryStore()
+    if request.param == "file":
+        return FileStore(str(tmp_path / "alarms.json"))
+    return DynamoDbStore(FakeDynamoDb(), "table")
+
+
+class FakeDynamoDb:
+    """Local stand-in for the DynamoDB client calls used by DynamoDbStore."""
+
+    class exceptions:
+        class ConditionalCheckFailedException(Exception):
+            pass
+
+    def __init__(self):
+        self.items = {}
+        # Called after each get_item, e.g. to simulate a concurrent writer
+        self.after_get = lambda: None
+
+    def get_item(self, TableName, Key, ConsistentRead):
+        item = self.items.get((TableName, Key["pk"]["S"]))
+        self.after_get()
+        return {"Item": item} if item else {}
+
+    def put_item(
+        self,
+        TableName,
+        Item,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+    ):
+        assert set(Item) <= {"pk", "document", "version"}
+        current = self.items.get((TableName, Item["pk"]["S"]))
+        if ConditionExpression == "attribute_not_exists(pk)":
+            satisfied = current is None
+        elif ConditionExpression == "attribute_not_exists(#version)":
+            satisfied = current is not None and "version" not in current
+        elif ConditionExpression == "#version = :version":
+            satisfied = (
+                current is not None
+                and current.get("version") == ExpressionAttributeValues[":version"]
+            )
+        else:
+            assert ConditionExpression is None
+            satisfied = True
+        if not satisfied:
+            raise self.exceptions.ConditionalCheckFailedException()
+        self.items[(TableName, Item["pk"]["S"])] = Item
+
+
+def test_store_round_trips_documents(store):
+    assert store.get("topic") is None
+    store.put("topic", {"alarms": ["a"], "reconciledAt": 1.5})
+    store.put("other", {"alarms": [], "reconciledAt": 2})
+    assert store.get("topic") == {"alarms": ["a"], "reconciledAt": 1.5}
+    assert store.get("other") == {"alarms": [], "reconciledAt": 2}
+
+
+def test_dynamodb_store_reapplies_updates_changed_concurrently():
+    dynamodb = FakeDynamoDb()
+    index, other_index = (
+        ActiveAlarmIndex(
+            DynamoDbStore(dynamodb, "table"),
+            lambda topic_arn: [],
+            reconcile_interval_seconds=300,
+        )
+        for _ in range(2)
+    )
+
+    def concurrent_apply(alarm_name):
+        def apply():
+            dynamodb.after_get = lambda: None
+            other_index.apply("topic", alarm_name, "ALARM")
+
+        return apply
+
+    # Another container records a transition between the read and the write
+    dynamodb.after_get = concurrent_apply("a")
+    assert index.apply("topic", "b", "ALARM") == ["a", "b"]
+    dynamodb.after_get = concurrent_apply("c")
+    assert index.apply("topic", "d", "ALARM") == ["a", "b", "c", "d"]
+    assert other_index.apply_all("topic", []) == ["a", "b", "c", "d"]
+
+
+def test_active_alarm_index_applies_transitions_between_reconciliations(store):
+    clock = FakeClock(now=1000)
+    listings = []
+
+    def list_func(topic_arn):
+        listings.append(topic_arn)
+        return ["a", "b"]
+
+    index = ActiveAlarmIndex(
+        store, list_func, reconcile_interval_seconds=300, clock=clock
+    )
+
+    assert index.apply("topic", "c", "ALARM") == ["a", "b", "c"]
+    assert index.apply("topic", "a", "OK") == ["b", "c"]
+    assert index.apply("topic", "b", "INSUFFICIENT_DATA") == ["c"]
+    assert listings == ["topic"]
+
+    # A second container sharing the store sees the same index
+    other = ActiveAlarmIndex(
+        store, list_func, reconcile_interval_seconds=300, clock=clock
+    )
+    assert other.apply("topic", "d", "ALARM") == ["c", "d"]
+    assert listings == ["topic"]
+
+    clock.now = 1300
+    assert index.apply("topic", "e", "OK") == ["a", "b"]
+    assert listings == ["topic", "topic"]
+
+
+def sqs_record(message_id, topic_arn, alarm_name, old_state, new_state, time):
+    message = {
+        "AlarmName": alarm_name,
+        "AlarmDescription": None,
+        "AWSAccountId": "123456789012",
+        "OldStateValue": old_state,
+        "NewStateValue": new_state,
+        "StateChangeTime": time,
+    }
+    body = {
+        "Type": "Notification",
+        "TopicArn": topic_arn,
+        "Message": json.dumps(message),
+    }
+    return {"messageId": message_id, "eventSource": "aws:sqs", "body": json.dumps(body)}
+
+
+class SlackCapture:
+    """Records posted messages; posts mentioning a fail marker fail."""
+
+    def __init__(self):
+        self.messages = []
+        self.fail_markers = []
+
+    def post(self, secret_name, slack_message, *, deadline):
+        self.messages.append(slack_message)
+        text = json.dumps(slack_message)
+        delivered = not any(marker in text for marker in self.fail_markers)
+        return SendOutcome(delivered, 1, 0.0, 200 if delivered else 500, "")
+
+
+@pytest.fixture
+def slack(monkeypatch):
+    capture = SlackCapture()
+    monkeypatch.setattr(
+        handler_module, "post_to_slack_with_secret_refresh", capture.post
+    )
+    monkeypatch.setattr(
+        handler_module,
+        "active_alarm_index",
+        ActiveAlarmIndex(
+            MemoryStore(), lambda topic_arn: [], reconcile_interval_seconds=300
+        ),
+    )
+    return capture
+
+
+def test_digest_posts_one_message_per_topic(slack):
+    topic = "arn:aws:sns:eu-west-1:123456789012:alarms"
+    records = [
+        sqs_record("1", topic, "db", "OK", "ALARM", "2024-01-01T00:00:02"),
+        sqs_record("2", topic, "api", "OK", "ALARM", "2024-01-01T00:00:01"),
+        sqs_record("3", topic, "db", "ALARM", "OK", "2024-01-01T00:00:03"),
+        {"messageId": "4", "eventSource": "aws:sqs", "body": "not json"},
+    ]
+
+    result = handler_module.handler({"Records": records}, None)
+
+    assert result == {"batchItemFailures": []}
+    assert len(slack.messages) == 1
+    fields = {
+        field["title"].strip(): field["value"]
+        for field in slack.messages[0]["attachments"][0]["fields"]
+    }
+    assert fields["New States"] == "ALARM: 2, OK: 1"
+    assert fields["State Transitions"].splitlines()[0].endswith("api: OK -> ALARM")
+    assert fields["All active alarms :rotating_light:"] == "- api"
+
+
+def test_digest_reports_failed_topics_as_batch_item_failures(slack):
+    ok_topic = "arn:aws:sns:eu-west-1:123456789012:ok-topic"
+    failing_topic = "arn:aws:sns:eu-west-1:123456789012:failing-topic"
+    slack.fail_markers.append("failing-alarm")
+    records = [
+        sqs_record("1", ok_topic, "a", "OK", "ALARM", "2024-01-01T00:00:01"),
+        sqs_record("2", ok_topic, "b", "OK", "ALARM", "2024-01-01T00:00:02"),
+        sqs_record("3", failing_topic, "failing-alarm", "OK", "ALARM", "t"),
+    ]
+
+    result = handler_module.handler({"Records": records}, None)
+
+    assert result == {"batchItemFailures": [{"itemIdentifier": "3"}]}
+    assert len(slack.messages) == 2
+
+
+def test_digest_skips_malformed_records(slack):
+    topic = "arn:aws:sns:eu-west-1:123456789012:alarms"
+    valid = sqs_record("1", topic, "db", "OK", "ALARM", "t")
+    without_topic = json.loads(valid["body"])
+    del without_topic["TopicArn"]
+    without_alarm_name = json.loads(valid["body"])
+    without_alarm_name["Message"] = json.dumps({"NewStateValue": "ALARM"})
+    records = [
+        valid,
+        {**valid, "messageId": "2", "body": json.dumps(without_topic)},
+        {**valid, "messageId": "3", "body": json.dumps(without_alarm_name)},
+        sqs_record("4", "not-an-arn", "db", "OK", "ALARM", "t"),
+        {**valid, "messageId": "5", "body": json.dumps({"TopicArn": topic})},
+        {**valid, "messageId": "6", "body": "[]"},
+    ]
+
+    result = handler_module.handler({"Records": records}, None)
+
+    assert result == {"batchItemFailures": []}
+    assert len(slack.messages) == 1
+
+
+def test_digest_retries_count_each_transition_once(slack, monkeypatch):
+    monkeypatch.setattr(
+        handler_module,
+        "flap_detector",
+        FlapDetector(MemoryStore(), threshold=2, window_seconds=600),
+    )
+    topic = "arn:aws:sns:eu-west-1:123456789012:alarms"
+    records = [
+        sqs_record("1", topic, "db", "OK", "ALARM", "2024-01-01T00:00:01"),
+        sqs_record("2", topic, "db", "ALARM", "OK", "2024-01-01T00:00:02"),
+    ]
+    slack.fail_markers.append("db")
+    assert handler_module.handler({"Records": records}, None) == {
+        "batchItemFailures": [{"itemIdentifier": "1"}, {"itemIdentifier": "2"}]
+    }
+
+    slack.fail_markers.clear()
+    assert handler_module.handler({"Records": records}, None) == {
+        "batchItemFailures": []
+    }
+    assert slack.messages[0] == slack.messages[1]
+    assert "flapping" not in json.dumps(slack.messages[1])
+
+
+def test_digest_of_one_transition_shows_flapping(slack, monkeypatch):
+    detector = FlapDetector(MemoryStore(), threshold=1, window_seconds=600)
+    detector.check("db")
+    monkeypatch.setattr(handler_module, "flap_detector", detector)
+    topic = "arn:aws:sns:eu-west-1:123456789012:alarms"
+    records = [
+        sqs_record("1", topic, "db", "OK", "ALARM", "2024-01-01T00:00:01"),
+        sqs_record("2", topic, "db", "ALARM", "OK", "2024-01-01T00:00:02"),
+    ]
+
+    handler_module.handler({"Records": records}, None)
+
+    [message] = slack.messages
+    fields = {
+        field["title"].strip(): field["value"]
+        for field in message["attachments"][0]["fields"]
+    }
+    assert fields["Flapping :repeat:"].startswith("2 state changes")
+    # The suppressed transition still updates the active alarms
+    assert fields["All active alarms"] == "None"
+
+
+def test_flap_detector_collapses_flapping_alarm():
+    clock = FakeClock(now=0)
+    detector = FlapDetector(MemoryStore(), threshold=3, window_seconds=600, clock=clock)
+    decisions = []
+    for now in (0, 10, 20, 30, 40, 50):
+        clock.now = now
+        decisions.append(detector.check("db"))
+
+    assert decisions == [
+        (FlapDetector.NOTIFY, 1),
+        (FlapDetector.NOTIFY, 2),
+        (FlapDetector.NOTIFY, 3),
+        (FlapDetector.FLAPPING, 4),
+        (FlapDetector.SUPPRESSED, 5),
+        (FlapDetector.SUPPRESSED, 6),
+    ]
+    assert detector.check("other") == (FlapDetector.NOTIFY, 1)
+
+    for now in (300, 400, 500):
+        clock.now = now
+        assert detector.check("db")[0] == FlapDetector.SUPPRESSED
+
+    # Still flapping a window after it was reported: reported again
+    clock.now = 630
+    assert detector.check("db") == (FlapDetector.FLAPPING, 6)
+
+    clock.now = 1300
+    assert detector.check("db") == (FlapDetector.NOTIFY, 1)
+
+
+def test_flap_detector_disabled_without_threshold():
+    detector = FlapDetector(MemoryStore(), threshold=0, window_seconds=600)
+    assert {detector.check("db") for _ in range(10)} == {(FlapDetector.NOTIFY, 1)}
+
+
+def test_suppressed_notification_updates_index_without_slack_calls(monkeypatch):
+    class Unreachable:
+        def __getattr__(self, name):
+            raise AssertionError(f"unexpected call to {name}")
+
+    detector = FlapDetector(MemoryStore(), threshold=1, window_seconds=600)
+    detector.check("db")
+    detector.check("db")
+    monkeypatch.setattr(handler_module, "flap_detector", detector)
+    index = ActiveAlarmIndex(
+        MemoryStore(), lambda topic_arn: [], reconcile_interval_seconds=300
+    )
+    monkeypatch.setattr(handler_module, "active_alarm_index", index)
+    monkeypatch.setattr(handler_module, "cloudwatch", Unreachable())
+    monkeypatch.setattr(handler_module, "secret_cache", Unreachable())
+    monkeypatch.setattr(handler_module, "slack_sender", Unreachable())
+    message = {"AlarmName": "db", "NewStateValue": "ALARM", "OldStateValue": "OK"}
+    event = {
+        "Records": [
+            {
+                "Sns": {
+                    "Message": json.dumps(message),
+                    "TopicArn": "arn:aws:sns:eu-west-1:123456789012:alarms",
+                }
+            }
+        ]
+    }
+
+    assert handler_module.handler(event, None) == {
+        "delivered": False,
+        "suppressed": True,
+    }
+    # The suppressed transition still updates the active alarms
+    assert index.apply_all("arn:aws:sns:eu-west-1:123456789012:alarms", []) == ["db"]
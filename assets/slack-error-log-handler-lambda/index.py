@@ -11,10 +11,16 @@ import json
 import os
 from pprint import pprint
 from typing import TypedDict, Optional
-from urllib.request import Request, urlopen
+from urllib.parse import urlsplit
+from urllib.request import Request
 import base64
+import bisect
 import gzip
+import http.client
+import io
+import select
 from urllib.error import URLError, HTTPError
+import threading
 import time
 import boto3
 
@@ -48,11 +54,258 @@ def _get_secrets_client(secrets_client=None):
 
 
 SLACK_URL_SECRET_NAME = os.getenv("SLACK_URL_SECRET_NAME", None)
+SLACK_URL_SECRET_TTL_SECONDS = float(os.getenv("SLACK_URL_SECRET_TTL_SECONDS", "300"))
+SLACK_URL_SECRET_VERSION_STAGE = os.getenv(
+    "SLACK_URL_SECRET_VERSION_STAGE", "AWSCURRENT"
+)
 PROJECT_NAME = os.getenv("PROJECT_NAME", "undefined")
 ENVIRONMENT_NAME = os.getenv("ENVIRONMENT_NAME", "undefined")
 REGION = os.getenv("AWS_REGION", "eu-west-1")
 
 
+# BEGIN shared secret-cache (assets/shared/slack.py)
+class SecretCache:
+    """Cache secret strings from Secrets Manager across warm invocations.
+
+    Entries are keyed by secret ID and version stage and expire after
+    `ttl_seconds`. A TTL of 0 disables caching.
+    """
+
+    def __init__(
+        self,
+        client,
+        *,
+        ttl_seconds: float = 300,
+        version_stage: str = "AWSCURRENT",
+        clock=time.monotonic,
+    ):
+        self._client = client
+        self._ttl_seconds = ttl_seconds
+        self._version_stage = version_stage
+        self._clock = clock
+        # (secret_id, version_stage) -> (secret_string, expires_at)
+        self._entries: dict[tuple[str, str], tuple[str, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, secret_id: str, *, force_refresh: bool = False) -> str:
+        """Return the secret string, fetching it if missing, expired or forced."""
+        key = (secret_id, self._version_stage)
+        entry = self._entries.get(key)
+        if entry is not None and not force_refresh and self._clock() < entry[1]:
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        try:
+            # Secrets Manager defaults to AWSCURRENT when no stage is given
+            if self._version_stage == "AWSCURRENT":
+                response = self._client.get_secret_value(SecretId=secret_id)
+            else:
+                response = self._client.get_secret_value(
+                    SecretId=secret_id, VersionStage=self._version_stage
+                )
+        except Exception as e:
+            raise RuntimeError(f"Error retrieving secret '{secret_id}': {e}") from e
+        secret_string = response["SecretString"]
+        self._entries[key] = (secret_string, self._clock() + self._ttl_seconds)
+        return secret_string
+
+
+# END shared secret-cache
+# Module-level cached SecretCache, lazily created by _get_secret_cache.
+_secret_cache = None
+
+
+def _get_secret_cache(secret_cache=None, secrets_client=None):
+    """Return the SecretCache to read the Slack webhook URL through.
+
+    Behavior mirrors `_get_secrets_client`:
+    - An injected `secret_cache` is returned as-is.
+    - An injected `secrets_client` gets a non-caching SecretCache, so injected
+      clients never leak into the module-level cache.
+    - Otherwise a module-level cache is lazily created and reused across
+      invocations within the same Lambda execution environment.
+    """
+    if secret_cache is not None:
+        return secret_cache
+    if secrets_client is not None:
+        return SecretCache(
+            secrets_client,
+            ttl_seconds=0,
+            version_stage=SLACK_URL_SECRET_VERSION_STAGE,
+        )
+
+    global _secret_cache
+    if _secret_cache is None:
+        _secret_cache = SecretCache(
+            _get_secrets_client(),
+            ttl_seconds=SLACK_URL_SECRET_TTL_SECONDS,
+            version_stage=SLACK_URL_SECRET_VERSION_STAGE,
+        )
+
+    return _secret_cache
+
+
+class SlackWebhookRejectedError(RuntimeError):
+    """Slack rejected the webhook URL (403/404), e.g. because it was rotated."""
+
+
+# BEGIN shared transport (assets/shared/slack.py)
+SLACK_CONNECT_TIMEOUT_SECONDS = float(os.getenv("SLACK_CONNECT_TIMEOUT_SECONDS", "2"))
+SLACK_READ_TIMEOUT_SECONDS = float(os.getenv("SLACK_READ_TIMEOUT_SECONDS", "4"))
+
+
+class LatencyHistogram:
+    """Counts of request latencies in fixed millisecond buckets."""
+
+    BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, seconds * 1000)] += 1
+
+    def __str__(self):
+        labels = [f"<={bucket}ms" for bucket in self.BUCKETS_MS]
+        labels.append(f">{self.BUCKETS_MS[-1]}ms")
+        return " ".join(f"{label}:{n}" for label, n in zip(labels, self.counts))
+
+
+class TransportResponse:
+    def __init__(self, status: int, headers, body: bytes):
+        self.status = status
+        self.headers = headers
+        self._body = body
+
+    def read(self) -> bytes:
+        return self._body
+
+
+class RequestNotSentError(URLError):
+    """A request failed before it was sent, so retrying it cannot post the
+    message twice."""
+
+
+class KeepAliveTransport:
+    """Send HTTP(S) requests over persistent connections that are reused
+    across warm Lambda invocations.
+
+    `urlopen` is a drop-in replacement for `urllib.request.urlopen`: it
+    raises HTTPError for 4xx/5xx responses and URLError for connection
+    failures and timeouts. Idle connections are pooled per origin, and one
+    that the server has closed while idle is discarded before it is reused.
+    Requests are not retried, since a request that fails once sent (e.g. a
+    read timeout) may already have been processed. Failures before the
+    request was sent raise RequestNotSentError, which is safe to retry.
+    """
+
+    def __init__(
+        self,
+        *,
+        connect_timeout: float = SLACK_CONNECT_TIMEOUT_SECONDS,
+        read_timeout: float = SLACK_READ_TIMEOUT_SECONDS,
+        max_idle_per_origin: int = 4,
+        ssl_context=None,
+    ):
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._max_idle_per_origin = max_idle_per_origin
+        self._ssl_context = ssl_context
+        self._lock = threading.Lock()
+        self._idle: dict[tuple[str, str, int], list[http.client.HTTPConnection]] = {}
+        self.latency_histogram = LatencyHistogram()
+        self.connections_opened = 0
+
+    def _connect(self, origin: tuple[str, str, int]) -> http.client.HTTPConnection:
+        scheme, host, port = origin
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                host, port, timeout=self._connect_timeout, context=self._ssl_context
+            )
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self._connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self._read_timeout)
+        with self._lock:
+            self.connections_opened += 1
+        return conn
+
+    def _acquire(self, origin) -> http.client.HTTPConnection:
+        while True:
+            with self._lock:
+                idle = self._idle.get(origin)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                return self._connect(origin)
+            # An idle connection is only readable once the server has closed it
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+            if not readable:
+                return conn
+            conn.close()
+
+    def _release(self, origin, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self._max_idle_per_origin:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def urlopen(self, req: Request) -> TransportResponse:
+        url = urlsplit(req.full_url)
+        origin = (
+            url.scheme,
+            url.hostname,
+            url.port or (443 if url.scheme == "https" else 80),
+        )
+        path = (url.path or "/") + (f"?{url.query}" if url.query else "")
+        headers = dict(req.header_items())
+        if not req.has_header("Content-type"):
+            headers["Content-Type"] = "application/json"
+
+        start = time.monotonic()
+        try:
+            conn = self._acquire(origin)
+        except (OSError, http.client.HTTPException) as e:
+            raise RequestNotSentError(e) from e
+        try:
+            # A request that could not be written in full cannot be processed
+            conn.request(req.get_method(), path, body=req.data, headers=headers)
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise RequestNotSentError(e) from e
+        try:
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise URLError(e) from e
+        self.latency_histogram.observe(time.monotonic() - start)
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(origin, conn)
+
+        if response.status >= 400:
+            raise HTTPError(
+                req.full_url,
+                response.status,
+                response.reason,
+                response.headers,
+                io.BytesIO(body),
+            )
+        return TransportResponse(response.status, response.headers, body)
+
+
+# END shared transport
+# Module-level transport so connections are kept alive across invocations
+# within the same Lambda execution environment.
+_transport = KeepAliveTransport()
+
+
 class CloudWatchLog(TypedDict, total=False):
     """Single parsed log entry (message, stack_trace, service)."""
 
@@ -79,6 +332,7 @@ def process_event(
     _context,
     *,
     secrets_client=None,
+    secret_cache=None,
     urlopen_func=None,
     time_func=time.time,
     slack_secret_name=SLACK_URL_SECRET_NAME,
@@ -148,6 +402,7 @@ def process_event(
     send_slack_notification(
         slack_message,
         secrets_client=secrets_client,
+        secret_cache=secret_cache,
         urlopen_func=urlopen_func,
         slack_secret_name=slack_secret_name,
     )
@@ -166,20 +421,36 @@ def send_slack_notification(
     slack_message: dict,
     *,
     secrets_client=None,
+    secret_cache=None,
     urlopen_func=None,
     slack_secret_name=None,
 ):
-    """Post the Slack payload using a webhook from Secrets Manager."""
-    client = _get_secrets_client(secrets_client)
+    """Post the Slack payload using a webhook from Secrets Manager.
+
+    The webhook URL is read through a warm-container cache. If Slack rejects
+    the cached URL with 403/404 the secret is refreshed, and the post is
+    retried once if the webhook has changed.
+    """
+    cache = _get_secret_cache(secret_cache, secrets_client)
     if urlopen_func is None:
-        urlopen_func = urlopen
+        urlopen_func = _transport.urlopen
     if slack_secret_name is None:
         slack_secret_name = SLACK_URL_SECRET_NAME
 
-    slack_url = get_secret(slack_secret_name, secrets_client=client)
+    slack_url = cache.get(slack_secret_name)
 
     # Use helper to post so error mapping is consistent
-    _post_to_slack(slack_url, slack_message, urlopen_func=urlopen_func)
+    try:
+        _post_to_slack(slack_url, slack_message, urlopen_func=urlopen_func)
+    except SlackWebhookRejectedError:
+        refreshed_slack_url = cache.get(slack_secret_name, force_refresh=True)
+        if refreshed_slack_url == slack_url:
+            raise
+        print("Slack rejected the webhook URL, retrying with refreshed secret")
+        _post_to_slack(refreshed_slack_url, slack_message, urlopen_func=urlopen_func)
+    finally:
+        print(f"Secret cache hits={cache.hits} misses={cache.misses}")
+        print(f"Slack latency histogram: {_transport.latency_histogram}")
 
 
 def _post_to_slack(url: str, payload: dict, *, urlopen_func):
@@ -191,7 +462,8 @@ def _post_to_slack(url: str, payload: dict, *, urlopen_func):
     try:
         urlopen_func(req).read()
     except HTTPError as e:
-        raise RuntimeError(f"Request to slack failed: {e.code} {e.reason}") from e
+        error_type = SlackWebhookRejectedError if e.code in (403, 404) else RuntimeError
+        raise error_type(f"Request to slack failed: {e.code} {e.reason}") from e
     except URLError as e:
         raise RuntimeError(f"Server connection to slack failed: {e.reason}") from e
 
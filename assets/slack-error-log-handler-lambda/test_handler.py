@@ -2,6 +2,15 @@ import json
 import gzip
 import base64
 import os
+import shutil
+import socket
+import ssl
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.request import Request
 import pytest
 
 os.environ.setdefault("AWS_REGION", "eu-west-1")
@@ -9,6 +18,9 @@ os.environ.setdefault("AWS_REGION", "eu-west-1")
 import index as handler_module
 
 from index import (
+    KeepAliveTransport,
+    RequestNotSentError,
+    SecretCache,
     create_slack_message_from_cloudwatch_log,
     process_event,
     get_secret,
@@ -227,3 +239,268 @@ def test_process_event_with_broken_secrets_client_raises():
 def test_get_masked_slack_webhook_url(url, tail):
     masked = get_masked_slack_webhook_url(url)
     assert masked.endswith("*" * len(tail))
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class RotatingSecretsClient:
+    """Secrets client returning the next value in `secrets` on every call."""
+
+    def __init__(self, *secrets):
+        self._secrets = list(secrets)
+        self.calls = []
+
+    def get_secret_value(self, SecretId, **kwargs):
+        self.calls.append({"SecretId": SecretId, **kwargs})
+        return {
+            "SecretString": self._secrets[min(len(self.calls), len(self._secrets)) - 1]
+        }
+
+
+def test_secret_cache_expires_after_ttl():
+    clock = FakeClock()
+    client = RotatingSecretsClient("first", "second")
+    cache = SecretCache(client, ttl_seconds=60, clock=clock)
+
+    assert cache.get("id") == "first"
+    clock.now = 59
+    assert cache.get("id") == "first"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    clock.now = 60
+    assert cache.get("id") == "second"
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_secret_cache_is_keyed_by_version_stage():
+    client = RotatingSecretsClient("pending")
+    cache = SecretCache(client, version_stage="AWSPENDING", clock=FakeClock())
+
+    assert cache.get("id") == "pending"
+    assert client.calls == [{"SecretId": "id", "VersionStage": "AWSPENDING"}]
+
+
+def test_send_slack_notification_refreshes_rotated_webhook(dummy_resp):
+    client = RotatingSecretsClient(
+        "https://hooks.slack.com/services/T/B/OLD",
+        "https://hooks.slack.com/services/T/B/NEW",
+    )
+    cache = SecretCache(client, ttl_seconds=300, clock=FakeClock())
+    posted_urls = []
+
+    def dummy_urlopen(req):
+        posted_urls.append(req.full_url)
+        if req.full_url.endswith("OLD"):
+            raise HTTPError(req.full_url, 404, "no_service", {}, None)
+        return dummy_resp
+
+    send_slack_notification(
+        {"foo": "bar"},
+        secret_cache=cache,
+        urlopen_func=dummy_urlopen,
+        slack_secret_name="unused",
+    )
+    assert [url.rsplit("/", 1)[1] for url in posted_urls] == ["OLD", "NEW"]
+
+    # The refreshed webhook is cached for the following invocations
+    send_slack_notification(
+        {"foo": "bar"},
+        secret_cache=cache,
+        urlopen_func=dummy_urlopen,
+        slack_secret_name="unused",
+    )
+    assert posted_urls[-1].endswith("NEW")
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_send_slack_notification_does_not_retry_unchanged_webhook():
+    client = RotatingSecretsClient("https://hooks.slack.com/services/T/B/S")
+    cache = SecretCache(client, clock=FakeClock())
+    called = {"c": 0}
+
+    def dummy_urlopen(req):
+        called["c"] += 1
+        raise HTTPError(req.full_url, 403, "invalid_token", {}, None)
+
+    with pytest.raises(RuntimeError, match="403"):
+        send_slack_notification(
+            {"foo": "bar"},
+            secret_cache=cache,
+            urlopen_func=dummy_urlopen,
+            slack_secret_name="unused",
+        )
+    assert called["c"] == 1
+    assert cache.misses == 2
+
+
+@pytest.fixture(scope="module")
+def tls_certificate(tmp_path_factory):
+    """Self-signed certificate for 127.0.0.1, as (certfile, keyfile)."""
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl is needed to create a test certificate")
+    directory = tmp_path_factory.mktemp("tls")
+    certfile, keyfile = directory / "cert.pem", directory / "key.pem"
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=127.0.0.1",
+            "-addext",
+            "subjectAltName=IP:127.0.0.1",
+            "-keyout",
+            str(keyfile),
+            "-out",
+            str(certfile),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return str(certfile), str(keyfile)
+
+
+@pytest.fixture(params=["http", "https"])
+def stub_slack_server(request):
+    """Local HTTP/1.1 server standing in for the Slack webhook API, served
+    over plain HTTP and over TLS. `server.url` is its base URL and
+    `server.client_ssl_context` trusts its certificate."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        status = 200
+        delay_seconds = 0.0
+        # Close the connection after responding, without telling the client
+        close_after_response = False
+        # Close the connection after reading the request, without responding
+        drop_before_response = False
+        connections = set()
+        bodies = []
+
+        def do_POST(self):
+            Handler.connections.add(self.client_address)
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            Handler.bodies.append(json.loads(body))
+            if Handler.drop_before_response:
+                self.close_connection = True
+                return
+            time.sleep(Handler.delay_seconds)
+            try:
+                self.send_response(Handler.status)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+            except BrokenPipeError:
+                # The client gave up waiting (read timeout)
+                pass
+            if Handler.close_after_response:
+                self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.client_ssl_context = None
+    if request.param == "https":
+        certfile, keyfile = request.getfixturevalue("tls_certificate")
+        server_ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_ssl_context.load_cert_chain(certfile, keyfile)
+        server.socket = server_ssl_context.wrap_socket(server.socket, server_side=True)
+        server.client_ssl_context = ssl.create_default_context(cafile=certfile)
+    server.url = f"{request.param}://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, Handler
+    server.shutdown()
+    server.server_close()
+
+
+def make_transport(server, **kwargs):
+    return KeepAliveTransport(
+        connect_timeout=1, ssl_context=server.client_ssl_context, **kwargs
+    )
+
+
+def test_transport_reuses_connection_across_posts(stub_slack_server):
+    server, stub = stub_slack_server
+    url = f"{server.url}/services/T/B/S"
+    transport = make_transport(server, read_timeout=1)
+
+    for i in range(3):
+        req = Request(url, data=json.dumps({"n": i}).encode("utf-8"))
+        assert transport.urlopen(req).read() == b"ok"
+
+    assert stub.bodies == [{"n": 0}, {"n": 1}, {"n": 2}]
+    assert len(stub.connections) == 1
+    assert transport.connections_opened == 1
+    assert sum(transport.latency_histogram.counts) == 3
+
+
+def test_transport_replaces_connection_closed_while_idle(stub_slack_server):
+    server, stub = stub_slack_server
+    stub.close_after_response = True
+    transport = make_transport(server, read_timeout=1)
+
+    for i in range(2):
+        req = Request(f"{server.url}/x", data=json.dumps({"n": i}).encode("utf-8"))
+        assert transport.urlopen(req).read() == b"ok"
+        # Give the server time to close the connection
+        time.sleep(0.1)
+
+    assert stub.bodies == [{"n": 0}, {"n": 1}]
+    assert transport.connections_opened == 2
+
+
+def test_transport_does_not_resend_request_after_connection_lost(stub_slack_server):
+    server, stub = stub_slack_server
+    stub.drop_before_response = True
+    transport = make_transport(server, read_timeout=1)
+    req = Request(f"{server.url}/x", data=b"{}")
+
+    with pytest.raises(URLError) as exc:
+        transport.urlopen(req)
+    assert not isinstance(exc.value, RequestNotSentError)
+    assert stub.bodies == [{}]
+
+
+def test_transport_maps_error_status_to_http_error(stub_slack_server):
+    server, stub = stub_slack_server
+    stub.status = 404
+    transport = make_transport(server, read_timeout=1)
+    req = Request(f"{server.url}/x", data=b"{}")
+
+    with pytest.raises(HTTPError) as exc:
+        transport.urlopen(req)
+    assert exc.value.code == 404
+
+
+def test_transport_read_timeout_raises_url_error(stub_slack_server):
+    server, stub = stub_slack_server
+    stub.delay_seconds = 0.5
+    transport = make_transport(server, read_timeout=0.1)
+    req = Request(f"{server.url}/x", data=b"{}")
+
+    with pytest.raises(URLError) as exc:
+        transport.urlopen(req)
+    assert not isinstance(exc.value, RequestNotSentError)
+
+
+def test_transport_connection_refused_is_not_sent():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    transport = KeepAliveTransport(connect_timeout=1, read_timeout=1)
+
+    with pytest.raises(RequestNotSentError):
+        transport.urlopen(Request(f"http://127.0.0.1:{port}/x", data=b"{}"))
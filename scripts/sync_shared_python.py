@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Copy the shared Python code of the Lambda assets into each asset.
+
+Each Lambda function is packaged from its own directory under assets/, so
+code shared by several of them cannot be imported and is copied instead.
+The canonical code is kept in assets/shared/, in regions such as
+
+    # BEGIN shared transport (assets/shared/slack.py)
+    ...
+    # END shared transport
+
+and the same markers in an asset are replaced with the canonical region.
+
+Usage:
+    scripts/sync_shared_python.py          # update the copies
+    scripts/sync_shared_python.py --check  # fail if a copy differs
+"""
+
+import difflib
+import re
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SHARED_DIR = ROOT / "assets" / "shared"
+
+BEGIN = re.compile(r"^# BEGIN shared (\S+) \((\S+)\)$")
+END = "# END shared {name}"
+
+
+def find_regions(lines: list[str], path: Path) -> dict[str, tuple[str, int, int]]:
+    """Return the regions of the file by name, as the canonical file they are
+    copied from and the indexes of their begin and end markers"""
+    regions = {}
+    for begin, line in enumerate(lines):
+        match = BEGIN.match(line)
+        if match is None:
+            continue
+        name, source = match.groups()
+        try:
+            end = lines.index(END.format(name=name), begin + 1)
+        except ValueError:
+            sys.exit(f"{path}:{begin + 1}: shared region {name} is not ended")
+        if name in regions:
+            sys.exit(f"{path}:{begin + 1}: shared region {name} is repeated")
+        regions[name] = (source, begin, end)
+    return regions
+
+
+def read_canonical_regions() -> dict[tuple[str, str], list[str]]:
+    canonical = {}
+    for path in sorted(SHARED_DIR.glob("*.py")):
+        lines = path.read_text().splitlines()
+        for name, (_, begin, end) in find_regions(lines, path).items():
+            canonical[(path.relative_to(ROOT).as_posix(), name)] = lines[
+                begin + 1 : end
+            ]
+    return canonical
+
+
+def main(check: bool) -> int:
+    canonical = read_canonical_regions()
+    outdated = []
+    for path in sorted((ROOT / "assets").glob("*/*.py")):
+        if path.parent == SHARED_DIR:
+            continue
+        lines = path.read_text().splitlines()
+        regions = find_regions(lines, path)
+        if not regions:
+            continue
+        updated = list(lines)
+        # Replace from the bottom so the indexes of earlier regions still hold
+        for name, (source, begin, end) in sorted(
+            regions.items(), key=lambda item: item[1][1], reverse=True
+        ):
+            if (source, name) not in canonical:
+                sys.exit(f"{path}:{begin + 1}: no shared region {name} in {source}")
+            updated[begin + 1 : end] = canonical[(source, name)]
+        if updated == lines:
+            continue
+        outdated.append(path)
+        if check:
+            sys.stdout.writelines(
+                difflib.unified_diff(
+                    [f"{line}\n" for line in lines],
+                    [f"{line}\n" for line in updated],
+                    str(path.relative_to(ROOT)),
+                    f"{path.relative_to(ROOT)} (synced)",
+                )
+            )
+        else:
+            path.write_text("\n".join(updated) + "\n")
+            print(f"Updated {path.relative_to(ROOT)}")
+
+    if check and outdated:
+        print(
+            "The shared code in the files above differs from assets/shared/. "
+            "Edit assets/shared/ and run `make py-shared-sync`.",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(check="--check" in sys.argv[1:]))
@@ -1,6 +1,7 @@
 import "@aws-cdk/assert/jest"
-import { App, Stack } from "aws-cdk-lib"
+import { App, Duration, Stack } from "aws-cdk-lib"
 import "jest-cdk-snapshot"
+import * as dynamodb from "aws-cdk-lib/aws-dynamodb"
 import * as secretsmanager from "aws-cdk-lib/aws-secretsmanager"
 import { SlackAlarm } from "../slack-alarm"
 
@@ -20,3 +21,66 @@ test("create slack alarm", () => {
 
   expect(stack).toMatchCdkSnapshot({ ignoreAssets: true })
 })
+
+test("create slack alarm with persisted state and flap detection", () => {
+  const app = new App()
+  const stack = new Stack(app, "Stack")
+
+  const secret = new secretsmanager.Secret(stack, "TestSecret", {
+    secretName: "TestSecret",
+  })
+  const table = new dynamodb.Table(stack, "StateTable", {
+    partitionKey: { name: "pk", type: dynamodb.AttributeType.STRING },
+  })
+
+  new SlackAlarm(stack, "SlackAlarm", {
+    envName: "dev",
+    projectName: "my-project",
+    slackWebhookUrlSecret: secret,
+    stateTable: table,
+    flapDetection: { threshold: 5 },
+  })
+
+  expect(stack).toHaveResourceLike("AWS::Lambda::Function", {
+    Environment: {
+      Variables: {
+        STATE_STORE: stack.resolve(`dynamodb:${table.tableName}`),
+        FLAP_THRESHOLD: "5",
+        FLAP_WINDOW_SECONDS: "900",
+      },
+    },
+  })
+})
+
+test("create slack alarm with digest window", () => {
+  const app = new App()
+  const stack = new Stack(app, "Stack")
+
+  const secret = new secretsmanager.Secret(stack, "TestSecret", {
+    secretName: "TestSecret",
+  })
+
+  new SlackAlarm(stack, "SlackAlarm", {
+    envName: "dev",
+    projectName: "my-project",
+    slackWebhookUrlSecret: secret,
+    digestWindow: Duration.minutes(1),
+  })
+
+  expect(stack).toHaveResourceLike("AWS::SNS::Subscription", {
+    Protocol: "sqs",
+  })
+  expect(stack).toHaveResourceLike("AWS::Lambda::EventSourceMapping", {
+    BatchSize: 100,
+    MaximumBatchingWindowInSeconds: 60,
+    FunctionResponseTypes: ["ReportBatchItemFailures"],
+  })
+  expect(stack).toHaveResourceLike("AWS::SQS::Queue", {
+    VisibilityTimeout: 36,
+    RedrivePolicy: {
+      maxReceiveCount: 5,
+    },
+  })
+  expect(stack).toCountResources("AWS::SQS::Queue", 2)
+  expect(stack).not.toHaveResource("AWS::Lambda::Permission")
+})
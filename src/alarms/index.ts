@@ -6,5 +6,5 @@ export type { QueueAlarmsProps } from "./queue-alarms"
 export { QueueAlarms } from "./queue-alarms"
 export type { ServiceAlarmsProps } from "./service-alarms"
 export { ServiceAlarms } from "./service-alarms"
-export type { SlackAlarmProps } from "./slack-alarm"
+export type { SlackAlarmFlapDetection, SlackAlarmProps } from "./slack-alarm"
 export { SlackAlarm } from "./slack-alarm"
@@ -2,11 +2,15 @@ import * as path from "node:path"
 import { fileURLToPath } from "node:url"
 import { Duration } from "aws-cdk-lib"
 import * as cloudwatchActions from "aws-cdk-lib/aws-cloudwatch-actions"
+import type * as dynamodb from "aws-cdk-lib/aws-dynamodb"
 import * as iam from "aws-cdk-lib/aws-iam"
 import { Effect, PolicyStatement } from "aws-cdk-lib/aws-iam"
 import * as lambda from "aws-cdk-lib/aws-lambda"
+import * as sources from "aws-cdk-lib/aws-lambda-event-sources"
 import type * as secretsmanager from "aws-cdk-lib/aws-secretsmanager"
 import * as sns from "aws-cdk-lib/aws-sns"
+import * as snsSubscriptions from "aws-cdk-lib/aws-sns-subscriptions"
+import * as sqs from "aws-cdk-lib/aws-sqs"
 import * as constructs from "constructs"
 
 const __file = fileURLToPath(import.meta.url)
@@ -23,6 +27,48 @@ export interface SlackAlarmProps {
    * NOTE: Incoming webhooks created through legacy custom integrations in Slack are not supported.
    */
   slackWebhookUrlSecret: secretsmanager.ISecret
+  /**
+   * A DynamoDB table used to persist state shared between invocations of the
+   * Lambda: the index of active alarms shown in each Slack message, and the
+   * recent transitions of each alarm when `flapDetection` is enabled.
+   *
+   * The table must have a partition key named `pk` of type string.
+   *
+   * @default - the state is kept in the memory of the Lambda function.
+   */
+  stateTable?: dynamodb.ITable
+  /**
+   * If set, alarm notifications are buffered in an SQS queue and posted to
+   * Slack as one digest per window, with counts per state, instead of one
+   * message per alarm transition. Useful to limit noise when many alarms
+   * trigger at once, e.g. when a shared dependency fails.
+   *
+   * Must be at most 5 minutes.
+   *
+   * @default - one Slack message is posted per alarm transition.
+   */
+  digestWindow?: Duration
+  /**
+   * Collapse notifications for alarms that change state often within a
+   * short period into a single "flapping" message.
+   *
+   * @default - every transition is notified.
+   */
+  flapDetection?: SlackAlarmFlapDetection
+}
+
+export interface SlackAlarmFlapDetection {
+  /**
+   * An alarm with more than this number of state transitions within
+   * `window` is considered flapping. The transition that exceeds the
+   * threshold is posted as a flapping message, and the following
+   * transitions are dropped until `window` has passed.
+   */
+  threshold: number
+  /**
+   * @default Duration.minutes(15)
+   */
+  window?: Duration
 }
 
 /**
@@ -81,11 +127,26 @@ export class SlackAlarm extends constructs.Construct {
     props.slackWebhookUrlSecret.grantRead(this.logHandler)
     props.slackWebhookUrlSecret.grantRead(slackLambda)
 
-    slackLambda.addPermission("InvokePermission", {
-      action: "lambda:InvokeFunction",
-      principal: new iam.ServicePrincipal("sns.amazonaws.com"),
-      sourceArn: this.alarmTopic.topicArn,
-    })
+    if (props.stateTable) {
+      slackLambda.addEnvironment(
+        "STATE_STORE",
+        `dynamodb:${props.stateTable.tableName}`,
+      )
+      props.stateTable.grantReadWriteData(slackLambda)
+    }
+
+    if (props.flapDetection) {
+      const flapWindow = props.flapDetection.window ?? Duration.minutes(15)
+      slackLambda.addEnvironment(
+        "FLAP_THRESHOLD",
+        String(props.flapDetection.threshold),
+      )
+      slackLambda.addEnvironment(
+        "FLAP_WINDOW_SECONDS",
+        String(flapWindow.toSeconds()),
+      )
+    }
+
     slackLambda.addToRolePolicy(
       new PolicyStatement({
         actions: ["cloudwatch:DescribeAlarms"],
@@ -94,10 +155,50 @@ export class SlackAlarm extends constructs.Construct {
       }),
     )
 
-    new sns.Subscription(this, "Subscription", {
-      endpoint: slackLambda.functionArn,
-      protocol: sns.SubscriptionProtocol.LAMBDA,
-      topic: this.alarmTopic,
-    })
+    if (props.digestWindow) {
+      // Digests that keep failing are kept for inspection instead of being
+      // retried until they expire
+      const digestDeadLetterQueue = new sqs.Queue(
+        this,
+        "DigestDeadLetterQueue",
+        {
+          retentionPeriod: Duration.days(14),
+          enforceSSL: true,
+        },
+      )
+      const digestQueue = new sqs.Queue(this, "DigestQueue", {
+        // AWS recommends at least 6 times the timeout of the consuming function
+        visibilityTimeout: Duration.seconds(
+          6 * (slackLambda.timeout ?? Duration.seconds(3)).toSeconds(),
+        ),
+        enforceSSL: true,
+        deadLetterQueue: {
+          queue: digestDeadLetterQueue,
+          maxReceiveCount: 5,
+        },
+      })
+      this.alarmTopic.addSubscription(
+        new snsSubscriptions.SqsSubscription(digestQueue),
+      )
+      slackLambda.addEventSource(
+        new sources.SqsEventSource(digestQueue, {
+          batchSize: 100,
+          maxBatchingWindow: props.digestWindow,
+          reportBatchItemFailures: true,
+        }),
+      )
+    } else {
+      slackLambda.addPermission("InvokePermission", {
+        action: "lambda:InvokeFunction",
+        principal: new iam.ServicePrincipal("sns.amazonaws.com"),
+        sourceArn: this.alarmTopic.topicArn,
+      })
+
+      new sns.Subscription(this, "Subscription", {
+        endpoint: slackLambda.functionArn,
+        protocol: sns.SubscriptionProtocol.LAMBDA,
+        topic: this.alarmTopic,
+      })
+    }
   }
 }
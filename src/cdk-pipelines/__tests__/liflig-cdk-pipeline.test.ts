@@ -0,0 +1,93 @@
+import "@aws-cdk/assert/jest"
+import { App, Duration, Size, Stack, Stage } from "aws-cdk-lib"
+import { Bucket } from "aws-cdk-lib/aws-s3"
+import { LifligCdkPipeline } from "../liflig-cdk-pipeline"
+
+test("cdk-source pipeline with streaming transfer", () => {
+  const app = new App()
+  const stack = new Stack(app, "Stack")
+
+  const pipeline = new LifligCdkPipeline(stack, "Pipeline", {
+    artifactsBucket: new Bucket(stack, "ArtifactsBucket"),
+    pipelineName: "test-pipeline",
+    sourceType: "cdk-source",
+    cdkSourceTransfer: { streaming: true },
+  })
+  pipeline.cdkPipeline.addStage(new Stage(app, "Stage"))
+
+  expect(stack).toHaveResourceLike("AWS::Lambda::Function", {
+    Handler: "index.handler",
+    Timeout: 600,
+    // 256 MiB, 12 parts of 8 MiB and 10 blocks of 8 MiB read ahead is less
+    // than the minimum
+    MemorySize: 512,
+    Environment: {
+      Variables: {
+        STREAMING_TRANSFER: "true",
+      },
+    },
+  })
+})
+
+test("cdk-source pipeline with transfer timeout", () => {
+  const app = new App()
+  const stack = new Stack(app, "Stack")
+
+  const pipeline = new LifligCdkPipeline(stack, "Pipeline", {
+    artifactsBucket: new Bucket(stack, "ArtifactsBucket"),
+    pipelineName: "test-pipeline",
+    sourceType: "cdk-source",
+    cdkSourceTransfer: { streaming: true, timeout: Duration.minutes(15) },
+  })
+  pipeline.cdkPipeline.addStage(new Stage(app, "Stage"))
+
+  expect(stack).toHaveResourceLike("AWS::Lambda::Function", {
+    Handler: "index.handler",
+    Timeout: 900,
+  })
+})
+
+test("cdk-source pipeline with tuned transfer", () => {
+  const app = new App()
+  const stack = new Stack(app, "Stack")
+
+  const pipeline = new LifligCdkPipeline(stack, "Pipeline", {
+    artifactsBucket: new Bucket(stack, "ArtifactsBucket"),
+    pipelineName: "test-pipeline",
+    sourceType: "cdk-source",
+    cdkSourceTransfer: {
+      maxConcurrency: 16,
+      partSize: Size.mebibytes(32),
+      multipartThreshold: Size.mebibytes(64),
+    },
+  })
+  pipeline.cdkPipeline.addStage(new Stage(app, "Stage"))
+
+  expect(stack).toHaveResourceLike("AWS::Lambda::Function", {
+    Handler: "index.handler",
+    // 256 MiB and 18 parts of 32 MiB, rounded up to a multiple of 64 MiB
+    MemorySize: 832,
+    Environment: {
+      Variables: {
+        TRANSFER_MAX_CONCURRENCY: "16",
+        TRANSFER_PART_SIZE: String(32 * 1024 * 1024),
+        TRANSFER_MULTIPART_THRESHOLD: String(64 * 1024 * 1024),
+      },
+    },
+  })
+})
+
+test("cdk-source pipeline rejects too small parts", () => {
+  const app = new App()
+  const stack = new Stack(app, "Stack")
+
+  expect(
+    () =>
+      new LifligCdkPipeline(stack, "Pipeline", {
+        artifactsBucket: new Bucket(stack, "ArtifactsBucket"),
+        pipelineName: "test-pipeline",
+        sourceType: "cdk-source",
+        cdkSourceTransfer: { partSize: Size.mebibytes(1) },
+      }),
+  ).toThrow("partSize must be at least 5 MiB")
+})
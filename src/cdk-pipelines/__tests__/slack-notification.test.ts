@@ -1,9 +1,15 @@
 import "@aws-cdk/assert/jest"
-import { App, CfnOutput, Stack, Stage } from "aws-cdk-lib"
+import { App, CfnOutput, Duration, Stack, Stage } from "aws-cdk-lib"
+import * as cloudwatchActions from "aws-cdk-lib/aws-cloudwatch-actions"
+import * as dynamodb from "aws-cdk-lib/aws-dynamodb"
 import { Bucket } from "aws-cdk-lib/aws-s3"
 import * as secretsmanager from "aws-cdk-lib/aws-secretsmanager"
+import * as sns from "aws-cdk-lib/aws-sns"
 import { LifligCdkPipeline } from "../liflig-cdk-pipeline"
-import { SlackNotification } from "../slack-notification"
+import {
+  SlackNotification,
+  SlackNotificationDigest,
+} from "../slack-notification"
 
 test("slack-notification", () => {
   const app = new App({
@@ -79,3 +85,123 @@ test("slack-notification", () => {
     },
   })
 })
+
+test("slack-notification with digest", () => {
+  const app = new App()
+  const stack = new Stack(app, "Stack")
+
+  const secret = new secretsmanager.Secret(stack, "TestSecret", {
+    secretName: "TestSecret",
+  })
+  const artifactsBucket = new Bucket(stack, "ArtifactsBucket")
+  const digest = new SlackNotificationDigest(stack, "Digest", {
+    window: Duration.minutes(3),
+  })
+
+  for (const name of ["a", "b"]) {
+    const pipeline = new LifligCdkPipeline(stack, `Pipeline${name}`, {
+      artifactsBucket,
+      pipelineName: `test-pipeline-${name}`,
+      sourceType: "cloud-assembly",
+    })
+    pipeline.cdkPipeline.addStage(new Stage(app, `Stage${name}`))
+    pipeline.addSlackNotification({
+      slackWebhookUrlSecret: secret,
+      digest,
+    })
+  }
+
+  expect(stack).toCountResources("AWS::Lambda::Function", 1)
+  expect(stack).toHaveResourceLike("AWS::Lambda::EventSourceMapping", {
+    BatchSize: 100,
+    MaximumBatchingWindowInSeconds: 180,
+    FunctionResponseTypes: ["ReportBatchItemFailures"],
+  })
+  expect(stack).toHaveResourceLike("AWS::Events::Rule", {
+    Targets: [
+      {
+        Arn: stack.resolve(digest.queue.queueArn),
+      },
+    ],
+  })
+  expect(stack).toHaveResourceLike("AWS::SQS::Queue", {
+    VisibilityTimeout: 6 * 60 + 180,
+    RedrivePolicy: {
+      maxReceiveCount: 5,
+    },
+  })
+  expect(stack).toCountResources("AWS::SQS::Queue", 2)
+})
+
+test("slack-notification digest with infrastructure alarm", () => {
+  const app = new App()
+  const stack = new Stack(app, "Stack")
+  const topic = new sns.Topic(stack, "Topic")
+
+  const digest = new SlackNotificationDigest(stack, "Digest", {
+    infrastructureAlarmAction: new cloudwatchActions.SnsAction(topic),
+  })
+
+  expect(stack).toHaveResourceLike("AWS::CloudWatch::Alarm", {
+    Namespace: "AWS/SQS",
+    MetricName: "ApproximateNumberOfMessagesVisible",
+    Dimensions: [
+      {
+        Name: "QueueName",
+        Value: stack.resolve(digest.deadLetterQueue.queueName),
+      },
+    ],
+  })
+  expect(stack).toHaveResourceLike("AWS::CloudWatch::Alarm", {
+    Namespace: "AWS/Lambda",
+    MetricName: "Errors",
+    Dimensions: [
+      {
+        Name: "FunctionName",
+        Value: stack.resolve(digest.function.functionName),
+      },
+    ],
+  })
+})
+
+test("slack-notification digest window is at most 5 minutes", () => {
+  const app = new App()
+  const stack = new Stack(app, "Stack")
+
+  expect(
+    () =>
+      new SlackNotificationDigest(stack, "Digest", {
+        window: Duration.minutes(6),
+      }),
+  ).toThrow(/at most 5 minutes/)
+})
+
+test("slack-notification with state table", () => {
+  const app = new App()
+  const stack = new Stack(app, "Stack")
+
+  const secret = new secretsmanager.Secret(stack, "TestSecret", {
+    secretName: "TestSecret",
+  })
+  const table = new dynamodb.Table(stack, "StateTable", {
+    partitionKey: { name: "pk", type: dynamodb.AttributeType.STRING },
+  })
+  const pipeline = new LifligCdkPipeline(stack, "Pipeline", {
+    artifactsBucket: new Bucket(stack, "ArtifactsBucket"),
+    pipelineName: "test-pipeline",
+    sourceType: "cloud-assembly",
+  })
+  pipeline.cdkPipeline.addStage(new Stage(app, "Stage"))
+  pipeline.addSlackNotification({
+    slackWebhookUrlSecret: secret,
+    stateTable: table,
+  })
+
+  expect(stack).toHaveResourceLike("AWS::Lambda::Function", {
+    Environment: {
+      Variables: {
+        STATE_STORE: stack.resolve(`dynamodb:${table.tableName}`),
+      },
+    },
+  })
+})
@@ -1,5 +1,15 @@
-export type { LifligCdkPipelineProps } from "./liflig-cdk-pipeline"
+export type {
+  CdkSourceTransferOptions,
+  LifligCdkPipelineProps,
+} from "./liflig-cdk-pipeline"
 export { LifligCdkPipeline } from "./liflig-cdk-pipeline"
-export type { SlackNotificationProps } from "./slack-notification"
-export { SlackMention, SlackNotification } from "./slack-notification"
+export type {
+  SlackNotificationDigestProps,
+  SlackNotificationProps,
+} from "./slack-notification"
+export {
+  SlackMention,
+  SlackNotification,
+  SlackNotificationDigest,
+} from "./slack-notification"
 export { getVariable } from "./variables"
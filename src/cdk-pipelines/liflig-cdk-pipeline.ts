@@ -63,6 +63,121 @@ export interface LifligCdkPipelineProps {
    * @default default
    */
   parametersNamespace?: string
+  /**
+   * How the CDK source is transferred when preparing it for the build.
+   *
+   * Only relevant for sourceType of "cdk-source".
+   *
+   * @default - the CDK source is staged in the ephemeral storage of the Lambda function.
+   */
+  cdkSourceTransfer?: CdkSourceTransferOptions
+}
+
+export interface CdkSourceTransferOptions {
+  /**
+   * Read the CDK source from S3 and write the prepared source back to S3
+   * as streams, instead of staging them in the ephemeral storage of the
+   * Lambda function. Memory use is then bounded by the transfer part
+   * sizes, which allows CDK sources larger than the ephemeral storage.
+   *
+   * @default false
+   */
+  streaming?: boolean
+  /**
+   * The number of parts downloaded or uploaded in parallel.
+   *
+   * @default 10
+   */
+  maxConcurrency?: number
+  /**
+   * The size of the parts of multipart transfers. At least 5 MiB.
+   *
+   * @default cdk.Size.mebibytes(8)
+   */
+  partSize?: cdk.Size
+  /**
+   * Objects smaller than this are transferred in a single request
+   * instead of in parts.
+   *
+   * @default cdk.Size.mebibytes(8)
+   */
+  multipartThreshold?: cdk.Size
+  /**
+   * The memory of the Lambda function preparing the CDK source.
+   *
+   * @default - enough for the parts transferred in parallel, and at least 512 MiB.
+   */
+  memorySize?: number
+  /**
+   * The timeout of the Lambda function preparing the CDK source.
+   *
+   * @default - 10 minutes when streaming, as the sources that need it are
+   * large, otherwise 1 minute.
+   */
+  timeout?: cdk.Duration
+}
+
+/**
+ * Environment of the Lambda function preparing the CDK source for the
+ * given transfer options, and the memory it needs.
+ */
+function cdkSourceTransferSettings(transfer: CdkSourceTransferOptions): {
+  environment: Record<string, string>
+  memorySize: number
+  timeout: cdk.Duration
+} {
+  const maxConcurrency = transfer.maxConcurrency ?? 10
+  const partSize = transfer.partSize ?? cdk.Size.mebibytes(8)
+  const partSizeMebibytes = partSize.toMebibytes({
+    rounding: cdk.SizeRoundingBehavior.NONE,
+  })
+
+  if (!Number.isInteger(maxConcurrency) || maxConcurrency < 1) {
+    throw new Error(
+      `maxConcurrency must be a positive integer, got ${maxConcurrency}`,
+    )
+  }
+  if (partSizeMebibytes < 5) {
+    throw new Error(`partSize must be at least 5 MiB, got ${partSizeMebibytes}`)
+  }
+
+  const environment: Record<string, string> = {}
+  if (transfer.streaming) {
+    environment.STREAMING_TRANSFER = "true"
+  }
+  if (transfer.maxConcurrency != null) {
+    environment.TRANSFER_MAX_CONCURRENCY = String(maxConcurrency)
+  }
+  if (transfer.partSize != null) {
+    environment.TRANSFER_PART_SIZE = String(partSize.toBytes())
+  }
+  if (transfer.multipartThreshold != null) {
+    environment.TRANSFER_MULTIPART_THRESHOLD = String(
+      transfer.multipartThreshold.toBytes(),
+    )
+  }
+
+  // The parts in flight, one more being buffered, and the block being read,
+  // as well as the blocks read ahead when streaming, on top of the runtime
+  // itself
+  const readAheadBlocks =
+    transfer.streaming && maxConcurrency > 1 ? maxConcurrency : 0
+  const neededMebibytes =
+    256 + partSizeMebibytes * (maxConcurrency + 2 + readAheadBlocks)
+  const memorySize =
+    transfer.memorySize ??
+    Math.min(10240, Math.max(512, Math.ceil(neededMebibytes / 64) * 64))
+
+  const timeout =
+    transfer.timeout ??
+    (transfer.streaming ? cdk.Duration.minutes(10) : cdk.Duration.minutes(1))
+  if (timeout.toSeconds() > 900) {
+    throw new Error(
+      `timeout must be at most 15 minutes, got ${timeout.toHumanString()}`,
+    )
+  }
+
+  return { environment, memorySize, timeout }
 }
 
 /**
@@ -158,6 +273,7 @@ export class LifligCdkPipeline extends constructs.Construct {
           this.artifactsBucket,
           props.pipelineName,
           props.parametersNamespace ?? "default",
+          props.cdkSourceTransfer ?? {},
         )
         synth = cdkSource.synth
         stages = cdkSource.stages
@@ -282,7 +398,10 @@ export class LifligCdkPipeline extends constructs.Construct {
     cdkBucket: s3.IBucket,
     pipelineName: string,
     parametersNamespace: string,
+    transfer: CdkSourceTransferOptions,
   ): { stages: codepipeline.StageProps[]; synth: pipelines.IFileSetProducer } {
+    const transferSettings = cdkSourceTransferSettings(transfer)
+
     const prepareCdkSourceFn = new lambda.Function(this, "PrepareCdkSourceFn", {
       code: lambda.Code.fromAsset(
         path.join(__dirname, "../../assets/prepare-cdk-source-lambda"),
@@ -290,10 +409,14 @@ export class LifligCdkPipeline extends constructs.Construct {
       handler: "index.handler",
       // Using python instead if NodeJS due to zip-support in stdlib.
       runtime: lambda.Runtime.PYTHON_3_13,
-      timeout: cdk.Duration.minutes(1),
-      memorySize: 512,
+      timeout: transferSettings.timeout,
+      memorySize: transferSettings.memorySize,
     })
 
+    for (const [name, value] of Object.entries(transferSettings.environment)) {
+      prepareCdkSourceFn.addEnvironment(name, value)
+    }
+
     const account = cdk.Stack.of(this).account
     const region = cdk.Stack.of(this).region
 
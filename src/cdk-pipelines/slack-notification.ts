@@ -1,12 +1,17 @@
 import * as path from "node:path"
 import { fileURLToPath } from "node:url"
 import * as cdk from "aws-cdk-lib"
+import * as cloudwatch from "aws-cdk-lib/aws-cloudwatch"
 import type * as codepipeline from "aws-cdk-lib/aws-codepipeline"
+import type * as dynamodb from "aws-cdk-lib/aws-dynamodb"
+import * as events from "aws-cdk-lib/aws-events"
 import * as eventsTargets from "aws-cdk-lib/aws-events-targets"
 import * as iam from "aws-cdk-lib/aws-iam"
 import * as lambda from "aws-cdk-lib/aws-lambda"
+import * as sources from "aws-cdk-lib/aws-lambda-event-sources"
 import type * as s3 from "aws-cdk-lib/aws-s3"
 import type * as secretsmanager from "aws-cdk-lib/aws-secretsmanager"
+import * as sqs from "aws-cdk-lib/aws-sqs"
 import * as constructs from "constructs"
 
 const __filename = fileURLToPath(import.meta.url)
@@ -57,8 +62,34 @@ export interface SlackNotificationProps {
    * @default - none
    */
   mentions?: string[]
+  /**
+   * Buffer the events of the pipeline in a shared digest instead of
+   * notifying about each of them right away. Pipelines that fail the same
+   * way within the digest window are then reported in a single message.
+   *
+   * @default - events are notified one by one
+   */
+  digest?: SlackNotificationDigest
+  /**
+   * A DynamoDB table used to persist the recent succeeded and failed
+   * executions of each pipeline, so that the status of the previous
+   * execution can usually be known without listing the executions of the
+   * pipeline.
+   *
+   * The table must have a partition key named `pk` of type string.
+   *
+   * Cannot be used together with `digest`, set it on the digest instead.
+   *
+   * @default - the executions are kept in the memory of the Lambda function.
+   */
+  stateTable?: dynamodb.ITable
 }
 
+const assetPath = path.join(
+  __dirname,
+  "../../assets/pipeline-slack-notification-lambda",
+)
+
 /**
  * Monitor a CodePipeline and send message to Slack on failure
  * and some succeeded events.
@@ -71,6 +102,12 @@ export class SlackNotification extends constructs.Construct {
   ) {
     super(scope, id)
 
+    if (props.digest != null && props.stateTable != null) {
+      throw new Error(
+        "stateTable cannot be used with digest, set it on the digest instead",
+      )
+    }
+
     const environment: Record<string, string> = {
       SLACK_URL_SECRET_NAME: props.slackWebhookUrlSecret.secretName,
       NOTIFICATION_LEVEL: props.notificationLevel ?? "WARN",
@@ -84,17 +121,21 @@ export class SlackNotification extends constructs.Construct {
       environment.SLACK_MENTIONS = SlackMention.format(props.mentions)
     }
 
-    const reportFunction = new lambda.Function(this, "Function", {
-      code: lambda.Code.fromAsset(
-        path.join(__dirname, "../../assets/pipeline-slack-notification-lambda"),
-      ),
-      handler: "index.handler",
-      runtime: lambda.Runtime.PYTHON_3_13,
-      timeout: cdk.Duration.seconds(10),
-      environment,
-      description:
-        "Handle CodePipeline pipeline state change and report to Slack",
-    })
+    if (props.stateTable != null) {
+      environment.STATE_STORE = `dynamodb:${props.stateTable.tableName}`
+    }
+
+    const reportFunction =
+      props.digest?.function ??
+      new lambda.Function(this, "Function", {
+        code: lambda.Code.fromAsset(assetPath),
+        handler: "index.handler",
+        runtime: lambda.Runtime.PYTHON_3_13,
+        timeout: cdk.Duration.seconds(10),
+        environment,
+        description:
+          "Handle CodePipeline pipeline state change and report to Slack",
+      })
 
     reportFunction.grantPrincipal.addToPrincipalPolicy(
       new iam.PolicyStatement({
@@ -108,6 +149,8 @@ export class SlackNotification extends constructs.Construct {
 
     props.slackWebhookUrlSecret.grantRead(reportFunction)
 
+    props.stateTable?.grantReadWriteData(reportFunction)
+
     props.artifactsBucket.grantRead(reportFunction, props.triggerObjectKey)
 
     props.pipeline.onStateChange(`Event${id}`, {
@@ -117,11 +160,171 @@ export class SlackNotification extends constructs.Construct {
           state: ["SUCCEEDED", "FAILED", "STARTED", "SUPERSEDED"],
         },
       },
-      target: new eventsTargets.LambdaFunction(reportFunction),
+      target:
+        props.digest == null
+          ? new eventsTargets.LambdaFunction(reportFunction)
+          : new eventsTargets.SqsQueue(props.digest.queue, {
+              // The digest is shared between pipelines, so the settings
+              // of each pipeline are sent along with its events
+              message: events.RuleTargetInput.fromObject({
+                event: {
+                  "detail-type": events.EventField.detailType,
+                  region: events.EventField.region,
+                  account: events.EventField.account,
+                  time: events.EventField.time,
+                  detail: events.EventField.fromPath("$.detail"),
+                },
+                settings: {
+                  slackUrlSecretName: environment.SLACK_URL_SECRET_NAME,
+                  notificationLevel: environment.NOTIFICATION_LEVEL,
+                  accountFriendlyName: environment.ACCOUNT_FRIENDLY_NAME,
+                  slackMentions: environment.SLACK_MENTIONS,
+                },
+              }),
+            }),
     })
   }
 }
 
+export interface SlackNotificationDigestProps {
+  /**
+   * How long events are buffered before being notified. Pipelines that fail
+   * the same way within the window are reported in a single message.
+   *
+   * At most 5 minutes.
+   *
+   * @default cdk.Duration.minutes(2)
+   */
+  window?: cdk.Duration
+  /**
+   * A DynamoDB table used to persist the recent succeeded and failed
+   * executions of each pipeline, so that the status of the previous
+   * execution can usually be known without listing the executions of the
+   * pipeline.
+   *
+   * The table must have a partition key named `pk` of type string.
+   *
+   * @default - the executions are kept in the memory of the Lambda function.
+   */
+  stateTable?: dynamodb.ITable
+  /**
+   * If supplied, CloudWatch alarms will be created for errors in the Lambda
+   * function and for events that could not be notified after repeated
+   * attempts (e.g., because of an invalid Slack webhook URL), and the action
+   * will be used to notify on OK and ALARM actions.
+   *
+   * @default - no alarm
+   */
+  infrastructureAlarmAction?: cloudwatch.IAlarmAction
+}
+
+/**
+ * Buffer pipeline events for the Slack notifications of several pipelines,
+ * so that pipelines that fail the same way at about the same time (e.g.
+ * because of a broken shared dependency) are reported in a single message
+ * listing the affected pipelines.
+ *
+ * Use with the `digest` property of {@link SlackNotification}.
+ */
+export class SlackNotificationDigest extends constructs.Construct {
+  readonly queue: sqs.Queue
+  readonly deadLetterQueue: sqs.Queue
+  readonly function: lambda.Function
+
+  constructor(
+    scope: constructs.Construct,
+    id: string,
+    props: SlackNotificationDigestProps = {},
+  ) {
+    super(scope, id)
+
+    const window = props.window ?? cdk.Duration.minutes(2)
+    if (window.toSeconds() > 300) {
+      throw new Error("window of the digest must be at most 5 minutes")
+    }
+
+    this.function = new lambda.Function(this, "Function", {
+      code: lambda.Code.fromAsset(assetPath),
+      handler: "index.handler",
+      runtime: lambda.Runtime.PYTHON_3_13,
+      timeout: cdk.Duration.minutes(1),
+      description:
+        "Handle buffered CodePipeline pipeline state changes and report to Slack",
+    })
+
+    if (props.stateTable != null) {
+      this.function.addEnvironment(
+        "STATE_STORE",
+        `dynamodb:${props.stateTable.tableName}`,
+      )
+      props.stateTable.grantReadWriteData(this.function)
+    }
+
+    // Events that keep failing to be notified are kept for inspection
+    // instead of being retried until they expire
+    this.deadLetterQueue = new sqs.Queue(this, "DeadLetterQueue", {
+      retentionPeriod: cdk.Duration.days(14),
+      enforceSSL: true,
+    })
+
+    this.queue = new sqs.Queue(this, "Queue", {
+      // AWS recommends at least 6 times the function timeout, plus the
+      // batching window
+      visibilityTimeout: cdk.Duration.seconds(
+        6 * (this.function.timeout ?? cdk.Duration.seconds(3)).toSeconds() +
+          window.toSeconds(),
+      ),
+      enforceSSL: true,
+      deadLetterQueue: {
+        queue: this.deadLetterQueue,
+        maxReceiveCount: 5,
+      },
+    })
+
+    if (props.infrastructureAlarmAction) {
+      const deadLetterQueueAlarm = this.deadLetterQueue
+        .metricApproximateNumberOfMessagesVisible({
+          period: cdk.Duration.minutes(5),
+          statistic: cloudwatch.Statistic.MAXIMUM,
+        })
+        .createAlarm(this, "DeadLetterQueueAlarm", {
+          threshold: 1,
+          alarmDescription:
+            "Triggers if CodePipeline pipeline state changes could not be notified to Slack after repeated attempts and were moved to the dead-letter queue",
+          evaluationPeriods: 1,
+          datapointsToAlarm: 1,
+          treatMissingData: cloudwatch.TreatMissingData.IGNORE,
+        })
+      deadLetterQueueAlarm.addOkAction(props.infrastructureAlarmAction)
+      deadLetterQueueAlarm.addAlarmAction(props.infrastructureAlarmAction)
+
+      const errorAlarm = this.function
+        .metricErrors({
+          period: cdk.Duration.minutes(5),
+          statistic: cloudwatch.Statistic.SUM,
+        })
+        .createAlarm(this, "ErrorAlarm", {
+          threshold: 1,
+          alarmDescription:
+            "Triggers if the Lambda function that reports buffered CodePipeline pipeline state changes to Slack fails",
+          evaluationPeriods: 1,
+          datapointsToAlarm: 1,
+          treatMissingData: cloudwatch.TreatMissingData.IGNORE,
+        })
+      errorAlarm.addOkAction(props.infrastructureAlarmAction)
+      errorAlarm.addAlarmAction(props.infrastructureAlarmAction)
+    }
+
+    this.function.addEventSource(
+      new sources.SqsEventSource(this.queue, {
+        batchSize: 100,
+        maxBatchingWindow: window,
+        reportBatchItemFailures: true,
+      }),
+    )
+  }
+}
+
 /**
  * Slack mention formatter with validation per Slack API format:
  * https://docs.slack.dev/messaging/formatting-message-text/
@@ -14,6 +14,60 @@ import * as constructs from "constructs"
 const __filename = fileURLToPath(import.meta.url)
 const __dirname = path.dirname(__filename)
 
+/**
+ * A rule matching CloudTrail events that are expected, e.g., a break-glass role
+ * assumed by a CI principal. An event matches the rule if it matches all of the
+ * conditions that are set, and a condition matches if any of its values match.
+ */
+export interface CloudTrailSlackIntegrationSuppressionRule {
+  /**
+   * Glob patterns (using `*` and `?`) to match against the ARN of the principal that made the API call.
+   */
+  principalArns?: string[]
+  /**
+   * CIDR ranges to match against the source IP of the API call.
+   */
+  sourceIpCidrs?: string[]
+  /**
+   * Names of the API calls to match (e.g., `AssumeRole`).
+   */
+  eventNames?: string[]
+  /**
+   * IDs of the AWS accounts receiving the API call.
+   */
+  accountIds?: string[]
+  /**
+   * Whether to drop matching events, or to send them as informational messages.
+   *
+   * @default "DROP"
+   */
+  action?: "DROP" | "DOWNGRADE"
+}
+
+/**
+ * A Slack destination for CloudTrail events matching all of the conditions that
+ * are set. A condition matches if any of its values match.
+ */
+export interface CloudTrailSlackIntegrationRoute {
+  /**
+   * IDs of the AWS accounts receiving the API call.
+   */
+  accountIds?: string[]
+  /**
+   * Names of the API calls to route (e.g., `ConsoleLogin`).
+   */
+  eventNames?: string[]
+  /**
+   * Types of principals making the API call (e.g., `Root`, `IAMUser`, `AssumedRole`).
+   */
+  principalTypes?: string[]
+  slackChannel: string
+  /**
+   * @default - the `slackWebhookUrl` of the construct
+   */
+  slackWebhookUrl?: string
+}
+
 export interface CloudTrailSlackIntegrationProps extends cdk.StackProps {
   /**
    * A key-value pair of values to augment (e.g., AWS account IDs, principal IDs) with friendly names
@@ -43,10 +97,46 @@ export interface CloudTrailSlackIntegrationProps extends cdk.StackProps {
    * @default false
    */
   deduplicateEvents?: boolean
+  /**
+   * Whether to merge deduplicated events that are received in the same batch and are destined
+   * for the same webhook and channel into a single Slack message with multiple attachments.
+   * Reduces the number of calls to Slack during bursts of events. Only used if `deduplicateEvents` is enabled.
+   *
+   * @default false
+   */
+  coalesceMessages?: boolean
   /**
    * If supplied, CloudWatch alarms will be created for the construct's underlying infrastructure (e.g., Lambda functions) and the action will be used to notify on OK and ALARM actions.
    */
   infrastructureAlarmAction?: cloudwatch.IAlarmAction
+  /**
+   * Whether to look up the names of all accounts in the AWS Organization and use them as
+   * friendly names for accounts not present in `friendlyNames`. The accounts are loaded in bulk
+   * and cached by the Lambda function.
+   *
+   * NOTE: Listing the accounts of an organization is only allowed from the management account
+   * or a delegated administrator account.
+   *
+   * @default false
+   */
+  lookUpOrganizationAccountNames?: boolean
+  /**
+   * Rules for events that are expected and should be dropped or downgraded before
+   * being sent to Slack. The first matching rule is used.
+   *
+   * @default - no events are suppressed
+   */
+  suppressionRules?: CloudTrailSlackIntegrationSuppressionRule[]
+  /**
+   * Routes for sending events to other channels or webhooks based on the account, API call or
+   * principal type. An event is sent to all matching routes, and to `slackChannel` if no route matches.
+   *
+   * NOTE: Routes to more than one distinct webhook and channel require `deduplicateEvents`, as
+   * events are otherwise posted again to every matching route when a post to one of them fails.
+   *
+   * @default - all events are sent to `slackChannel`
+   */
+  routes?: CloudTrailSlackIntegrationRoute[]
 }
 
 /**
@@ -64,6 +154,20 @@ export class CloudTrailSlackIntegration extends constructs.Construct {
   ) {
     super(scope, id)
 
+    const routeDestinations = new Set(
+      (props.routes ?? []).map((route) =>
+        JSON.stringify([
+          route.slackWebhookUrl ?? props.slackWebhookUrl,
+          route.slackChannel,
+        ]),
+      ),
+    )
+    if (routeDestinations.size > 1 && !props.deduplicateEvents) {
+      throw new Error(
+        "Routes to more than one Slack webhook and channel require deduplicateEvents to be enabled",
+      )
+    }
+
     const eventTransformer = new lambda.Function(
       this,
       "EventTransformerLambda",
@@ -96,6 +200,35 @@ export class CloudTrailSlackIntegration extends constructs.Construct {
         resources: ["*"],
       }),
     )
+    if (props.suppressionRules && props.suppressionRules.length > 0) {
+      eventTransformer.addEnvironment(
+        "SUPPRESSION_RULES",
+        JSON.stringify(props.suppressionRules),
+      )
+    }
+    if (props.routes && props.routes.length > 0) {
+      eventTransformer.addEnvironment(
+        "SLACK_ROUTES",
+        JSON.stringify(
+          props.routes.map((route) => ({
+            ...route,
+            slackWebhookUrl: route.slackWebhookUrl ?? props.slackWebhookUrl,
+          })),
+        ),
+      )
+    }
+    if (props.lookUpOrganizationAccountNames) {
+      eventTransformer.addEnvironment(
+        "ACCOUNT_DIRECTORY_SOURCE",
+        "organizations",
+      )
+      eventTransformer.addToRolePolicy(
+        new iam.PolicyStatement({
+          actions: ["organizations:ListAccounts"],
+          resources: ["*"],
+        }),
+      )
+    }
     if (props.infrastructureAlarmAction) {
       const eventTransformerAlarm = eventTransformer
         .metricErrors({
@@ -114,12 +247,24 @@ export class CloudTrailSlackIntegration extends constructs.Construct {
       eventTransformerAlarm.addAlarmAction(props.infrastructureAlarmAction)
     }
     if (props.deduplicateEvents) {
+      // Events that keep failing to be posted (e.g., due to an invalid Slack
+      // webhook URL) are kept for inspection instead of being retried until
+      // they expire
+      const deadLetterQueue = new sqs.Queue(this, "DeadLetterQueue", {
+        queueName: `${this.node.id.substring(0, 29)}${this.node.addr}-dlq.fifo`,
+        fifo: true,
+        retentionPeriod: cdk.Duration.days(14),
+      })
       const deduplicationQueue = new sqs.Queue(this, "Queue", {
         // We explicitly give the queue a name due to bug https://github.com/aws/aws-cdk/issues/5860
         queueName:
           `${this.node.id.substring(0, 33)}${this.node.addr}`.substring(0, 75) +
           ".fifo",
         fifo: true,
+        deadLetterQueue: {
+          queue: deadLetterQueue,
+          maxReceiveCount: 5,
+        },
       })
       eventTransformer.addEnvironment(
         "SQS_QUEUE_URL",
@@ -142,6 +287,9 @@ export class CloudTrailSlackIntegration extends constructs.Construct {
           retention: logs.RetentionDays.TWO_WEEKS,
         }),
       })
+      if (props.coalesceMessages) {
+        slackForwarder.addEnvironment("SLACK_FORWARDER_COALESCE", "true")
+      }
 
       if (props.infrastructureAlarmAction) {
         const slackForwarderAlarm = slackForwarder
@@ -159,9 +307,27 @@ export class CloudTrailSlackIntegration extends constructs.Construct {
           })
         slackForwarderAlarm.addOkAction(props.infrastructureAlarmAction)
         slackForwarderAlarm.addAlarmAction(props.infrastructureAlarmAction)
+
+        const deadLetterQueueAlarm = deadLetterQueue
+          .metricApproximateNumberOfMessagesVisible({
+            period: cdk.Duration.minutes(5),
+            statistic: cloudwatch.Statistic.MAXIMUM,
+          })
+          .createAlarm(this, "DeadLetterQueueAlarm", {
+            threshold: 1,
+            alarmDescription:
+              "Triggers if deduplicated CloudTrail API calls could not be posted to Slack after repeated attempts and were moved to the dead-letter queue",
+            evaluationPeriods: 1,
+            datapointsToAlarm: 1,
+            treatMissingData: cloudwatch.TreatMissingData.IGNORE,
+          })
+        deadLetterQueueAlarm.addOkAction(props.infrastructureAlarmAction)
+        deadLetterQueueAlarm.addAlarmAction(props.infrastructureAlarmAction)
       }
       slackForwarder.addEventSource(
-        new sources.SqsEventSource(deduplicationQueue),
+        new sources.SqsEventSource(deduplicationQueue, {
+          reportBatchItemFailures: true,
+        }),
       )
     }
 
@@ -1,2 +1,6 @@
-export type { CloudTrailSlackIntegrationProps } from "./cloudtrail-slack-integration"
+export type {
+  CloudTrailSlackIntegrationProps,
+  CloudTrailSlackIntegrationRoute,
+  CloudTrailSlackIntegrationSuppressionRule,
+} from "./cloudtrail-slack-integration"
 export { CloudTrailSlackIntegration } from "./cloudtrail-slack-integration"